@@ -0,0 +1,76 @@
+"""Fixtures of the benchmarks, run them with pytest-benchmark::
+
+    python -m pytest benchmarks --benchmark-autosave
+    python -m pytest benchmarks --benchmark-compare \
+        --benchmark-compare-fail=mean:20%
+
+The first command records a baseline in .benchmarks, the second one fails
+when a benchmark is 20% slower than the last baseline. Timings depend on
+the machine, so baselines are not committed: record one on the base commit
+(make bench), then compare the change against it on the same machine (make
+bench-compare). The 100k rows samples files are only benchmarked with
+--bench-large.
+"""
+
+import os
+
+import pytest
+
+from biominer_app_util import cli
+import synthetic
+
+SAMPLE_ROWS = [10, 1000, pytest.param(100000, marks=pytest.mark.large)]
+
+
+def pytest_addoption(parser):
+    parser.addoption('--bench-large', action='store_true',
+                     help='Also benchmark the samples files with 100k rows.')
+
+
+def pytest_configure(config):
+    config.addinivalue_line('markers', 'large: a benchmark with 100k rows.')
+
+
+def pytest_collection_modifyitems(config, items):
+    if config.getoption('--bench-large'):
+        return
+    skip_large = pytest.mark.skip(reason='needs --bench-large')
+    for item in items:
+        if 'large' in item.keywords:
+            item.add_marker(skip_large)
+
+
+@pytest.fixture(scope='session')
+def bench_dir(tmp_path_factory):
+    return str(tmp_path_factory.mktemp('bench'))
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(bench_dir, monkeypatch):
+    """Keep the caches of the benchmarks out of the cache of the user."""
+    cache_dir = os.path.join(bench_dir, 'cache')
+    monkeypatch.setattr(cli, 'DEFAULT_CACHE_DIR', cache_dir)
+    return cache_dir
+
+
+@pytest.fixture(scope='session')
+def app_dir(bench_dir):
+    """An app with 10 task WDL files, 20 variables and 10 defaults."""
+    app_dir = os.path.join(bench_dir, 'apps', 'bench')
+    synthetic.make_app(app_dir)
+    return app_dir
+
+
+@pytest.fixture(scope='session')
+def samples_files(bench_dir):
+    """Make a samples file of the app with n rows once."""
+    files = dict()
+
+    def get(n_rows):
+        if n_rows not in files:
+            path = os.path.join(bench_dir, 'samples-%d.csv' % n_rows)
+            synthetic.make_samples(path, n_rows, synthetic.sample_columns())
+            files[n_rows] = path
+        return files[n_rows]
+
+    return get
@@ -0,0 +1,96 @@
+"""Generators of synthetic apps and samples files for the benchmarks.
+
+An app has n_vars variables in its inputs and workflow.wdl, the first
+n_defaults of them have values in the defaults file and the others come
+from the samples file, see sample_columns.
+"""
+
+import os
+import csv
+import json
+import zipfile
+
+
+def make_app(app_dir, n_tasks=10, n_vars=20, n_defaults=10, task_lines=20):
+    """Create an app with n_tasks task WDL files under app_dir.
+
+    :param n_vars: The number of variables, the size of the templates.
+    :param n_defaults: The number of values in the defaults file.
+    :param task_lines: The number of command lines of a task WDL file.
+    :return: The defaults.
+    """
+    os.makedirs(os.path.join(app_dir, 'tasks'))
+    keys = ['var_%d' % i for i in range(n_vars)]
+    inputs = ',\n'.join('  "wf.%s": "{{ %s }}"' % (key, key) for key in keys)
+    with open(os.path.join(app_dir, 'inputs'), 'w') as f:
+        f.write('{\n  "wf.sample_id": "{{ sample_id }}",\n%s\n}\n' % inputs)
+
+    imports = '\n'.join('import "tasks/task_%d.wdl" as t%d' % (i, i)
+                        for i in range(n_tasks))
+    calls = '\n'.join('  call t%d.task_%d { input: value = "{{ %s }}" }' %
+                      (i, i, keys[i % n_vars]) for i in range(n_tasks))
+    with open(os.path.join(app_dir, 'workflow.wdl'), 'w') as f:
+        f.write('%s\n\nworkflow {{ project_name }} {\n%s\n}\n' %
+                (imports, calls))
+
+    command = '\n'.join('    echo "step %d" ${value}' % i
+                        for i in range(task_lines))
+    for i in range(n_tasks):
+        task_path = os.path.join(app_dir, 'tasks', 'task_%d.wdl' % i)
+        with open(task_path, 'w') as f:
+            f.write('task task_%d {\n  String value\n  command {\n%s\n  }\n'
+                    '}\n' % (i, command))
+
+    # Defaults beyond the variables are never used, like a shared defaults
+    # file.
+    defaults = dict((keys[i] if i < n_vars else 'unused_%d' % i,
+                     'default-%d' % i) for i in range(n_defaults))
+    with open(os.path.join(app_dir, 'defaults'), 'w') as f:
+        json.dump(defaults, f)
+    return defaults
+
+
+def sample_columns(n_vars=20, n_defaults=10):
+    """The columns of a samples file of an app made by make_app."""
+    return ['sample_id'] + ['var_%d' % i for i in range(n_defaults, n_vars)]
+
+
+def make_samples(path, n_rows, columns):
+    """Write a CSV samples file with n_rows samples."""
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(columns)
+        for row in range(n_rows):
+            writer.writerow(['S%d' % row] +
+                            ['/data/S%d/%s.fq.gz' % (row, column)
+                             for column in columns[1:]])
+
+
+def make_app_root(root_dir, n_apps, namespaces=4, **options):
+    """Create n_apps apps, half of them in namespace directories.
+
+    See listapps.
+    """
+    for i in range(n_apps):
+        if i % 2:
+            app_dir = os.path.join(root_dir, 'ns_%d' % (i % namespaces),
+                                   'app_%d-v1.0' % i)
+        else:
+            app_dir = os.path.join(root_dir, 'app_%d' % i)
+        make_app(app_dir, **options)
+
+
+def make_app_zip(path, **options):
+    """Create a zip file of an app which can be installed by install_app.
+
+    The name of the app is the name of the zip file, e.g. bench.zip.
+    """
+    app_name = os.path.splitext(os.path.basename(path))[0]
+    work_dir = '%s.d' % path
+    make_app(os.path.join(work_dir, app_name), **options)
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+        for root, dirs, files in os.walk(work_dir):
+            for filename in files:
+                filepath = os.path.join(root, filename)
+                zip_file.write(filepath, os.path.relpath(filepath, work_dir))
+    return path
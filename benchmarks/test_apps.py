@@ -0,0 +1,72 @@
+"""Benchmarks of listing, installing and zipping apps of different sizes."""
+
+import os
+import shutil
+
+import pytest
+
+from biominer_app_util import cli
+import synthetic
+
+
+@pytest.mark.benchmark(group='listapps')
+@pytest.mark.parametrize('n_apps', [10, 200])
+def test_listapps(benchmark, bench_dir, n_apps):
+    root_dir = os.path.join(bench_dir, 'listapps-%d' % n_apps)
+    synthetic.make_app_root(root_dir, n_apps, n_tasks=1)
+    apps = benchmark(cli.listapps, root_dir)
+    assert len(apps) == n_apps
+
+
+@pytest.mark.benchmark(group='install-app')
+@pytest.mark.parametrize('n_tasks', [10, 200])
+def test_install_app_zip(benchmark, bench_dir, n_tasks):
+    zip_dir = os.path.join(bench_dir, 'zips-%d' % n_tasks)
+    os.makedirs(zip_dir)
+    app_zip = synthetic.make_app_zip(os.path.join(zip_dir, 'bench.zip'),
+                                     n_tasks=n_tasks)
+    root_dir = os.path.join(bench_dir, 'install-%d' % n_tasks)
+
+    def setup():
+        shutil.rmtree(root_dir, ignore_errors=True)
+        os.makedirs(root_dir)
+
+    benchmark.pedantic(cli.install_app,
+                       args=(root_dir, app_zip, None, None, None, False),
+                       setup=setup, rounds=10)
+    assert cli.is_valid_app(os.path.join(root_dir, 'bench'))
+
+
+@pytest.mark.benchmark(group='dependencies-zip')
+@pytest.mark.parametrize('cached', [False, True], ids=['build', 'cached'])
+@pytest.mark.parametrize('n_tasks', [10, 200])
+def test_generate_dependencies_zip(benchmark, bench_dir, n_tasks, cached):
+    """Build the zip file of a tasks directory, or find it in the store."""
+    app_dir = os.path.join(bench_dir, 'zip-%d' % n_tasks)
+    if not os.path.isdir(app_dir):
+        synthetic.make_app(app_dir, n_tasks=n_tasks)
+    tasks_path = os.path.join(app_dir, 'tasks')
+    store_dir = os.path.join(bench_dir, 'zip-store-%d' % n_tasks)
+
+    def setup():
+        if not cached:
+            shutil.rmtree(store_dir, ignore_errors=True)
+
+    zip_output = benchmark.pedantic(
+        cli.generate_dependencies_zip, args=(tasks_path,),
+        kwargs={'cache_dir': store_dir}, setup=setup, rounds=10,
+        warmup_rounds=1 if cached else 0)
+    assert os.path.isfile(zip_output)
+
+
+@pytest.mark.benchmark(group='get-all-variables')
+@pytest.mark.parametrize('n_vars,n_defaults',
+                         [(20, 10), (500, 250), (500, 5000)],
+                         ids=['small', 'large-templates', 'large-defaults'])
+def test_get_all_variables(benchmark, bench_dir, n_vars, n_defaults):
+    app_dir = os.path.join(bench_dir, 'vars-%d-%d' % (n_vars, n_defaults))
+    if not os.path.isdir(app_dir):
+        synthetic.make_app(app_dir, n_tasks=1, n_vars=n_vars,
+                           n_defaults=n_defaults)
+    variables = benchmark(cli.get_all_variables, app_dir, no_default=True)
+    assert len(variables) == max(n_vars - n_defaults, 0) + 1
@@ -0,0 +1,81 @@
+"""Benchmarks of rendering samples files of 10, 1k and 100k rows."""
+
+import os
+import csv
+import tracemalloc
+
+import pytest
+from click.testing import CliRunner
+
+from biominer_app_util import cli
+from conftest import SAMPLE_ROWS
+
+
+def rounds(n_rows):
+    return 1 if n_rows >= 100000 else 3 if n_rows >= 1000 else 10
+
+
+@pytest.mark.benchmark(group='render')
+@pytest.mark.parametrize('n_rows', SAMPLE_ROWS)
+def test_render(benchmark, app_dir, samples_files, bench_dir, n_rows):
+    """The render command, the caches are warm after the first round."""
+    samples = samples_files(n_rows)
+    work_dir = os.path.join(bench_dir, 'projects')
+    os.makedirs(work_dir, exist_ok=True)
+    args = ['render', 'bench', samples, '-b', os.path.dirname(app_dir),
+            '-w', work_dir, '-p', 'render-%d' % n_rows, '--force',
+            '--link-mode', 'hardlink']
+
+    def render():
+        result = CliRunner().invoke(cli.main, args)
+        assert result.exit_code == 0, result.output
+
+    benchmark.pedantic(render, rounds=rounds(n_rows), iterations=1)
+
+
+@pytest.mark.benchmark(group='render-in-memory')
+@pytest.mark.parametrize('n_rows', SAMPLE_ROWS)
+def test_render_in_memory(benchmark, app_dir, samples_files, n_rows):
+    """Validate and render every sample without writing, see --preflight."""
+    samples = samples_files(n_rows)
+
+    def render():
+        errors = cli.preflight_samples(app_dir, 'bench',
+                                       cli.iter_samples(samples))
+        assert errors == []
+
+    benchmark.pedantic(render, rounds=rounds(n_rows), iterations=1)
+
+
+@pytest.mark.benchmark(group='parse-samples')
+@pytest.mark.parametrize('n_rows', SAMPLE_ROWS)
+def test_parse_samples(benchmark, samples_files, n_rows):
+    samples = samples_files(n_rows)
+    count = benchmark(lambda: sum(1 for _ in cli.iter_samples(samples)))
+    assert count == n_rows
+
+
+def parse_dicts(path):
+    """The samples as a list of dicts, as parse_samples kept them before."""
+    with open(path, 'rt', newline='') as f:
+        return list(csv.DictReader(f))
+
+
+@pytest.mark.benchmark(group='samples-memory')
+@pytest.mark.parametrize('n_rows', SAMPLE_ROWS)
+@pytest.mark.parametrize('parse', [parse_dicts, cli.parse_samples],
+                         ids=['dicts', 'table'])
+def test_samples_memory(benchmark, samples_files, parse, n_rows):
+    """Parse a samples file, the memory of the samples is in extra_info."""
+    samples = samples_files(n_rows)
+    tracemalloc.start()
+    try:
+        parsed = parse(samples)
+        benchmark.extra_info['memory'] = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    del parsed
+
+    parsed = benchmark.pedantic(parse, args=(samples,), rounds=rounds(n_rows),
+                                iterations=1)
+    assert len(parsed) == n_rows
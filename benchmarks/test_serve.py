@@ -0,0 +1,60 @@
+"""Benchmarks of the latency of a one-sample render, the CLI and the daemon."""
+
+import os
+import sys
+import threading
+import subprocess
+
+import pytest
+
+from biominer_app_util import cli, client, serve
+import synthetic
+
+
+@pytest.fixture(scope='module')
+def sample():
+    columns = synthetic.sample_columns()
+    return dict(zip(columns, ['S1'] + ['/data/S1/%s.fq.gz' % column
+                                       for column in columns[1:]]))
+
+
+@pytest.fixture
+def server(app_dir, bench_dir, cache_dir):
+    work_dir = os.path.join(bench_dir, 'serve-projects')
+    os.makedirs(work_dir, exist_ok=True)
+    socket_path = os.path.join(bench_dir, 'serve.sock')
+    server = serve.RenderServer(socket_path, base_dir=os.path.dirname(app_dir),
+                                work_dir=work_dir)
+    server.warm_up()
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+    thread.join()
+
+
+@pytest.mark.benchmark(group='serve')
+def test_cli_render(benchmark, app_dir, samples_files, bench_dir, cache_dir):
+    """A new process for every render, it pays for imports and compiling."""
+    work_dir = os.path.join(bench_dir, 'cli-projects')
+    os.makedirs(work_dir, exist_ok=True)
+    env = dict(os.environ, BIOMINER_CACHE_DIR=cache_dir,
+               PYTHONPATH=os.path.dirname(os.path.dirname(cli.__file__)))
+    command = [sys.executable, '-m', 'biominer_app_util.cli', 'render',
+               'bench', samples_files(1), '-b', os.path.dirname(app_dir),
+               '-w', work_dir, '-p', 'cli', '--force']
+    benchmark.pedantic(subprocess.check_call, args=(command,),
+                       kwargs={'env': env, 'stderr': subprocess.DEVNULL},
+                       rounds=5, iterations=1)
+
+
+@pytest.mark.benchmark(group='serve')
+@pytest.mark.parametrize('dry_run', [False, True], ids=['render', 'dry-run'])
+def test_daemon_render(benchmark, server, sample, dry_run):
+    """A request to the daemon, its caches are warm."""
+    with client.Client(server.server_address) as conn:
+        response = benchmark(conn.request, 'render', app_name='bench',
+                             project_name='serve', samples=[sample],
+                             dry_run=dry_run, force=True)
+    assert response['ok'], response
@@ -0,0 +1,35 @@
+"""Benchmarks of rendering the templates of a sample."""
+
+import os
+import json
+
+import pytest
+from jinja2 import Environment, FileSystemLoader
+
+from biominer_app_util import cli
+import synthetic
+
+
+def render_uncached(app_path, template_file, data):
+    """Compile the template on every call, as render_app_file did before."""
+    env = Environment(loader=FileSystemLoader(app_path))
+    return env.get_template(template_file).render(**data)
+
+
+@pytest.mark.benchmark(group='template-cache')
+@pytest.mark.parametrize('render', [render_uncached, cli.render_app_file],
+                         ids=['uncached', 'cached'])
+def test_render_sample_templates(benchmark, bench_dir, render):
+    """Render the inputs and workflow.wdl of an app with 50 variables."""
+    app_dir = os.path.join(bench_dir, 'templates')
+    if not os.path.isdir(app_dir):
+        synthetic.make_app(app_dir, n_tasks=1, n_vars=50, n_defaults=0)
+    data = dict(('var_%d' % i, 'value') for i in range(50))
+    data.update({'sample_id': 'S1', 'project_name': 'bench'})
+
+    def render_sample():
+        inputs = render(app_dir, 'inputs', data)
+        json.loads(inputs)
+        return render(app_dir, 'workflow.wdl', data)
+
+    assert 'workflow bench {' in benchmark(render_sample)
@@ -12,6 +12,7 @@
 
 import verboselogs
 import logging
+import hashlib
 import zipfile
 import tempfile
 import shutil
@@ -22,11 +23,24 @@ import sys
 import json
 import os
 import click
+import functools
+import time
+import socket
+import threading
+from array import array
+from contextlib import contextmanager
+from collections import deque, ChainMap
+from itertools import zip_longest, chain, islice
+from collections.abc import Mapping, Sequence
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from subprocess import Popen, PIPE
 from markdown2 import Markdown
-from jinja2 import Environment, FileSystemLoader, meta
+from jinja2 import Environment, FileSystemLoader, meta, nodes
+from jinja2.bccache import BytecodeCache, Bucket
 from json.decoder import JSONDecodeError
-from io import StringIO
+from io import StringIO, BytesIO
+from types import MappingProxyType
+from biominer_app_util.client import DEFAULT_SOCKET_PATH
 
 logging.setLoggerClass(verboselogs.VerboseLogger)
 logger = logging.getLogger('app-utility')
@@ -35,9 +49,15 @@ VERSION = 'v0.1.0'
 APP_IS_INSTALLED = 1
 APP_INSTALL_FAILED = 2
 JSON_NOT_VALID = 3
+RENDER_FAILED = 4
 
 DEFAULT_APP_ROOT_DIR = os.path.expanduser('~/.biominer/apps')
 DEFAULT_PROJECT_ROOT_DIR = os.path.expanduser('~/.biominer/projects')
+DEFAULT_CACHE_DIR = os.environ.get('BIOMINER_CACHE_DIR',
+                                   os.path.expanduser('~/.biominer/cache'))
+DEFAULT_BYTECODE_CACHE_SIZE = 64 * 1024 * 1024
+DEFAULT_ZIP_CACHE_SIZE = 1024 * 1024 * 1024
+DEFAULT_INDEX_CACHE_SIZE = 256 * 1024 * 1024
 
 
 class NotFoundApp(Exception):
@@ -56,6 +76,117 @@ class AppUnInstallationFailed(Exception):
     pass
 
 
+class InValidJSON(Exception):
+    pass
+
+
+class _StageRecord(threading.local):
+    # The stages of the sample rendered by this thread, and the innermost one.
+    stages = None
+    current = None
+
+
+_stage_record = _StageRecord()
+# The MemoryTracer of --trace-memory.
+_memory_tracer = None
+
+
+class _NullStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_null_stage = _NullStage()
+
+
+class _Stage:
+    __slots__ = ('name', 'stages', 'parent', 'start', 'nbytes', 'memory',
+                 'peak', 'snapshot')
+
+    def __init__(self, name, stages):
+        self.name = name
+        self.stages = stages
+        self.nbytes = 0
+        self.memory = self.peak = 0
+        self.snapshot = None
+
+    def __enter__(self):
+        self.parent = _stage_record.current
+        _stage_record.current = self
+        if _memory_tracer is not None:
+            _memory_tracer.enter(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        elapsed = time.perf_counter() - self.start
+        _stage_record.current = self.parent
+        if _memory_tracer is not None:
+            _memory_tracer.exit(self)
+        if self.stages is None:
+            return False
+
+        # The seconds, calls and bytes written of a stage.
+        entry = self.stages.get(self.name)
+        if entry is None:
+            entry = self.stages[self.name] = [0.0, 0, 0]
+        entry[0] += elapsed
+        entry[1] += 1
+        entry[2] += self.nbytes
+        return False
+
+
+def stage(name):
+    """Time a stage of a render, see StageProfiler.
+
+    Unless the stages of the current thread are recorded (see
+    recording_stages) or the memory is traced (see MemoryTracer), a shared
+    no-op context manager is returned.
+    """
+    stages = _stage_record.stages
+    if stages is None and _memory_tracer is None:
+        return _null_stage
+    return _Stage(name, stages)
+
+
+def staged(name, iterable):
+    """Read every item of iterable in a stage, the items are passed through."""
+    iterator = iter(iterable)
+    end = object()
+    while True:
+        with stage(name):
+            item = next(iterator, end)
+        if item is end:
+            return
+        yield item
+
+
+def record_bytes(nbytes=0, path=None):
+    """Count the bytes written by the innermost stage.
+
+    :param path: Count the size of a written file, it is only read when the
+                 stages are recorded.
+    """
+    current = _stage_record.current
+    if current is not None:
+        current.nbytes += os.path.getsize(path) if path else nbytes
+
+
+@contextmanager
+def recording_stages(stages):
+    """Record the stages of this thread into a dict, None disables it."""
+    previous = _stage_record.stages, _stage_record.current
+    _stage_record.stages = stages
+    _stage_record.current = None
+    try:
+        yield stages
+    finally:
+        _stage_record.stages, _stage_record.current = previous
+
+
 class AppDefaultVar:
     def __init__(self, app_path):
         self.app_path = app_path
@@ -115,6 +246,32 @@ class AppDefaultVar:
             json.dump(self.default_vars, f, indent=2, sort_keys=True)
 
 
+_app_defaults = dict()
+
+
+def get_app_defaults(app_path):
+    """Get the defaults of an app, parsed once until the file changes.
+
+    :return: A read-only mapping, empty when the app has no defaults.
+    """
+    default = os.path.join(os.path.abspath(app_path), 'defaults')
+    try:
+        mtime = os.path.getmtime(default)
+    except OSError:
+        mtime = None
+
+    cached = _app_defaults.get(default)
+    if cached is None or cached[0] != mtime:
+        if mtime is None:
+            defaults = dict()
+        else:
+            defaults = AppDefaultVar(app_path).default_vars
+        cached = (mtime, MappingProxyType(defaults))
+        _app_defaults[default] = cached
+
+    return cached[1]
+
+
 def is_valid_app(path, ignore_error=False):
     """Validate a directory path and verify the directory is an valid app directory. # noqa
 
@@ -164,20 +321,22 @@ def dfs_get_zip_file(input_path, result):
             result.append(filepath)
 
 
-def zip_path(input_path, output_path):
+def zip_path(input_path, output_path, cwd=None):
+    """Zip input_path, relative to cwd (the current directory by default)."""
     f = zipfile.ZipFile(output_path, 'w', zipfile.ZIP_DEFLATED)
     filelists = []
-    dfs_get_zip_file(input_path, filelists)
+    dfs_get_zip_file(os.path.join(cwd or '', input_path), filelists)
     for file in filelists:
-        f.write(file)
+        f.write(file, os.path.relpath(file, cwd) if cwd else file)
     f.close()
     return output_path
 
 
-def zip_path_by_ext_program(input_path, output_path):
+def zip_path_by_ext_program(input_path, output_path, cwd=None):
     cmd = ['zip', '-r', '-q', output_path, input_path]
-    logger.debug('ZIP: Working Directory %s, CMD: %s' % (os.getcwd(), cmd))
-    proc = Popen(cmd, stdin=PIPE)
+    logger.debug('ZIP: Working Directory %s, CMD: %s' %
+                 (cwd or os.getcwd(), cmd))
+    proc = Popen(cmd, stdin=PIPE, cwd=cwd)
     proc.communicate()
 
 
@@ -189,30 +348,211 @@ def check_cmd(command):
     return False
 
 
-def generate_dependencies_zip(dependencies_path):
-    # Fix Bug: When Changing Directory, you need a abs path.
-    dependencies_path = os.path.abspath(dependencies_path)
-    previous_workdir = os.getcwd()
-    par_dir = tempfile.mkdtemp()
+def tree_digest(path, exclude=()):
+    """Compute the sha256 digest of a tree from its file names and contents.
+
+    :param exclude: The names of files and directories directly under path
+                    which are skipped.
+    """
+    digest = hashlib.sha256()
+    for root, dirs, files in os.walk(path):
+        if root == path and exclude:
+            dirs[:] = [name for name in dirs if name not in exclude]
+            files = [name for name in files if name not in exclude]
+        dirs.sort()
+        for dirname in dirs:
+            relpath = os.path.relpath(os.path.join(root, dirname), path)
+            digest.update(('d:%s\0' % relpath).encode('utf-8'))
+
+        for filename in sorted(files):
+            filepath = os.path.join(root, filename)
+            relpath = os.path.relpath(filepath, path)
+            size = os.path.getsize(filepath)
+            digest.update(('f:%s\0%d\0' % (relpath, size)).encode('utf-8'))
+            with open(filepath, 'rb') as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                    digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def zip_dependencies(dependencies_path, dest_dir=None):
+    """Zip the dependencies of an app into a new temporary directory.
+
+    The current directory is never changed, other threads of the process,
+    e.g. the requests of a web service, may depend on it.
+
+    :param dependencies_path: Path to the tasks directory of an app.
+    :param dest_dir: Where to make the temporary directory.
+    :return: Path to the zip file.
+    """
+    par_dir = os.path.abspath(tempfile.mkdtemp(prefix='.tasks-',
+                                               dir=dest_dir))
     zip_output = os.path.join(par_dir, 'tasks.zip')
 
-    os.chdir(par_dir)
     dest_path = 'tasks'
-    shutil.copytree(dependencies_path, dest_path)
+    shutil.copytree(dependencies_path, os.path.join(par_dir, dest_path))
 
     # 外部命令
     if check_cmd('zip'):
-        zip_path_by_ext_program('tasks', zip_output)
+        zip_path_by_ext_program(dest_path, zip_output, cwd=par_dir)
     else:
         # TODO: Fix the Bug
         # Python zipfile generate a zip that are version 2.0;
         # But Cromwell need a zip that are version 1.0;
-        zip_path(dest_path, zip_output)
+        zip_path(dest_path, zip_output, cwd=par_dir)
 
-    os.chdir(previous_workdir)
     return zip_output
 
 
+def generate_dependencies_zip(dependencies_path, dest_dir=None, cache_dir=None,
+                              digest=None):
+    """Get a zip file of the dependencies of an app.
+
+    Zip files are kept in a content-addressed store keyed by the digest of
+    the tasks tree, <cache_dir>/zips/<sha256>.zip, so an unchanged tree is
+    never zipped twice. With a dest_dir, the zip file of the store is copied
+    (or reflinked) into a temporary directory of dest_dir, so the rendered
+    samples never link the store itself. The temporary directory can be
+    removed by cleanup_dependencies_zip.
+
+    :param dependencies_path: Path to the tasks directory of an app.
+    :param dest_dir: Where to make the temporary directory, a directory on
+                     the same filesystem as the rendered samples lets them
+                     hard link the zip file. Without it, the path in the
+                     store is returned and must not be linked or changed.
+    :param cache_dir: The cache directory, DEFAULT_CACHE_DIR by default.
+    :param digest: The tree_digest of dependencies_path if it is known.
+    :return: Path to the zip file.
+    """
+    store_dir = os.path.join(cache_dir or DEFAULT_CACHE_DIR, 'zips')
+    digest = digest or tree_digest(dependencies_path)
+    cached_zip = os.path.join(store_dir, '%s.zip' % digest)
+    if os.path.isfile(cached_zip):
+        # Mark the entry as recently used.
+        os.utime(cached_zip)
+    else:
+        try:
+            os.makedirs(store_dir, exist_ok=True)
+            zip_output = zip_dependencies(dependencies_path,
+                                          dest_dir=store_dir)
+        except OSError as err:
+            logger.debug('Dependencies zip store is disabled: %s' % str(err))
+            return zip_dependencies(dependencies_path, dest_dir=dest_dir)
+
+        os.replace(zip_output, cached_zip)
+        cleanup_dependencies_zip(zip_output)
+        record_bytes(path=cached_zip)
+        prune_cache_dir(store_dir, DEFAULT_ZIP_CACHE_SIZE, keep=[cached_zip])
+
+    if dest_dir is None:
+        return cached_zip
+
+    zip_output = os.path.join(tempfile.mkdtemp(prefix='.tasks-', dir=dest_dir),
+                              'tasks.zip')
+    mode = get_link_mode(cached_zip, os.path.dirname(zip_output), 'reflink')
+    link_file(cached_zip, zip_output, mode)
+    return zip_output
+
+
+def cleanup_dependencies_zip(zip_output):
+    """Remove the temporary directory of a zip file, the store is kept."""
+    par_dir = os.path.dirname(zip_output)
+    if os.path.basename(par_dir).startswith('.tasks-'):
+        shutil.rmtree(par_dir, ignore_errors=True)
+
+
+# ioctl request number of FICLONE on Linux.
+FICLONE = 0x40049409
+
+
+def reflink_file(src, dst):
+    """Make a copy-on-write clone of src, on filesystems like btrfs and xfs."""
+    import fcntl
+    try:
+        with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        shutil.copystat(src, dst)
+    except OSError:
+        if os.path.exists(dst):
+            os.remove(dst)
+        raise
+
+
+LINK_MODES = ('copy', 'hardlink', 'symlink', 'reflink')
+
+
+def get_link_mode(src, dest_dir, mode):
+    """Fall back to copy early, hard links and reflinks cannot cross disks."""
+    if mode in ('hardlink', 'reflink'):
+        try:
+            if os.stat(src).st_dev != os.stat(dest_dir).st_dev:
+                return 'copy'
+        except OSError:
+            return 'copy'
+
+    return mode
+
+
+def link_file(src, dst, mode='hardlink'):
+    """Place a file at dst as cheaply as possible.
+
+    :param src: Path to the source file.
+    :param dst: Path to the destination file, it will be replaced if it exists.
+    :param mode: One of LINK_MODES. Fall back to copy when the mode is not
+                 supported, e.g. a hard link across filesystems.
+    :return: The mode which was used.
+    """
+    # Never write into an existing file, it may be a link to another file.
+    if os.path.lexists(dst):
+        os.remove(dst)
+
+    try:
+        if mode == 'hardlink':
+            os.link(src, dst)
+            return mode
+        elif mode == 'symlink':
+            os.symlink(os.path.abspath(src), dst)
+            return mode
+        elif mode == 'reflink':
+            reflink_file(src, dst)
+            return mode
+    except (OSError, ImportError) as err:
+        logger.debug('Cannot %s %s to %s, fall back to copy: %s' %
+                     (mode, src, dst, str(err)))
+
+    copy_file(src, dst)
+    return 'copy'
+
+
+def copy_file(src, dst):
+    """Copy a file like shutil.copy2, the bytes count in the current stage."""
+    shutil.copy2(src, dst)
+    record_bytes(path=dst)
+
+
+def link_tree(src, dst, mode='copy'):
+    """Place a directory tree at dst, see link_file for the modes.
+
+    A symlink mode links the whole directory, the other modes link every file.
+    """
+    if mode == 'symlink':
+        try:
+            os.symlink(os.path.abspath(src), dst)
+            return
+        except OSError as err:
+            logger.debug('Cannot symlink %s to %s, fall back to copy: %s' %
+                         (src, dst, str(err)))
+            mode = 'copy'
+
+    mode = get_link_mode(src, os.path.dirname(os.path.abspath(dst)), mode)
+    if mode == 'copy':
+        shutil.copytree(src, dst, copy_function=copy_file)
+    else:
+        shutil.copytree(src, dst,
+                        copy_function=lambda s, d: link_file(s, d, mode))
+
+
 def install_app_by_git(base_url, namespace, app_name, dest_dir='./',
                        version='', username=None, password=None,
                        is_terminal=True):
@@ -295,7 +635,8 @@ def install_app(app_root_dir, choppy_app, base_url, username, password, is_termi
             return True
 
         if check_app(dest_namelist, namelist):
-            choppy_app_handler.extractall(app_root_dir, dest_namelist)
+            with stage('extract'):
+                choppy_app_handler.extractall(app_root_dir, dest_namelist)
             logger.success("Install %s successfully." % app_name)
         else:
             raise InValidApp("Not a valid app.")
@@ -331,32 +672,1066 @@ def uninstall_app(base_dir, app_name, is_terminal=True):
         return msg
 
 
+def detect_samples_format(file):
+    """Detect the format of a samples file without parsing the whole file.
+
+    :return: json (an array of objects), jsonl (JSON objects separated by
+             whitespace, e.g. JSON Lines or a single object), parquet,
+             feather (Feather or Arrow IPC), tsv or csv.
+    """
+    ext = os.path.splitext(file)[1].lower()
+    if ext in ('.jsonl', '.ndjson'):
+        return 'jsonl'
+    elif ext in ('.tsv', '.tab'):
+        return 'tsv'
+    elif ext in ('.parquet', '.pq'):
+        return 'parquet'
+    elif ext in ('.feather', '.arrow', '.ipc'):
+        return 'feather'
+
+    with open(file, 'rb') as f:
+        magic = f.read(6)
+    if magic.startswith(b'PAR1'):
+        return 'parquet'
+    elif magic == b'ARROW1' or magic.startswith(b'FEA1'):
+        return 'feather'
+
+    with open(file, 'r') as f:
+        head = f.read(4096)
+
+    stripped = head.lstrip()
+    if stripped.startswith('['):
+        return 'json'
+    elif stripped.startswith('{'):
+        return 'jsonl'
+
+    first_line = head.split('\n', 1)[0]
+    if first_line.count('\t') > first_line.count(','):
+        return 'tsv'
+    else:
+        return 'csv'
+
+
+def iter_json_values(f, array=False, bufsize=64 * 1024):
+    """Decode JSON values from a file object incrementally.
+
+    :param f: A file object in text mode.
+    :param array: Whether the values are the items of a top-level array,
+                  otherwise they are separated by whitespace.
+    :param bufsize: The size of each read, a value may span several reads.
+    """
+    decoder = json.JSONDecoder()
+    separators = ' \t\r\n,' if array else ' \t\r\n'
+    buf = f.read(bufsize)
+    eof = not buf
+    pos = buf.index('[') + 1 if array else 0
+
+    while True:
+        # Skip separators, refill the buffer when it is exhausted.
+        while True:
+            while pos < len(buf) and buf[pos] in separators:
+                pos += 1
+            if pos < len(buf) or eof:
+                break
+            buf = f.read(bufsize)
+            pos = 0
+            eof = not buf
+
+        if pos >= len(buf):
+            if array:
+                raise ValueError('Unterminated JSON array.')
+            return
+        elif array and buf[pos] == ']':
+            return
+
+        try:
+            value, end = decoder.raw_decode(buf, pos)
+            # A value at the end of the buffer may be truncated, e.g. a number.
+            complete = eof or end < len(buf)
+        except JSONDecodeError:
+            if eof:
+                raise
+            complete = False
+
+        if not complete:
+            more = f.read(max(bufsize, len(buf) - pos))
+            eof = not more
+            buf = buf[pos:] + more
+            pos = 0
+            continue
+
+        yield value
+        pos = end
+        if pos >= bufsize:
+            # Drop the decoded values to keep memory bounded.
+            buf = buf[pos:]
+            pos = 0
+
+
+class SampleRow(Mapping):
+    """A read-only sample sharing its header with the other rows of a sheet.
+
+    A row only holds a tuple of values, the header is an index of the column
+    names shared by all rows, so a row is much smaller than a dict.
+    """
+
+    __slots__ = ('_index', '_values')
+
+    def __init__(self, index, values):
+        """
+        :param index: A dict of the column names to their positions in values.
+        :param values: A tuple of values.
+        """
+        self._index = index
+        self._values = values
+
+    def __getitem__(self, key):
+        return self._values[self._index[key]]
+
+    def get(self, key, default=None):
+        position = self._index.get(key)
+        return default if position is None else self._values[position]
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def __iter__(self):
+        return iter(self._index)
+
+    def __len__(self):
+        return len(self._index)
+
+    def __repr__(self):
+        return 'SampleRow(%r)' % dict(self)
+
+
+def normalize_sample_id(sample):
+    """Convert an integer sample_id of a JSON sample to str, in place.
+
+    A sample_id names the directory of the sample, so it is always a str.
+    """
+    sample_id = sample.get('sample_id')
+    if isinstance(sample_id, int) and not isinstance(sample_id, bool):
+        sample['sample_id'] = str(sample_id)
+    return sample
+
+
+def make_header_index(header):
+    """Make the index of a header shared by SampleRow.
+
+    The last one of duplicated columns wins.
+    """
+    return dict((name, position) for position, name in enumerate(header))
+
+
+class SampleTable(Sequence):
+    """A list of samples which keeps every sample as a SampleRow.
+
+    The samples with the same columns share a header index, so a large sheet
+    takes a fraction of the memory of a list of dicts.
+    """
+
+    def __init__(self, samples=()):
+        self._indexes = dict()
+        self._rows = []
+        for sample in samples:
+            self.append(sample)
+
+    def append(self, sample):
+        if not isinstance(sample, SampleRow):
+            header = tuple(sample.keys())
+            index = self._indexes.get(header)
+            if index is None:
+                index = self._indexes[header] = make_header_index(header)
+            sample = SampleRow(index, tuple(sample[key] for key in header))
+        self._rows.append(sample)
+
+    def __getitem__(self, position):
+        return self._rows[position]
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __eq__(self, other):
+        if not isinstance(other, (Sequence, list)):
+            return NotImplemented
+        return len(self) == len(other) and \
+            all(a == b for a, b in zip(self, other))
+
+    def __repr__(self):
+        return 'SampleTable(%d samples)' % len(self)
+
+
+def iter_samples(file, is_terminal=True):
+    """Read samples one by one from a CSV, TSV, JSON Lines or JSON file.
+
+    :param file: Path to a samples file, see detect_samples_format.
+    :param is_terminal: Exit when the CSV file is not qualified, otherwise
+                        raise.
+    :return: A generator of samples, a dict for a JSON file, a SampleRow for
+             the other files, see also read_sample_columns.
+    """
+    samples_format = detect_samples_format(file)
+    columns = read_sample_columns(file, samples_format=samples_format)
+    if columns is not None:
+        for sample in columns:
+            yield sample
+    elif samples_format in ('json', 'jsonl'):
+        with open(file, 'r') as f:
+            for sample in iter_json_values(f, array=samples_format == 'json'):
+                if not isinstance(sample, dict):
+                    raise ValueError("Each sample must be a JSON object.")
+                yield normalize_sample_id(sample)
+    else:
+        delimiter = '\t' if samples_format == 'tsv' else ','
+        with open(file, 'rt', newline='') as f:
+            reader = csv.reader(f, delimiter=delimiter)
+            header = next(reader, [])
+            index = make_header_index(header)
+            width = len(header)
+            # A value repeated in a column, e.g. a genome or a platform, is
+            # shared by the rows. A column with too many distinct values,
+            # e.g. a path, stops sharing.
+            pools = [dict() for _ in header]
+            for values in reader:
+                if not values:
+                    continue
+                # An unnamed column, or more values than columns.
+                if "" in index or len(values) > width:
+                    if is_terminal:
+                        print("CSV file is not qualified.")
+                        sys.exit(2)
+                    else:
+                        raise ValueError("CSV file is not qualified.")
+                if len(values) < width:
+                    values.extend([None] * (width - len(values)))
+                for position, pool in enumerate(pools):
+                    if pool is not None:
+                        values[position] = pool.setdefault(values[position],
+                                                           values[position])
+                        if len(pool) > 1024:
+                            pools[position] = None
+                yield SampleRow(index, tuple(values))
+
+
 def parse_samples(file):
+    """Read all samples of a samples file into a SampleTable.
+
+    See iter_samples.
+    """
+    return SampleTable(iter_samples(file))
+
+
+def parse_bool(value):
+    lowered = value.lower()
+    if lowered in ('true', 'yes', '1'):
+        return True
+    elif lowered in ('false', 'no', '0'):
+        return False
+    raise ValueError(value)
+
+
+# The types of a typed header, e.g. reads:json or threads:int.
+SAMPLE_COLUMN_TYPES = {
+    'str': str,
+    'int': int,
+    'float': float,
+    'bool': parse_bool,
+    'json': json.loads,
+}
+
+
+def parse_typed_header(header):
+    """Split a typed header into the column names and types.
+
+    :return: A tuple of the names and the types, None when no column is typed.
     """
-    TODO: may be not working.
+    names, types = [], []
+    for column in header:
+        name, sep, type_name = column.rpartition(':')
+        if sep and name and type_name in SAMPLE_COLUMN_TYPES:
+            names.append(name)
+            types.append(type_name)
+        else:
+            names.append(column)
+            types.append(None)
+
+    if not any(types):
+        return None
+    return names, types
+
+
+def convert_column(values, type_name):
+    """Convert the values of a column, an empty value is None.
+
+    :return: A tuple of the converted values and the rows (0-based) of the
+             values which cannot be converted.
     """
+    convert = SAMPLE_COLUMN_TYPES[type_name]
     try:
-        dict_list = json.load(open(file, 'r'))
-        if type(dict_list) == dict:
-            dict_list = [dict_list, ]
+        return [None if value in ('', None) else convert(value)
+                for value in values], []
+    except (ValueError, TypeError):
+        pass
+
+    converted, invalid = [], []
+    for row, value in enumerate(values):
+        try:
+            converted.append(None if value in ('', None) else convert(value))
+        except (ValueError, TypeError):
+            converted.append(None)
+            invalid.append(row)
+    return converted, invalid
+
+
+def format_row_errors(errors):
+    """Format a list of (row, sample_id, error) ordered by row."""
+    messages = []
+    for row, sample_id, error in sorted(errors, key=lambda e: e[0]):
+        if sample_id:
+            messages.append('Row %d (%s): %s' % (row, sample_id, error))
+        else:
+            messages.append('Row %d: %s' % (row, error))
+    return messages
+
+
+class SampleColumns:
+    """Samples kept as columns, see read_sample_columns.
+
+    The columns are validated as a whole before any sample is rendered, then
+    the samples are iterated as SampleRow.
+    """
+
+    def __init__(self, names, columns, num_rows, table=None, errors=()):
+        """
+        :param columns: A list of lists, or of pyarrow arrays with the table.
+        :param errors: The (row, sample_id, error) found while reading.
+        """
+        self.names = list(names)
+        self.columns = columns
+        self.num_rows = num_rows
+        self.table = table
+        self.errors = list(errors)
+
+    def __len__(self):
+        return self.num_rows
+
+    def column(self, name):
+        return self.columns[self.names.index(name)]
+
+    def _sample_ids(self, rows):
+        if 'sample_id' not in self.names or not rows:
+            return dict()
+        column = self.column('sample_id')
+        if self.table is None:
+            return dict((row, column[row]) for row in rows)
+        return dict((row, column[row].as_py()) for row in rows)
+
+    def _empty_rows(self, column):
+        if self.table is None:
+            return [row for row, value in enumerate(column)
+                    if value is None or value == '']
+
+        import pyarrow as pa
+        import pyarrow.compute as pc
+        empty = pc.is_null(column)
+        if pa.types.is_string(column.type) or \
+                pa.types.is_large_string(column.type):
+            is_blank = pc.fill_null(pc.equal(column, ''), False)
+            empty = pc.or_kleene(empty, is_blank)
+        if not pc.any(empty).as_py():
+            return []
+        return pc.indices_nonzero(empty).to_pylist()
+
+    def _duplicated_rows(self, column):
+        if self.table is None:
+            seen = set()
+            rows = []
+            for row, value in enumerate(column):
+                if value in seen:
+                    rows.append(row)
+                elif value is not None:
+                    seen.add(value)
+            return rows
+
+        import pyarrow.compute as pc
+        counts = pc.value_counts(column)
+        duplicated = pc.filter(counts.field('values'),
+                               pc.greater(counts.field('counts'), 1))
+        if len(duplicated) == 0:
+            return []
+        # Only the rows of the duplicated values are visited.
+        candidates = pc.indices_nonzero(pc.is_in(column, value_set=duplicated))
+        seen = set()
+        rows = []
+        for row in candidates.to_pylist():
+            value = column[row].as_py()
+            if value in seen:
+                rows.append(row)
+            else:
+                seen.add(value)
+        return rows
+
+    def validate(self, required=()):
+        """Validate the columns, sample_id and the values of the samples.
+
+        :param required: The columns which must exist, e.g. the variables of
+                         an app without default values.
+        :return: A list of error messages ordered by row, see
+                 preflight_samples.
+        """
+        messages = []
+        missing = sorted(set(required).union(['sample_id']) - set(self.names))
+        if missing:
+            messages.append('%s not in samples header.' % ', '.join(missing))
+
+        errors = list(self.errors)
+        if 'sample_id' in self.names:
+            column = self.column('sample_id')
+            if self.table is not None:
+                import pyarrow as pa
+                if not (pa.types.is_string(column.type) or
+                        pa.types.is_large_string(column.type)):
+                    messages.append('sample_id must be strings, not %s.' %
+                                    column.type)
+                    return messages
+
+            errors.extend((row + 1, None, 'sample_id is empty.')
+                          for row in self._empty_rows(column))
+            duplicated = self._duplicated_rows(column)
+            sample_ids = self._sample_ids(duplicated)
+            errors.extend((row + 1, sample_ids[row], 'duplicated sample_id.')
+                          for row in duplicated)
+
+        return messages + format_row_errors(errors)
+
+    def __iter__(self):
+        if self.errors:
+            raise ValueError(format_row_errors(self.errors)[0])
+
+        index = make_header_index(self.names)
+        if self.table is None:
+            for values in zip(*self.columns) if self.columns else ():
+                yield SampleRow(index, values)
+            return
+
+        for batch in self.table.to_batches():
+            columns = [column.to_pylist() for column in batch.columns]
+            for values in zip(*columns):
+                yield SampleRow(index, values)
+
+
+def read_sample_columns(file, samples_format=None):
+    """Read a columnar samples file into SampleColumns.
+
+    Parquet and Feather files keep their types and need pyarrow. A CSV or
+    TSV file is columnar when its header is typed, e.g. threads:int or
+    reads:json (see SAMPLE_COLUMN_TYPES), its values are converted column
+    by column. An integer sample_id is read as str.
+
+    :return: SampleColumns, None when the file is not columnar.
+    """
+    samples_format = samples_format or detect_samples_format(file)
+    if samples_format in ('parquet', 'feather'):
+        try:
+            if samples_format == 'parquet':
+                from pyarrow.parquet import read_table
+            else:
+                from pyarrow.feather import read_table
+        except ImportError:
+            raise ImportError('pyarrow is required to read %s samples files, '
+                              'please install biominer_app_util[pyarrow].' %
+                              samples_format)
+
+        table = read_table(file)
+        if 'sample_id' in table.column_names:
+            import pyarrow as pa
+            position = table.column_names.index('sample_id')
+            column = table.column(position)
+            if pa.types.is_integer(column.type):
+                table = table.set_column(position, 'sample_id',
+                                         column.cast(pa.string()))
+        return SampleColumns(table.column_names, table.columns, table.num_rows,
+                             table=table)
+    elif samples_format not in ('csv', 'tsv'):
+        return None
+
+    delimiter = '\t' if samples_format == 'tsv' else ','
+    with open(file, 'rt', newline='') as f:
+        reader = csv.reader(f, delimiter=delimiter)
+        typed_header = parse_typed_header(next(reader, []))
+        if typed_header is None:
+            return None
+
+        names, types = typed_header
+        if '' in names:
+            raise ValueError("CSV file is not qualified.")
+        rows = [values for values in reader if values]
+
+    errors = []
+    for row, values in enumerate(rows, 1):
+        if len(values) > len(names):
+            errors.append((row, None, '%d values for %d columns.' %
+                           (len(values), len(names))))
+            del values[len(names):]
+
+    columns = [list(column) for column in zip_longest(*rows)] or \
+        [[] for _ in names]
+    columns.extend([None] * len(rows)
+                   for _ in range(len(names) - len(columns)))
+    sample_ids = None
+    if 'sample_id' in names:
+        sample_ids = columns[names.index('sample_id')]
+    for position, type_name in enumerate(types):
+        # A sample_id is kept as written, e.g. 007 for sample_id:int.
+        if type_name is None or names[position] == 'sample_id':
+            continue
+        values = columns[position]
+        columns[position], invalid = convert_column(values, type_name)
+        for row in invalid:
+            errors.append((row + 1, sample_ids[row] if sample_ids else None,
+                           '%r is not a valid %s for %s.' %
+                           (values[row], type_name, names[position])))
+
+    return SampleColumns(names, columns, len(rows), errors=errors)
+
+
+class OffsetLines:
+    """Iterate the lines of a binary file as text, tracking their offsets.
+
+    offset is the offset of the next line, i.e. where the next record of a
+    csv.reader over the lines starts.
+    """
+
+    def __init__(self, f, encoding='utf-8'):
+        self.f = f
+        self.encoding = encoding
+        self.offset = f.tell()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        line = self.f.readline()
+        if not line:
+            raise StopIteration
+        self.offset += len(line)
+        return line.decode(self.encoding)
+
+
+class SampleIndex:
+    """An index of the byte offsets of the samples of a file by sample_id.
+
+    Only CSV, TSV (with an untyped header) and JSON Lines files with one
+    sample per line can be indexed. The index is built on the first scan and
+    kept in <cache_dir>/index, it is rebuilt when the size or the
+    modification time of the file changes.
+
+    The index file is a JSON line of metadata, then a line of the sample_id
+    and the offset of every sample sorted by sample_id, which is searched by
+    bisection without loading the whole index.
+    """
+
+    def __init__(self, file, cache_dir=None):
+        self.file = os.path.abspath(file)
+        key = hashlib.sha256(self.file.encode('utf-8')).hexdigest()
+        self.path = os.path.join(cache_dir or DEFAULT_CACHE_DIR, 'index',
+                                 '%s.index' % key)
+        self.samples_format = None
+        self.header = None
+        # The sorted lines are in [start, end) of the index file.
+        self.start = self.end = 0
+
+    def _stat(self):
+        stat = os.stat(self.file)
+        return [stat.st_size, stat.st_mtime_ns]
+
+    @staticmethod
+    def _key(sample_id):
+        # Escape the tabs and newlines in a sample_id.
+        return json.dumps(str(sample_id)).encode('utf-8')
+
+    def load(self):
+        """Load the index, or build it when it is missing or stale.
+
+        :return: False when the file cannot be indexed.
+        """
+        stat = self._stat()
+        if self._load_meta(stat):
+            # Mark the index as recently used.
+            os.utime(self.path)
+            return True
+
+        return self.build(stat) and self._load_meta(stat)
+
+    def _load_meta(self, stat):
+        try:
+            with open(self.path, 'rb') as f:
+                meta = json.loads(f.readline().decode('utf-8'))
+                start = f.tell()
+        except (OSError, ValueError):
+            return False
+
+        if meta.get('version') != VERSION or meta.get('stat') != stat:
+            return False
+
+        self.samples_format = meta['format']
+        self.header = meta['header']
+        self.start = start
+        self.end = os.path.getsize(self.path)
+        return True
+
+    def build(self, stat):
+        samples_format = detect_samples_format(self.file)
+        entries = []
+        header = None
+        with open(self.file, 'rb') as f:
+            if samples_format in ('csv', 'tsv'):
+                delimiter = '\t' if samples_format == 'tsv' else ','
+                lines = OffsetLines(f)
+                reader = csv.reader(lines, delimiter=delimiter)
+                header = next(reader, [])
+                position = make_header_index(header).get('sample_id')
+                if position is None or parse_typed_header(header) is not None:
+                    return False
+
+                while True:
+                    start = lines.offset
+                    values = next(reader, None)
+                    if values is None:
+                        break
+                    if position < len(values):
+                        entries.append((self._key(values[position]), start))
+            elif samples_format == 'jsonl':
+                start = 0
+                for line in f:
+                    if line.strip():
+                        try:
+                            sample = json.loads(line)
+                        except ValueError:
+                            # A sample spans several lines.
+                            return False
+                        if not isinstance(sample, dict):
+                            return False
+                        key = self._key(sample.get('sample_id'))
+                        entries.append((key, start))
+                    start += len(line)
+            else:
+                return False
+
+        entries.sort()
+        meta = {'version': VERSION, 'stat': stat, 'format': samples_format,
+                'header': header}
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = '%s.%s' % (self.path, uuid.uuid4().hex)
+            with open(tmp_path, 'wb') as f:
+                f.write(json.dumps(meta).encode('utf-8') + b'\n')
+                f.writelines(b'%s\t%d\n' % entry for entry in entries)
+            os.replace(tmp_path, self.path)
+        except OSError as err:
+            logger.debug('Cannot save the index of %s: %s' %
+                         (self.file, str(err)))
+            return False
+
+        prune_cache_dir(os.path.dirname(self.path), DEFAULT_INDEX_CACHE_SIZE,
+                        keep=[self.path])
+        return True
+
+    def _line_start(self, f, position):
+        """The start of the first line at or after position."""
+        if position <= self.start:
+            return self.start
+        f.seek(position - 1)
+        f.readline()
+        return f.tell()
+
+    def lookup(self, f, sample_id):
+        """Find the offsets of a sample_id in f, the binary index file."""
+        key = self._key(sample_id)
+        low, high = self.start, self.end
+        while low < high:
+            middle = (low + high) // 2
+            line_start = self._line_start(f, middle)
+            f.seek(line_start)
+            if line_start < self.end and \
+                    f.readline().rpartition(b'\t')[0] < key:
+                low = middle + 1
+            else:
+                high = middle
+
+        offsets = []
+        f.seek(self._line_start(f, low))
+        for line in f:
+            line_key, _, offset = line.rpartition(b'\t')
+            if line_key != key:
+                break
+            offsets.append(int(offset))
+        return offsets
+
+    def read(self, sample_ids):
+        """Read the samples of sample_ids, in the order of the file."""
+        with open(self.path, 'rb') as f:
+            offsets = sorted(offset for sample_id in set(sample_ids)
+                             for offset in self.lookup(f, sample_id))
+
+        with open(self.file, 'rb') as f:
+            if self.samples_format == 'jsonl':
+                for offset in offsets:
+                    f.seek(offset)
+                    yield normalize_sample_id(json.loads(f.readline()))
+                return
+
+            delimiter = '\t' if self.samples_format == 'tsv' else ','
+            index = make_header_index(self.header)
+            width = len(self.header)
+            for offset in offsets:
+                f.seek(offset)
+                values = next(csv.reader(OffsetLines(f), delimiter=delimiter))
+                if "" in index or len(values) > width:
+                    raise ValueError("CSV file is not qualified.")
+                values.extend([None] * (width - len(values)))
+                yield SampleRow(index, tuple(values))
+
+
+def select_samples(file, sample_ids, samples=None, cache_dir=None):
+    """Read the samples with the given sample_ids, in the order of the file.
+
+    The samples are read at their offsets when the file can be indexed (see
+    SampleIndex), otherwise all samples are scanned.
+
+    :param samples: The samples of the file if they are read already, e.g.
+                    SampleColumns, they are scanned.
+    :return: A generator of samples.
+    """
+    sample_ids = set(str(sample_id) for sample_id in sample_ids)
+    if samples is None:
+        index = SampleIndex(file, cache_dir=cache_dir)
+        if index.load():
+            for sample in index.read(sample_ids):
+                yield sample
+            return
+        samples = iter_samples(file, is_terminal=False)
+
+    for sample in samples:
+        if str(sample.get('sample_id')) in sample_ids:
+            yield sample
+
+
+def read_sample_ids(file):
+    """Read sample_ids from a file, one per line.
+
+    Blank lines and # comments are skipped.
+    """
+    sample_ids = []
+    with open(file, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                sample_ids.append(line)
+    return sample_ids
+
+
+def prune_cache_dir(cache_dir, max_size, keep=()):
+    """Evict the least recently used files until the directory fits max_size.
+
+    :param cache_dir: Path to a cache directory, subdirectories are ignored.
+    :param max_size: The size limit in bytes.
+    :param keep: Paths which must not be evicted.
+    :return: The number of evicted files.
+    """
+    if not os.path.isdir(cache_dir):
+        return 0
+
+    entries = []
+    total_size = 0
+    for entry in os.scandir(cache_dir):
+        # Skip temporary files which are being written by other processes.
+        if entry.name.startswith('.') or \
+                not entry.is_file(follow_symlinks=False):
+            continue
+        if entry.path in keep:
+            continue
+        stat = entry.stat(follow_symlinks=False)
+        entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total_size += stat.st_size
+
+    evicted = 0
+    for mtime, size, path in sorted(entries):
+        if total_size <= max_size:
+            break
+        try:
+            os.remove(path)
+            evicted += 1
+        except FileNotFoundError:
+            # Evicted by another process.
+            pass
+        total_size -= size
+
+    return evicted
+
+
+class AppBytecodeCache(BytecodeCache):
+    """An on-disk cache of compiled templates shared by all processes.
+
+    Entries are keyed by the template path (which contains the app path and
+    its version), the version of app-utility and the checksum of the template
+    source. The least recently used entries are evicted when the cache grows
+    beyond max_size bytes.
+    """
+
+    def __init__(self, directory, max_size=DEFAULT_BYTECODE_CACHE_SIZE):
+        self.directory = directory
+        self.max_size = max_size
+        os.makedirs(self.directory, exist_ok=True)
+
+    def get_bucket(self, environment, name, filename, source):
+        checksum = self.get_source_checksum(source)
+        key = self.get_cache_key(name, '%s:%s:%s' %
+                                 (VERSION, filename, checksum))
+        bucket = Bucket(environment, key, checksum)
+        self.load_bytecode(bucket)
+        return bucket
+
+    def _get_cache_filename(self, bucket):
+        return os.path.join(self.directory, '%s.cache' % bucket.key)
+
+    def load_bytecode(self, bucket):
+        filename = self._get_cache_filename(bucket)
+        try:
+            with open(filename, 'rb') as f:
+                bucket.load_bytecode(f)
+            # Mark the entry as recently used.
+            os.utime(filename)
+        except OSError:
+            pass
+
+    def dump_bytecode(self, bucket):
+        # Write to a temporary file first, concurrent runs may read the entry.
+        fd, tmp_path = tempfile.mkstemp(prefix='.', dir=self.directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                bucket.write_bytecode(f)
+            os.replace(tmp_path, self._get_cache_filename(bucket))
+        except OSError as err:
+            logger.debug('Cannot save compiled template: %s' % str(err))
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+
+        prune_cache_dir(self.directory, self.max_size)
+
+    def clear(self):
+        for filename in os.listdir(self.directory):
+            if filename.endswith('.cache'):
+                os.remove(os.path.join(self.directory, filename))
+
+
+_bytecode_caches = dict()
+
+
+def get_bytecode_cache(cache_dir=None):
+    """Get the on-disk bytecode cache, None if its directory is read-only."""
+    directory = os.path.join(cache_dir or DEFAULT_CACHE_DIR, 'bytecode')
+    if directory not in _bytecode_caches:
+        try:
+            _bytecode_caches[directory] = AppBytecodeCache(directory)
+        except OSError as err:
+            logger.debug('Bytecode cache is disabled: %s' % str(err))
+            _bytecode_caches[directory] = None
+
+    return _bytecode_caches[directory]
+
+
+class AppTemplateEngine:
+    """Compile the templates of an app once and reuse them for every sample.
+
+    A template is recompiled only when the modification time of its file
+    changes, so an engine can be kept for the whole life of the process.
+    With a bytecode cache, the compiled code is also reused across processes.
+    """
+
+    def __init__(self, app_path, bytecode_cache=None):
+        self.app_path = os.path.abspath(app_path)
+        self.env = Environment(loader=FileSystemLoader(self.app_path),
+                               bytecode_cache=bytecode_cache)
+        self._templates = dict()
+        self._variables = dict()
+        self._specialized = dict()
+
+    def get_template(self, template_file):
+        template_path = os.path.join(self.app_path, template_file)
+        mtime = os.path.getmtime(template_path)
+        cached = self._templates.get(template_file)
+        if cached is None or cached[0] != mtime:
+            # Bypass the environment cache, it would stat the file again.
+            template = self.env.loader.load(self.env, template_file)
+            cached = (mtime, template)
+            self._templates[template_file] = cached
+
+        return cached[1]
+
+    def _get_meta(self, template_file):
+        """Get the undeclared variables of a template, and whether it has
+        STATEFUL_NODES.
+        """
+        template_path = os.path.join(self.app_path, template_file)
+        mtime = os.path.getmtime(template_path)
+        cached = self._variables.get(template_file)
+        if cached is None or cached[0] != mtime:
+            source = self.env.loader.get_source(self.env, template_file)[0]
+            ast = self.env.parse(source)
+            variables = meta.find_undeclared_variables(ast)
+            stateful = any(True for _ in ast.find_all(self.STATEFUL_NODES))
+            cached = (mtime, frozenset(variables), stateful)
+            self._variables[template_file] = cached
+
+        return cached[1:]
+
+    def get_variables(self, template_file):
+        """Get the undeclared variables of a template.
+
+        See get_vars_from_app.
+        """
+        return self._get_meta(template_file)[0]
+
+    def is_invariant(self, template_file, sample_keys):
+        """Whether a template is project-invariant, uses no sample variables.
+
+        Such a template only uses defaults and project_name, so its output is
+        the same for all samples of a project. The variables of included,
+        imported or extended templates are unknown, a template with
+        STATEFUL_NODES is never project-invariant.
+        """
+        variables, stateful = self._get_meta(template_file)
+        if stateful:
+            return False
+        return (variables - {'project_name'}).isdisjoint(sample_keys)
+
+    # A template with these nodes has state across its nodes, it is never
+    # specialized.
+    STATEFUL_NODES = (nodes.Extends, nodes.Block, nodes.Macro,
+                      nodes.CallBlock, nodes.Import, nodes.FromImport,
+                      nodes.Include, nodes.Assign, nodes.AssignBlock)
+    # The output of a node with these filters or functions may vary between
+    # renders.
+    VOLATILE_NAMES = frozenset(['random', 'lipsum', 'cycler', 'joiner',
+                                'namespace'])
+
+    def get_specialized(self, template_file, constants, sample_keys, key):
+        """Get a template partially evaluated against constants.
+
+        The top-level blocks and expressions of the template which only use
+        constants (defaults and project_name) are rendered once, the residual
+        template renders the same output for the constants overlaid by a
+        sample.
+
+        :param constants: The values which are the same for all samples.
+        :param sample_keys: The variables from the sample, they are never
+                            constant.
+        :param key: Identify the constants, e.g. the digest of the run.
+        :return: The residual template.
+        """
+        template_path = os.path.join(self.app_path, template_file)
+        mtime = os.path.getmtime(template_path)
+        variables = self.get_variables(template_file)
+        cache_key = (template_file, key, variables.intersection(sample_keys))
+        cached = self._specialized.get(cache_key)
+        if cached is None or cached[0] != mtime:
+            if len(self._specialized) > 256:
+                self._specialized.clear()
+            const_keys = set(constants.keys()).difference(sample_keys)
+            residual = self._specialize(template_file, constants, const_keys)
+            cached = (mtime, residual)
+            self._specialized[cache_key] = cached
+
+        return cached[1]
+
+    def _specialize(self, template_file, constants, const_keys):
+        source, filename, _ = self.env.loader.get_source(self.env,
+                                                         template_file)
+        ast = self.env.parse(source, template_file, filename)
+        if any(True for _ in ast.find_all(self.STATEFUL_NODES)):
+            return self.get_template(template_file)
+
+        body = []
+        for node in ast.body:
+            if isinstance(node, nodes.Output):
+                items = [self._evaluate(item, constants, const_keys,
+                                        expression=True)
+                         for item in node.nodes]
+                body.append(nodes.Output(items, lineno=node.lineno))
+            else:
+                body.append(self._evaluate(node, constants, const_keys))
+
+        residual = nodes.Template(body, lineno=1)
+        residual.set_environment(self.env)
+        return self.env.from_string(residual)
+
+    def _evaluate(self, node, constants, const_keys, expression=False):
+        """Render a node if it only uses constants, otherwise keep it as is."""
+        if isinstance(node, nodes.TemplateData):
+            return node
+
+        body = nodes.Output([node]) if expression else node
+        template = nodes.Template([body], lineno=1)
+        template.set_environment(self.env)
+        variables = meta.find_undeclared_variables(template)
+        if not variables or not variables.issubset(const_keys):
+            return node
+
+        for child in [node] + list(node.find_all((nodes.Name, nodes.Filter))):
+            if getattr(child, 'name', None) in self.VOLATILE_NAMES:
+                return node
+
+        try:
+            data = self.env.from_string(template).render(
+                **dict((key, constants[key]) for key in variables))
+        except Exception:
+            # Let the error be raised when a sample is rendered.
+            return node
+
+        data_node = nodes.TemplateData(data, lineno=node.lineno)
+        if expression:
+            return data_node
+        else:
+            return nodes.Output([data_node], lineno=node.lineno)
+
+    def render(self, template_file, data):
+        return render_mapping(self.get_template(template_file), data)
+
+
+def render_mapping(template, data):
+    """Render a template with any mapping as its context, without copying it.
+
+    Template.render copies the data into a new dict, the data here is
+    looked up in place and overlays the globals of the template.
+    """
+    context = template.new_context(ChainMap(data, template.globals),
+                                   shared=True)
+    try:
+        return ''.join(template.root_render_func(context))
     except Exception:
-        reader = csv.DictReader(open(file, 'rt'))
-        dict_list = []
+        template.environment.handle_exception()
 
-        for line in reader:
-            header = line.keys()
-            if None in header or "" in header:
-                print("CSV file is not qualified.")
-                sys.exit(2)
-            dict_list.append(line)
 
-    return dict_list
+_template_engines = dict()
+
+
+def get_template_engine(app_path):
+    """Get the template engine of an app, one engine per app per process."""
+    app_path = os.path.abspath(app_path)
+    engine = _template_engines.get(app_path)
+    if engine is None:
+        engine = AppTemplateEngine(app_path,
+                                   bytecode_cache=get_bytecode_cache())
+        _template_engines[app_path] = engine
+
+    return engine
 
 
 def render_app_file(app_path, template_file, data):
-    env = Environment(loader=FileSystemLoader(app_path))
-    template = env.get_template(template_file)
-    return template.render(**data)
+    return get_template_engine(app_path).render(template_file, data)
 
 
 def read_file_as_string(filepath):
@@ -424,8 +1799,49 @@ def get_header(file):
 
 
 def write(path, filename, data):
-    with open(os.path.join(path, filename), 'w') as f:
+    filepath = os.path.join(path, filename)
+    # Never write into an existing file, it may be a link to another file.
+    if os.path.lexists(filepath):
+        os.remove(filepath)
+
+    with open(filepath, 'w') as f:
         f.write(data)
+    record_bytes(path=filepath)
+
+
+_shared_files = dict()
+
+
+def write_shared(path, filename, data, key, link_mode='hardlink'):
+    """Write a file, or link it to the file written with the same key and data.
+
+    :param key: Identify the files which can be shared, e.g. the same template
+                rendered in the same run. Files are only shared between the
+                sample directories of the same project directory.
+    :param link_mode: See LINK_MODES, copy always writes the file. A symlink
+                      mode makes a hard link instead, the file is linked to
+                      another sample which may be removed.
+    """
+    filepath = os.path.join(path, filename)
+    size = len(data.encode('utf-8'))
+    key = (os.path.dirname(os.path.abspath(path)), key)
+    shared = _shared_files.get(key)
+    if link_mode != 'copy' and shared and shared[0] == data \
+            and os.path.isfile(shared[1]) \
+            and os.path.getsize(shared[1]) == size:
+        if shared[1] == filepath:
+            # Rendered again into the same sample, e.g. with --force.
+            return
+        if link_mode == 'symlink':
+            link_mode = 'hardlink'
+        link_file(shared[1], filepath,
+                  get_link_mode(shared[1], path, link_mode))
+        return
+
+    write(path, filename, data)
+    if len(_shared_files) > 1024:
+        _shared_files.clear()
+    _shared_files[key] = (data, filepath)
 
 
 def kv_list_to_dict(kv_list):
@@ -552,7 +1968,7 @@ def parse_error(err):
       \(char\ (?P<pos>\d+)(?:\ -\ (?P<end>\d+))?\)$""", err, re.VERBOSE)
 
 
-def check_json(json_file=None, string=''):
+def check_json(json_file=None, string='', is_terminal=True):
     try:
         if json_file:
             with open(json_file) as f:
@@ -561,9 +1977,12 @@ def check_json(json_file=None, string=''):
             json.loads(string)
     except JSONDecodeError as error:
         if json_file:
-            logger.error("Invalid JSON: %s" % json_file)
+            title = "Invalid JSON: %s" % json_file
         else:
-            logger.error("Invalid JSON")
+            title = "Invalid JSON"
+
+        if is_terminal:
+            logger.error(title)
 
         if json_file:
             with open(json_file) as f:
@@ -585,16 +2004,117 @@ def check_json(json_file=None, string=''):
                 err_dict[k] = int(v)
 
         err = DictStruct(**err_dict)
+        detail = err_msg
         for ii, line in enumerate(string.readlines()):
             if ii == err.lineno - 1:
-                logger.error("%s\n\n%s\n%s^-- %s\n" % (err_msg, line.replace("\n", ""),
-                                                       " " * (err.colno - 1),
-                                                       err.msg))
+                detail = "%s\n\n%s\n%s^-- %s\n" % (
+                    err_msg, line.replace("\n", ""), " " * (err.colno - 1),
+                    err.msg)
+
+        if is_terminal:
+            logger.error(detail)
+            sys.exit(JSON_NOT_VALID)
+        else:
+            raise InValidJSON("%s: %s" % (title, detail))
 
-        sys.exit(JSON_NOT_VALID)
 
+class JSONBackend:
+    """Parse and serialize rendered inputs with the json module."""
 
-def copy_and_overwrite(from_path, to_path, is_file=False, ignore_errors=True, ask=False):
+    name = 'json'
+
+    def loads(self, string):
+        return json.loads(string)
+
+    def dumps(self, obj, minified=False):
+        if minified:
+            return json.dumps(obj, separators=(',', ':'), ensure_ascii=False)
+        else:
+            return json.dumps(obj, indent=2, sort_keys=True,
+                              ensure_ascii=False)
+
+
+class OrjsonBackend(JSONBackend):
+    """Parse rendered inputs with orjson, if it is installed.
+
+    The inputs are still serialized with json, orjson formats some numbers
+    differently (e.g. 1e16 for 1e+16), so the canonical and minified inputs
+    would depend on whether orjson is installed.
+    """
+
+    name = 'orjson'
+
+    def __init__(self):
+        import orjson
+        self.orjson = orjson
+
+    def loads(self, string):
+        return self.orjson.loads(string)
+
+
+# In order of preference, the first one which can be loaded is used.
+JSON_BACKENDS = [OrjsonBackend, JSONBackend]
+INPUTS_FORMATS = ('raw', 'canonical', 'minified')
+
+_json_backend = None
+
+
+def get_json_backend(name=None):
+    """Get a JSON backend by name, or the preferred one.
+
+    The BIOMINER_JSON_BACKEND environment variable can choose the default one.
+    """
+    global _json_backend
+    if name is None and _json_backend is not None:
+        return _json_backend
+
+    wanted = name or os.environ.get('BIOMINER_JSON_BACKEND')
+    backend = None
+    for backend_class in JSON_BACKENDS:
+        if wanted and backend_class.name != wanted:
+            continue
+        try:
+            backend = backend_class()
+            break
+        except ImportError:
+            continue
+
+    backend = backend or JSONBackend()
+    if name is None:
+        _json_backend = backend
+    return backend
+
+
+def load_inputs(string, inputs_format='raw', is_terminal=True):
+    """Validate rendered inputs by parsing them once.
+
+    The location of an error is only computed when the inputs are invalid.
+
+    :param inputs_format: raw keeps the string as rendered, canonical and
+                          minified serialize the parsed object.
+    :return: The inputs to write.
+    """
+    backend = get_json_backend()
+    try:
+        obj = backend.loads(string)
+    except ValueError:
+        # A fast backend may be stricter than json, e.g. for NaN, so json has
+        # the final say and locates the error.
+        backend = JSONBackend()
+        try:
+            obj = backend.loads(string)
+        except ValueError:
+            check_json(string=string, is_terminal=is_terminal)
+            raise
+
+    if inputs_format == 'raw':
+        return string
+    else:
+        return backend.dumps(obj, minified=inputs_format == 'minified')
+
+
+def copy_and_overwrite(from_path, to_path, is_file=False, ignore_errors=True,
+                       ask=False, link_mode='copy'):
     if ask:
         answer = ''
         while answer.upper() not in ("YES", "NO", "Y", "N"):
@@ -610,7 +2130,8 @@ def copy_and_overwrite(from_path, to_path, is_file=False, ignore_errors=True, as
 
     if ignore_errors:
         # TODO: rmtree is too dangerous
-        if os.path.isfile(to_path):
+        # Remove the link only, never the files it links to.
+        if os.path.islink(to_path) or os.path.isfile(to_path):
             os.remove(to_path)
 
         if os.path.isdir(to_path):
@@ -621,9 +2142,10 @@ def copy_and_overwrite(from_path, to_path, is_file=False, ignore_errors=True, as
             parent_dir = os.path.dirname(to_path)
             # Force to make directory when parent directory doesn't exist
             os.makedirs(parent_dir, exist_ok=True)
-            shutil.copy2(from_path, to_path)
+            link_file(from_path, to_path,
+                      get_link_mode(from_path, parent_dir, link_mode))
         elif os.path.isdir(from_path):
-            shutil.copytree(from_path, to_path)
+            link_tree(from_path, to_path, link_mode)
     except Exception as err:
         logger.warning('Copy %s to %s error: %s' %
                        (from_path, to_path, str(err)))
@@ -713,42 +2235,947 @@ def install(choppy_app, base_dir, force, username, password, endpoint):
     install_app(app_root_dir, choppy_app, endpoint, username, password)
 
 
-def render_app(app_dir, output_dir, project_name, sample={}):
-    # 用户可通过samples文件覆写default文件中已定义的变量
-    # 只有samples文件中缺少的变量才从default文件中取值
-    app_default_var = AppDefaultVar(app_dir)
-    all_default_value = app_default_var.show_default_value()
+_invariant_outputs = dict()
+
+
+def render_sample_file(app_dir, template_file, data, sample_keys,
+                       render_digest=None, constants=None):
+    """Render a template of an app for a sample.
+
+    A project-invariant template (see AppTemplateEngine.is_invariant) is
+    rendered only once per run per process, other templates are partially
+    evaluated against the constants once per run (see get_specialized).
+
+    :param sample_keys: The variables from the sample, but not from defaults.
+    :param render_digest: Identify the run, see get_render_digest.
+    :param constants: The defaults and the project_name of the run.
+    :return: The output.
+    """
+    engine = get_template_engine(app_dir)
+    if render_digest is None:
+        return engine.render(template_file, data)
+
+    if engine.is_invariant(template_file, sample_keys):
+        key = (render_digest, template_file)
+        if key not in _invariant_outputs:
+            if len(_invariant_outputs) > 1024:
+                _invariant_outputs.clear()
+            _invariant_outputs[key] = engine.render(template_file, data)
 
-    for key in all_default_value.keys():
-        if key not in sample.keys():
-            sample[key] = all_default_value.get(key)
+        return _invariant_outputs[key]
 
-    sample['project_name'] = project_name
+    template = engine.get_specialized(template_file, constants or dict(),
+                                      sample_keys, render_digest)
+    return render_mapping(template, data)
+
+
+def render_templates(app_dir, project_name, sample, is_terminal=True,
+                     render_digest=None, inputs_format='raw'):
+    """Render the inputs and workflow.wdl of an app for a sample in memory.
+
+    :param render_digest: Identify the run, see render_sample_file.
+    :param inputs_format: See load_inputs.
+    :return: A tuple of the rendered inputs and workflow.wdl.
+    """
+    sample_keys = set(sample.keys())
+
+    # 用户可通过samples文件覆写default文件中已定义的变量
+    # 只有samples文件中缺少的变量才从default文件中取值
+    # The sample is layered over the defaults, neither of them is copied.
+    with stage('defaults'):
+        defaults = get_app_defaults(app_dir)
+    project = {'project_name': project_name}
+    constants = ChainMap(project, defaults)
+    data = ChainMap(project, sample, defaults)
 
     # inputs
-    inputs = render_app_file(app_dir, 'inputs', sample)
-    check_json(string=inputs)  # Json Syntax Checker
-    write(output_dir, 'inputs', inputs)
-    inputs_path = os.path.join(output_dir, 'inputs')
+    with stage('render'):
+        inputs = render_sample_file(app_dir, 'inputs', data, sample_keys,
+                                    render_digest=render_digest,
+                                    constants=constants)
+    # Json Syntax Checker
+    with stage('check_json'):
+        inputs = load_inputs(inputs, inputs_format=inputs_format,
+                             is_terminal=is_terminal)
 
     # workflow.wdl
-    wdl = render_app_file(app_dir, 'workflow.wdl', sample)
-    write(output_dir, 'workflow.wdl', wdl)
-    wdl_path = os.path.join(output_dir, 'workflow.wdl')
+    with stage('render'):
+        wdl = render_sample_file(app_dir, 'workflow.wdl', data, sample_keys,
+                                 render_digest=render_digest,
+                                 constants=constants)
+    return inputs, wdl
+
+
+def render_app(app_dir, output_dir, project_name, sample={}, zip_output=None,
+               link_mode='copy', is_terminal=True, render_digest=None,
+               inputs_format='raw'):
+    inputs, wdl = render_templates(app_dir, project_name, sample,
+                                   is_terminal=is_terminal,
+                                   render_digest=render_digest,
+                                   inputs_format=inputs_format)
+    write_app(app_dir, output_dir, inputs, wdl, zip_output=zip_output,
+              link_mode=link_mode, render_digest=render_digest)
+
+
+def write_app(app_dir, output_dir, inputs, wdl, zip_output=None,
+              link_mode='copy', render_digest=None):
+    """Write the rendered inputs and workflow.wdl and the app's files."""
+    with stage('write'):
+        write(output_dir, 'inputs', inputs)
+        if render_digest:
+            # A project-invariant workflow.wdl is shared by all samples.
+            write_shared(output_dir, 'workflow.wdl', wdl,
+                         (render_digest, 'workflow.wdl'), link_mode=link_mode)
+        else:
+            write(output_dir, 'workflow.wdl', wdl)
+
+    with stage('copy'):
+        # defaults
+        src_defaults_file = os.path.join(app_dir, 'defaults')
+        dest_defaults_file = os.path.join(output_dir, 'defaults')
+        copy_and_overwrite(src_defaults_file, dest_defaults_file,
+                           is_file=True, link_mode=link_mode)
+
+        src_dependencies = os.path.join(app_dir, 'tasks')
+        dest_dependencies = os.path.join(output_dir, 'tasks')
+        copy_and_overwrite(src_dependencies, dest_dependencies,
+                           link_mode=link_mode)
+
+    # dependencies zip file, it can be shared by all samples of a project.
+    with stage('zip'):
+        if zip_output:
+            link_file(zip_output, os.path.join(output_dir, 'tasks.zip'))
+        else:
+            zip_output = generate_dependencies_zip(src_dependencies,
+                                                   dest_dir=output_dir)
+            link_file(zip_output, os.path.join(output_dir, 'tasks.zip'))
+            cleanup_dependencies_zip(zip_output)
+
+
+class RenderManifest:
+    """Fingerprints of the rendered samples in a project directory.
+
+    A sharded render keeps the samples of its shard in a manifest of its own,
+    .biominer-manifest.<i>-of-<N>.json, so the array jobs of a render never
+    overwrite each other. All the manifests of a project are merged on load,
+    the most recently saved one wins for a sample. A failed sample is kept
+    with no fingerprint, so an older manifest cannot bring its fingerprint
+    back.
+    """
+
+    filename = '.biominer-manifest.json'
+
+    def __init__(self, project_path, shard=None):
+        self.project_path = project_path
+        self.shard = shard
+        if shard:
+            self.path = os.path.join(
+                project_path, '.biominer-manifest.%d-of-%d.json' %
+                (shard.index, shard.count))
+        else:
+            self.path = os.path.join(project_path, self.filename)
+        self.samples = self._load()
+
+    def get_paths(self):
+        """The manifests of the project, the least recently saved first."""
+        try:
+            filenames = os.listdir(self.project_path)
+        except OSError:
+            return []
+
+        paths = []
+        for filename in filenames:
+            if filename.startswith('.biominer-manifest.') and \
+                    filename.endswith('.json'):
+                path = os.path.join(self.project_path, filename)
+                try:
+                    paths.append((os.stat(path).st_mtime_ns, path))
+                except OSError:
+                    continue
+        return [path for mtime, path in sorted(paths)]
+
+    def _load(self):
+        samples = dict()
+        for path in self.get_paths():
+            try:
+                with open(path, 'r') as f:
+                    samples.update(json.load(f).get('samples', dict()))
+            except (OSError, ValueError):
+                continue
+        return samples
+
+    def get(self, sample_id):
+        return self.samples.get(sample_id)
+
+    def update(self, sample_id, fingerprint):
+        self.samples[sample_id] = fingerprint
+
+    def remove(self, sample_id):
+        self.samples[sample_id] = None
+
+    def save(self):
+        samples = self.samples
+        if self.shard:
+            samples = dict((sample_id, fingerprint)
+                           for sample_id, fingerprint in samples.items()
+                           if self.shard.owns(sample_id))
+        tmp_path = '%s.%s' % (self.path, uuid.uuid4().hex)
+        with open(tmp_path, 'w') as f:
+            json.dump({'version': VERSION, 'samples': samples}, f)
+        os.replace(tmp_path, self.path)
+
+
+def get_render_digest(app_dir, project_name, link_mode='copy',
+                      tasks_digest=None, inputs_format='raw'):
+    """Digest of everything but the sample that a rendered sample depends on.
+
+    It covers the whole app, i.e. the templates with the templates they
+    include, import or extend, the defaults, the dependencies and the
+    options. Hidden files of the app, e.g. .git, are skipped.
+    """
+    tasks_digest = tasks_digest or tree_digest(os.path.join(app_dir, 'tasks'))
+    exclude = set(name for name in os.listdir(app_dir)
+                  if name.startswith('.'))
+    exclude.add('tasks')
+    parts = [VERSION, project_name, link_mode, inputs_format, tasks_digest,
+             tree_digest(app_dir, exclude=exclude)]
+
+    return hashlib.sha256('\0'.join(parts).encode('utf-8')).hexdigest()
+
+
+def sample_fingerprint(sample, render_digest):
+    """Fingerprint a sample, it changes with the sample or render_digest."""
+    data = json.dumps(dict(sample), sort_keys=True, default=str)
+    return hashlib.sha256((render_digest + data).encode('utf-8')).hexdigest()
+
 
-    # defaults
-    src_defaults_file = os.path.join(app_dir, 'defaults')
-    dest_defaults_file = os.path.join(output_dir, 'defaults')
-    copy_and_overwrite(src_defaults_file,
-                       dest_defaults_file, is_file=True)
+ARCHIVE_FORMATS = ('tar', 'tar.gz', 'tar.zst', 'zip')
 
-    src_dependencies = os.path.join(app_dir, 'tasks')
-    dest_dependencies = os.path.join(output_dir, 'tasks')
-    copy_and_overwrite(src_dependencies, dest_dependencies)
 
-    # dependencies zip file
-    zip_output = generate_dependencies_zip(src_dependencies)
-    shutil.copy2(zip_output, output_dir)
+def get_archive_format(path):
+    """Guess the archive format from the suffix of path, tar by default."""
+    if path.endswith('.tgz'):
+        return 'tar.gz'
+
+    for archive_format in ARCHIVE_FORMATS:
+        if path.endswith('.' + archive_format):
+            return archive_format
+
+    return 'tar'
+
+
+def import_zstandard():
+    """Import zstandard, the optional dependency of tar.zst archives."""
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError('zstandard is required to write tar.zst archives, '
+                          'please install biominer_app_util[zstd].')
+    return zstandard
+
+
+class ProjectArchive:
+    """Write a rendered project into a tar or zip archive.
+
+    The archive is written as a stream, so the file object may be a pipe.
+    In a tar archive, a file which is added many times, e.g. the tasks of
+    every sample, is stored once; the other entries are hard links to the
+    first one. A zip archive stores the bytes in every entry, because most
+    unzip tools extract a link entry as a file holding the link target.
+    """
+
+    def __init__(self, fileobj, archive_format='tar'):
+        self.archive_format = archive_format
+        self._compressor = None
+        self._stored = dict()
+        # Files are only stored once in tar archives, see add_link.
+        self._dedup = archive_format != 'zip'
+        if archive_format == 'zip':
+            self.zip = zipfile.ZipFile(fileobj, 'w', zipfile.ZIP_DEFLATED)
+        else:
+            import tarfile
+            self.tarfile = tarfile
+            mode = 'w|'
+            if archive_format == 'tar.gz':
+                mode = 'w|gz'
+            elif archive_format == 'tar.zst':
+                zstandard = import_zstandard()
+                self._compressor = zstandard.ZstdCompressor().stream_writer(
+                    fileobj, closefd=False)
+                fileobj = self._compressor
+            self.tar = tarfile.open(fileobj=fileobj, mode=mode)
+
+    def add_bytes(self, arcname, data, key=None):
+        """Add a file from data, files with the same key are stored once."""
+        if not self._dedup:
+            key = None
+        if key is not None and key in self._stored:
+            self.add_link(arcname, self._stored[key])
+            return
+
+        if key is not None:
+            self._stored[key] = arcname
+
+        record_bytes(len(data))
+        if self.archive_format == 'zip':
+            info = zipfile.ZipInfo(arcname, time.localtime()[:6])
+            info.external_attr = 0o644 << 16
+            info.compress_type = zipfile.ZIP_DEFLATED
+            self.zip.writestr(info, data)
+        else:
+            info = self.tarfile.TarInfo(arcname)
+            info.size = len(data)
+            info.mtime = time.time()
+            info.mode = 0o644
+            self.tar.addfile(info, BytesIO(data))
+
+    def add_link(self, arcname, target):
+        """Add a hard link to an entry of a tar archive."""
+        info = self.tarfile.TarInfo(arcname)
+        info.type = self.tarfile.LNKTYPE
+        info.linkname = target
+        info.mtime = time.time()
+        self.tar.addfile(info)
+
+    def add_file(self, arcname, path):
+        """Add a file, in tar it is stored once however often it is added."""
+        path = os.path.realpath(path)
+        if self._dedup and path in self._stored:
+            self.add_link(arcname, self._stored[path])
+            return
+
+        if self.archive_format == 'zip':
+            self.zip.write(path, arcname)
+        else:
+            self.tar.add(path, arcname, recursive=False)
+            self._stored[path] = arcname
+        record_bytes(path=path)
+
+    def add_tree(self, arcname, path):
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for filename in sorted(files):
+                filepath = os.path.join(root, filename)
+                relpath = os.path.relpath(filepath, path)
+                self.add_file(os.path.join(arcname, relpath), filepath)
+
+    def add_sample(self, arcname, app_dir, inputs, wdl, zip_output):
+        """Add a rendered sample with the same layout as render_app."""
+        self.add_bytes(os.path.join(arcname, 'inputs'), inputs.encode('utf-8'))
+        # A project-invariant workflow.wdl is stored once.
+        wdl = wdl.encode('utf-8')
+        self.add_bytes(os.path.join(arcname, 'workflow.wdl'), wdl,
+                       key=('workflow.wdl', hashlib.sha1(wdl).hexdigest()))
+        defaults = os.path.join(app_dir, 'defaults')
+        if os.path.isfile(defaults):
+            self.add_file(os.path.join(arcname, 'defaults'), defaults)
+        self.add_tree(os.path.join(arcname, 'tasks'),
+                      os.path.join(app_dir, 'tasks'))
+        self.add_file(os.path.join(arcname, 'tasks.zip'), zip_output)
+
+    def close(self):
+        if self.archive_format == 'zip':
+            self.zip.close()
+        else:
+            self.tar.close()
+            if self._compressor:
+                # End the zstd frame, the file object itself is not closed.
+                self._compressor.close()
+
+
+class RenderResult:
+    """The result of rendering a sample, error is None when it succeeded.
+
+    exception is the exception raised by a failed sample, elapsed is the
+    time to render the sample in seconds, skipped means the sample is
+    unchanged since the last incremental render and outputs holds the
+    rendered inputs and workflow.wdl of an in-memory render. stages holds
+    the recorded stages of the sample, see StageProfiler.
+    """
+
+    def __init__(self, sample_id, row, error=None, outputs=None,
+                 exception=None, elapsed=0.0, skipped=False, stages=None):
+        self.sample_id = sample_id
+        self.row = row
+        self.error = error
+        self.outputs = outputs
+        self.exception = exception
+        self.elapsed = elapsed
+        self.skipped = skipped
+        self.stages = stages
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    @property
+    def name(self):
+        return self.sample_id or 'row %d' % self.row
+
+    def to_dict(self):
+        data = {'sample_id': self.sample_id, 'row': self.row, 'ok': self.ok,
+                'error': self.error, 'elapsed': self.elapsed,
+                'skipped': self.skipped}
+        if self.outputs:
+            data['outputs'] = dict(zip(('inputs', 'workflow.wdl'),
+                                       self.outputs))
+        if self.stages:
+            data['stages'] = self.stages
+        return data
+
+
+class StageProfiler:
+    """A report of the time spent and the bytes written by a render.
+
+    The stages of a sample (defaults, render, check_json, write, copy, zip
+    and archive) are recorded wherever it is rendered, also in the processes
+    of jobs, and returned in RenderResult.stages. Reading the samples is the
+    parse stage, the stages of the project (e.g. the dependencies zip file)
+    only count in the totals.
+    """
+
+    STAGES = ('parse', 'defaults', 'render', 'check_json', 'write', 'copy',
+              'zip', 'archive')
+    FIELDS = ('stage', 'calls', 'samples', 'seconds', 'mean', 'p50', 'p90',
+              'p99', 'max', 'bytes')
+
+    def __init__(self):
+        # The seconds, calls and bytes written of every stage.
+        self.totals = dict()
+        self.sample_seconds = dict()
+        self.samples = 0
+        self.start = time.time()
+
+    def add(self, stages, sample=True):
+        """Add recorded stages, see recording_stages.
+
+        :param sample: Whether they are the stages of a sample, or of the
+                       project.
+        """
+        for name, (seconds, calls, nbytes) in stages.items():
+            total = self.totals.get(name)
+            if total is None:
+                total = self.totals[name] = [0.0, 0, 0]
+            total[0] += seconds
+            total[1] += calls
+            total[2] += nbytes
+            if sample:
+                self.sample_seconds.setdefault(name, array('d')).append(
+                    seconds)
+
+    def add_result(self, result):
+        if result.stages:
+            self.samples += 1
+            self.add(result.stages)
+
+    def time_samples(self, samples):
+        """Time reading every sample as the parse stage, passing it through."""
+        samples = iter(samples)
+        while True:
+            start = time.perf_counter()
+            try:
+                sample = next(samples)
+            except StopIteration:
+                return
+            self.add({'parse': [time.perf_counter() - start, 1, 0]})
+            yield sample
+
+    @staticmethod
+    def percentile(values, percent):
+        return values[int(round(percent / 100.0 * (len(values) - 1)))]
+
+    def report(self):
+        """The stages in the order of a render, with percentiles per sample."""
+        order = {name: i for i, name in enumerate(self.STAGES)}
+        rows = []
+        for name in sorted(self.totals, key=lambda name: (
+                order.get(name, len(order)), name)):
+            seconds, calls, nbytes = self.totals[name]
+            values = sorted(self.sample_seconds.get(name, ()))
+            row = {'stage': name, 'calls': calls, 'samples': len(values),
+                   'seconds': seconds, 'bytes': nbytes}
+            if values:
+                row.update(mean=sum(values) / len(values),
+                           p50=self.percentile(values, 50),
+                           p90=self.percentile(values, 90),
+                           p99=self.percentile(values, 99), max=values[-1])
+            rows.append(row)
+        return rows
+
+    def to_dict(self):
+        return {'version': VERSION, 'samples': self.samples,
+                'elapsed': time.time() - self.start, 'stages': self.report()}
+
+    def save(self, path):
+        """Save the report as CSV if path ends with .csv, as JSON otherwise."""
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp_path = '%s.%s' % (path, uuid.uuid4().hex)
+        with open(tmp_path, 'w', newline='') as f:
+            if path.endswith('.csv'):
+                writer = csv.DictWriter(f, fieldnames=self.FIELDS)
+                writer.writeheader()
+                writer.writerows(self.report())
+            else:
+                json.dump(self.to_dict(), f, indent=2)
+        os.replace(tmp_path, path)
+
+
+@contextmanager
+def project_stage(profiler, name):
+    """Time a stage of a project rather than of a sample, see StageProfiler.
+
+    :param profiler: A StageProfiler, nothing is timed if it is None.
+    """
+    if profiler is None:
+        # The memory may be traced.
+        with stage(name):
+            yield
+        return
+
+    with recording_stages(dict()) as stages, stage(name):
+        yield
+    profiler.add(stages, sample=False)
+
+
+class MemoryTracer:
+    """Trace the memory of the stages of a command, see --trace-memory.
+
+    For every stage (see stage) the report has the peak of the traced memory
+    while it ran, how much it grew over the memory at its start and what it
+    retained at its end. The top allocation sites of a stage are the sites
+    which grew the most in a call of it. They are compared on the first call
+    and again when the stage retained half as much memory again, so a stage
+    costs a few snapshots. The top sites of the process are kept for the
+    largest memory at the end of a stage, e.g. a list of samples.
+
+    Only the process of the command is traced, not the processes of jobs.
+    The peaks are the peaks of the process, stages running at the same time
+    in threads (in_flight) include each other. Python < 3.9 cannot reset the
+    peak, the peak of a stage is the largest memory at its start or end.
+    """
+
+    STAGES = StageProfiler.STAGES + ('extract',)
+
+    def __init__(self, top=10, frames=1):
+        self.top = top
+        self.frames = frames
+        self.pid = os.getpid()
+        self.stages = dict()
+        self.peak = 0
+        self.snapshot_memory = 0
+        self.top_sites = []
+        self.start_time = time.time()
+        import tracemalloc
+        self.tracemalloc = tracemalloc
+        self._reset_peak = getattr(tracemalloc, 'reset_peak', None)
+
+    def start(self):
+        global _memory_tracer
+        self.tracemalloc.start(self.frames)
+        _memory_tracer = self
+
+    def stop(self):
+        global _memory_tracer
+        if _memory_tracer is self:
+            _memory_tracer = None
+        self.tracemalloc.stop()
+
+    def get_sites(self, stats, diff=False):
+        """The top sites of the statistics of a snapshot, or of a diff."""
+        sites = []
+        for stat in stats:
+            frame = stat.traceback[0]
+            # The snapshots of the tracer are no sites of the command.
+            if frame.filename == self.tracemalloc.__file__ or \
+                    (diff and stat.size_diff <= 0):
+                continue
+            sites.append({'site': '%s:%d' % (frame.filename, frame.lineno),
+                          'size': stat.size_diff if diff else stat.size,
+                          'count': stat.count_diff if diff else stat.count})
+            if len(sites) == self.top:
+                break
+        return sites
+
+    def enter(self, stage):
+        if os.getpid() != self.pid:
+            # A forked process of jobs is not traced.
+            self.stop()
+            return
+
+        current, peak = self.tracemalloc.get_traced_memory()
+        if stage.parent is not None:
+            stage.parent.peak = max(stage.parent.peak, peak)
+        self.peak = max(self.peak, peak)
+
+        entry = self.stages.get(stage.name)
+        if entry is None:
+            entry = self.stages[stage.name] = {
+                'calls': 0, 'peak': 0, 'increase': 0, 'retained': 0,
+                'compared': 0, 'top': [], 'due': True}
+        if entry['due']:
+            stage.snapshot = self.tracemalloc.take_snapshot()
+
+        # The peak is reset for the stage, the enclosing stage keeps its peak.
+        if self._reset_peak:
+            self._reset_peak()
+        stage.memory = stage.peak = self.tracemalloc.get_traced_memory()[0]
+
+    def exit(self, stage):
+        if os.getpid() != self.pid:
+            self.stop()
+            return
+
+        current, peak = self.tracemalloc.get_traced_memory()
+        peak = max(peak if self._reset_peak else current, stage.peak)
+        if stage.parent is not None:
+            stage.parent.peak = max(stage.parent.peak, peak)
+        self.peak = max(self.peak, peak)
+
+        entry = self.stages.get(stage.name)
+        if entry is None:
+            # The stage was entered before the memory was traced.
+            return
+        entry['calls'] += 1
+        entry['peak'] = max(entry['peak'], peak)
+        entry['increase'] = max(entry['increase'], peak - stage.memory)
+        entry['retained'] = max(entry['retained'], current - stage.memory)
+
+        snapshot = None
+        if stage.snapshot is not None:
+            snapshot = self.tracemalloc.take_snapshot()
+            entry['top'] = self.get_sites(
+                snapshot.compare_to(stage.snapshot, 'lineno'), diff=True)
+            entry['compared'] = entry['retained']
+            entry['due'] = False
+            stage.snapshot = None
+        elif entry['retained'] > entry['compared'] * 1.5:
+            entry['due'] = True
+
+        if current > self.snapshot_memory * 1.5:
+            snapshot = snapshot or self.tracemalloc.take_snapshot()
+            self.snapshot_memory = current
+            self.top_sites = self.get_sites(snapshot.statistics('lineno'))
+
+        if snapshot is not None and self._reset_peak:
+            # Forget the memory of the snapshots.
+            self._reset_peak()
+
+    def to_dict(self):
+        order = {name: i for i, name in enumerate(self.STAGES)}
+        stages = []
+        for name in sorted(self.stages, key=lambda name: (
+                order.get(name, len(order)), name)):
+            entry = self.stages[name]
+            stages.append({'stage': name, 'calls': entry['calls'],
+                           'peak': entry['peak'],
+                           'increase': entry['increase'],
+                           'retained': entry['retained'],
+                           'top': entry['top']})
+        return {'version': VERSION, 'command': sys.argv[1:], 'peak': self.peak,
+                'elapsed': time.time() - self.start_time, 'stages': stages,
+                'top': {'memory': self.snapshot_memory,
+                        'sites': self.top_sites}}
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp_path = '%s.%s' % (path, uuid.uuid4().hex)
+        with open(tmp_path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
+        os.replace(tmp_path, path)
+
+
+def render_sample(row_sample, app_dir, project_path, project_name, force=False,
+                  zip_output=None, link_mode='copy', render_digest=None,
+                  inputs_format='raw', profile_stages=False):
+    """Render a sample into project_path/sample_id without exiting the process.
+
+    :param row_sample: A tuple of the row number and the sample.
+    :param profile_stages: Record the stages of the sample, see StageProfiler.
+    :return: A RenderResult, the error of a failed sample is kept in it.
+    """
+    row, sample = row_sample
+    sample_id = sample.get('sample_id')
+    start = time.time()
+    with recording_stages(dict() if profile_stages else None) as stages:
+        try:
+            if not sample_id:
+                raise Exception("Your samples file must contain "
+                                "sample_id column.")
+
+            # make project_name/sample_id directory
+            sample_path = os.path.join(project_path, sample_id)
+            check_dir(sample_path, skip=force)
+            render_app(app_dir, sample_path, project_name, sample=sample,
+                       zip_output=zip_output, link_mode=link_mode,
+                       is_terminal=False, render_digest=render_digest,
+                       inputs_format=inputs_format)
+            result = RenderResult(sample_id, row)
+        except Exception as err:
+            result = RenderResult(sample_id, row, error=str(err),
+                                  exception=err)
+
+    result.elapsed = time.time() - start
+    result.stages = stages
+    return result
+
+
+def write_sample(result, app_dir, project_path, force=False, zip_output=None,
+                 link_mode='copy', render_digest=None):
+    """Write a sample rendered by dry_render_sample into its directory.
+
+    :param result: A RenderResult with outputs, its stages are recorded if
+                   they were recorded by dry_render_sample.
+    :return: The RenderResult, the error of a failed sample is kept in it.
+    """
+    start = time.time()
+    with recording_stages(result.stages):
+        try:
+            if not result.sample_id:
+                raise Exception("Your samples file must contain "
+                                "sample_id column.")
+
+            sample_path = os.path.join(project_path, result.sample_id)
+            check_dir(sample_path, skip=force)
+            inputs, wdl = result.outputs
+            write_app(app_dir, sample_path, inputs, wdl, zip_output=zip_output,
+                      link_mode=link_mode, render_digest=render_digest)
+        except Exception as err:
+            result.error = str(err)
+            result.exception = err
+
+    result.outputs = None
+    result.elapsed += time.time() - start
+    return result
+
+
+def dry_render_sample(row_sample, app_dir, project_name, keep_outputs=False,
+                      render_digest=None, inputs_format='raw',
+                      profile_stages=False):
+    """Render a sample in memory only, see render_sample.
+
+    :param keep_outputs: Whether to keep the rendered files in the result.
+    """
+    row, sample = row_sample
+    start = time.time()
+    with recording_stages(dict() if profile_stages else None) as stages:
+        try:
+            outputs = render_templates(app_dir, project_name, sample,
+                                       is_terminal=False,
+                                       render_digest=render_digest,
+                                       inputs_format=inputs_format)
+            result = RenderResult(sample.get('sample_id'), row,
+                                  outputs=outputs if keep_outputs else None)
+        except Exception as err:
+            result = RenderResult(sample.get('sample_id'), row, error=str(err),
+                                  exception=err)
+
+    result.elapsed = time.time() - start
+    result.stages = stages
+    return result
+
+
+def preflight_samples(app_dir, project_name, samples, jobs=1,
+                      link_mode='copy', inputs_format='raw'):
+    """Validate samples and dry-render all of them before any file is written.
+
+    The header is validated once for each distinct set of columns (once per
+    sheet for CSV and TSV files) against the variables of the app. The
+    samples are dry-rendered with the options of the render.
+
+    :param samples: An iterable of samples.
+    :param jobs: The number of processes to dry-render samples.
+    :param link_mode: See LINK_MODES.
+    :param inputs_format: See INPUTS_FORMATS.
+    :return: A list of error messages ordered by row, empty when all samples
+             can be rendered.
+    """
+    errors = []
+    variables = set(get_all_variables(app_dir, no_default=True))
+    checked_headers = set()
+    sample_ids = set()
+
+    def checked_samples():
+        for row, sample in enumerate(samples, 1):
+            header = frozenset(sample.keys())
+            if header not in checked_headers:
+                checked_headers.add(header)
+                missing = sorted(variables - header)
+                if missing:
+                    errors.append((row, sample.get('sample_id'),
+                                   '%s not in samples header.' %
+                                   ', '.join(missing)))
+
+            sample_id = sample.get('sample_id')
+            if sample_id in sample_ids:
+                errors.append((row, sample_id, 'duplicated sample_id.'))
+            elif sample_id:
+                sample_ids.add(sample_id)
+            elif 'sample_id' in header:
+                errors.append((row, None, 'sample_id is empty.'))
+
+            yield row, sample
+
+    render_digest = get_render_digest(app_dir, project_name,
+                                      link_mode=link_mode,
+                                      inputs_format=inputs_format)
+    func = functools.partial(dry_render_sample, app_dir=app_dir,
+                             project_name=project_name,
+                             render_digest=render_digest,
+                             inputs_format=inputs_format)
+    for result in imap_ordered(func, checked_samples(), jobs=jobs):
+        if not result.ok:
+            errors.append((result.row, result.sample_id, result.error))
+
+    # Sort by row, the header errors are found before the render errors.
+    return format_row_errors(errors)
+
+
+def _map_chunk(func, chunk):
+    # A result, e.g. a skipped sample, is passed through in its place.
+    return [item if isinstance(item, RenderResult) else func(item)
+            for item in chunk]
+
+
+def imap_ordered(func, iterable, jobs=1, chunksize=16):
+    """Map func over iterable in a pool of processes, yield results in order.
+
+    Items are sent to the pool in chunks and only a few chunks per process are
+    in flight, so a large iterable is never loaded into memory at once. An item
+    which is already a RenderResult is yielded as is.
+
+    :param jobs: The number of processes, map in this process if it is 1.
+    """
+    if jobs <= 1:
+        for item in iterable:
+            yield _map_chunk(func, [item])[0]
+        return
+
+    def chunks():
+        chunk = []
+        for item in iterable:
+            chunk.append(item)
+            if len(chunk) == chunksize:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        pending = deque()
+        for chunk in chunks():
+            pending.append(executor.submit(_map_chunk, func, chunk))
+            if len(pending) >= jobs * 2:
+                for result in pending.popleft().result():
+                    yield result
+
+        while pending:
+            for result in pending.popleft().result():
+                yield result
+
+
+def render_pipeline(render_func, write_func, iterable, jobs=1, in_flight=8):
+    """Render and write items concurrently with asyncio, like imap_ordered.
+
+    A producer reads items, a render stage renders them in memory (in jobs
+    processes) and a write stage writes them in in_flight threads, so the
+    CPU and the filesystem are busy at the same time. At most in_flight
+    items are between the producer and the consumer, a slow filesystem or
+    consumer blocks the producer.
+
+    :param render_func: Render an item, return a RenderResult with outputs.
+    :param write_func: Write a rendered RenderResult, return the RenderResult.
+    :return: A generator of RenderResult in the order of iterable.
+    """
+    import asyncio
+
+    loop = asyncio.new_event_loop()
+    if jobs > 1:
+        render_executor = ProcessPoolExecutor(max_workers=jobs)
+    else:
+        render_executor = ThreadPoolExecutor(max_workers=1)
+    io_executor = ThreadPoolExecutor(max_workers=in_flight)
+
+    async def produce(slots, rendering):
+        for seq, item in enumerate(iterable):
+            await slots.acquire()
+            await rendering.put((seq, item))
+        for _ in range(jobs):
+            await rendering.put(None)
+
+    async def render_stage(rendering, writing):
+        while True:
+            entry = await rendering.get()
+            if entry is None:
+                return
+            seq, item = entry
+            if not isinstance(item, RenderResult):
+                item = await loop.run_in_executor(render_executor,
+                                                  render_func, item)
+            await writing.put((seq, item))
+
+    async def write_stage(writing, done):
+        while True:
+            entry = await writing.get()
+            if entry is None:
+                return
+            seq, result = entry
+            if result.ok and not result.skipped:
+                result = await loop.run_in_executor(io_executor, write_func,
+                                                    result)
+            await done.put((seq, result))
+
+    async def run(slots, done):
+        rendering = asyncio.Queue()
+        writing = asyncio.Queue()
+        stages = [asyncio.ensure_future(render_stage(rendering, writing))
+                  for _ in range(jobs)]
+        writers = [asyncio.ensure_future(write_stage(writing, done))
+                   for _ in range(in_flight)]
+        try:
+            await asyncio.gather(produce(slots, rendering), *stages)
+            for _ in writers:
+                await writing.put(None)
+            await asyncio.gather(*writers)
+            await done.put(None)
+        except Exception as err:
+            await done.put(err)
+        finally:
+            stages.extend(writers)
+            for stage in stages:
+                stage.cancel()
+            await asyncio.gather(*stages, return_exceptions=True)
+
+    async def start():
+        slots = asyncio.Semaphore(in_flight)
+        done = asyncio.Queue()
+        return slots, done, asyncio.ensure_future(run(slots, done))
+
+    # The loop runs while the consumer waits for the next result.
+    slots, done, task = loop.run_until_complete(start())
+    try:
+        pending = dict()
+        next_seq = 0
+        while True:
+            entry = loop.run_until_complete(done.get())
+            if entry is None:
+                break
+            if isinstance(entry, Exception):
+                raise entry
+
+            pending[entry[0]] = entry[1]
+            while next_seq in pending:
+                result = pending.pop(next_seq)
+                next_seq += 1
+                slots.release()
+                yield result
+    finally:
+        if not task.done():
+            task.cancel()
+            loop.run_until_complete(
+                asyncio.gather(task, return_exceptions=True))
+        render_executor.shutdown()
+        io_executor.shutdown()
+        loop.close()
 
 
 @click.group()
@@ -797,6 +3224,806 @@ def render_cli():
     pass
 
 
+def render_archive(app_dir, project_name, samples, archive,
+                   archive_format='tar', jobs=1, inputs_format='raw',
+                   profiler=None):
+    """Render samples into an archive of the project, see ProjectArchive.
+
+    Samples are rendered in memory, the archive is the only file written.
+
+    :param archive: Path to the archive file, - for stdout, or a binary file
+                    object.
+    :param profiler: Record the stages of the samples, see StageProfiler.
+    :return: A generator of RenderResult in the order of samples.
+    """
+    if archive_format == 'tar.zst':
+        # Fail before the archive file is created.
+        import_zstandard()
+
+    tasks_path = os.path.join(app_dir, 'tasks')
+    with project_stage(profiler, 'zip'):
+        tasks_digest = tree_digest(tasks_path)
+        zip_output = generate_dependencies_zip(tasks_path, digest=tasks_digest)
+    render_digest = get_render_digest(app_dir, project_name,
+                                      tasks_digest=tasks_digest,
+                                      inputs_format=inputs_format)
+    if archive == '-':
+        fileobj = sys.stdout.buffer
+    elif isinstance(archive, str):
+        fileobj = open(archive, 'wb')
+    else:
+        fileobj = archive
+
+    func = functools.partial(dry_render_sample, app_dir=app_dir,
+                             project_name=project_name, keep_outputs=True,
+                             render_digest=render_digest,
+                             inputs_format=inputs_format,
+                             profile_stages=profiler is not None)
+    project_archive = ProjectArchive(fileobj, archive_format=archive_format)
+    try:
+        for result in imap_ordered(func, enumerate(samples, 1), jobs=jobs):
+            if result.ok and not result.sample_id:
+                result.error = ("Your samples file must contain "
+                                "sample_id column.")
+
+            if result.ok:
+                inputs, wdl = result.outputs
+                with recording_stages(result.stages), stage('archive'):
+                    project_archive.add_sample(
+                        os.path.join(project_name, result.sample_id), app_dir,
+                        inputs, wdl, zip_output)
+                result.outputs = None
+            yield result
+    finally:
+        project_archive.close()
+        if fileobj is not archive and archive != '-':
+            fileobj.close()
+        cleanup_dependencies_zip(zip_output)
+
+
+def render_project(app_dir, samples, out, project_name=None, force=False,
+                   link_mode='copy', jobs=1, incremental=False,
+                   archive_format=None, inputs_format='raw', in_flight=0,
+                   manifest=True, profiler=None, shard=None):
+    """Render samples as a project, the library API of the render command.
+
+    Nothing exits the process, the error of a failed sample is kept in its
+    result. The caches of the process (templates, defaults and dependencies)
+    are shared by all calls.
+
+    :param app_dir: Path to an installed app.
+    :param samples: An iterable of samples, or path to a samples file.
+    :param out: The project directory, or the archive (see render_archive)
+                when archive_format is set.
+    :param project_name: The name of the project, the basename of out by
+                         default.
+    :param force: Overwrite existing sample directories.
+    :param link_mode: See LINK_MODES.
+    :param jobs: The number of processes to render samples.
+    :param incremental: Skip the samples unchanged since the last render.
+    :param archive_format: See ARCHIVE_FORMATS.
+    :param inputs_format: See INPUTS_FORMATS.
+    :param in_flight: Overlap writing files with rendering, at most in_flight
+                      samples are in flight, see render_pipeline. It is not
+                      used by an archive.
+    :param manifest: Record the rendered samples in the manifest of the
+                     project, it is required by incremental.
+    :param profiler: A StageProfiler to add the stages of the render to.
+    :param shard: The Shard of the samples, a sharded render keeps a manifest
+                  of its own, see RenderManifest.
+    :return: A generator of RenderResult in the order of samples.
+    """
+    if isinstance(samples, str):
+        samples = iter_samples(samples, is_terminal=False)
+    if profiler is not None:
+        samples = profiler.time_samples(samples)
+
+    if archive_format:
+        if incremental:
+            raise ValueError('An archive cannot be rendered incrementally.')
+        if not project_name:
+            raise ValueError('The project_name is required for an archive.')
+        for result in render_archive(app_dir, project_name, samples, out,
+                                     archive_format=archive_format, jobs=jobs,
+                                     inputs_format=inputs_format,
+                                     profiler=profiler):
+            if profiler is not None:
+                profiler.add_result(result)
+            yield result
+        return
+
+    project_path = out
+    project_name = project_name or os.path.basename(os.path.normpath(out))
+
+    # The dependencies zip file is the same for all samples, copy it from the
+    # store once and hard link the copy into every sample directory.
+    check_dir(project_path, skip=True)
+    tasks_path = os.path.join(app_dir, 'tasks')
+    with project_stage(profiler, 'zip'):
+        tasks_digest = tree_digest(tasks_path)
+        zip_output = generate_dependencies_zip(
+            tasks_path, dest_dir=project_path, digest=tasks_digest)
+
+    # Every rendered sample is recorded in the manifest with its fingerprint,
+    # the unchanged samples can be skipped by the next incremental render.
+    if incremental and not manifest:
+        raise ValueError('An incremental render needs the manifest.')
+    render_manifest = None
+    if manifest:
+        render_manifest = RenderManifest(project_path, shard=shard)
+    render_digest = get_render_digest(app_dir, project_name,
+                                      link_mode=link_mode,
+                                      tasks_digest=tasks_digest,
+                                      inputs_format=inputs_format)
+    fingerprints = dict()
+
+    def changed_samples():
+        for row, sample in enumerate(samples, 1):
+            fingerprint = sample_fingerprint(sample, render_digest)
+            sample_id = sample.get('sample_id')
+            if incremental and sample_id and \
+                    render_manifest.get(sample_id) == fingerprint \
+                    and os.path.isdir(os.path.join(project_path, sample_id)):
+                yield RenderResult(sample_id, row, skipped=True)
+                continue
+
+            fingerprints[row] = fingerprint
+            yield row, sample
+
+    if in_flight:
+        render_func = functools.partial(dry_render_sample, app_dir=app_dir,
+                                        project_name=project_name,
+                                        keep_outputs=True,
+                                        render_digest=render_digest,
+                                        inputs_format=inputs_format,
+                                        profile_stages=profiler is not None)
+        write_func = functools.partial(write_sample, app_dir=app_dir,
+                                       project_path=project_path,
+                                       force=force or incremental,
+                                       zip_output=zip_output,
+                                       link_mode=link_mode,
+                                       render_digest=render_digest)
+        results = render_pipeline(render_func, write_func, changed_samples(),
+                                  jobs=jobs, in_flight=in_flight)
+    else:
+        func = functools.partial(render_sample, app_dir=app_dir,
+                                 project_path=project_path,
+                                 project_name=project_name,
+                                 force=force or incremental,
+                                 zip_output=zip_output, link_mode=link_mode,
+                                 render_digest=render_digest,
+                                 inputs_format=inputs_format,
+                                 profile_stages=profiler is not None)
+        results = imap_ordered(func, changed_samples(), jobs=jobs)
+
+    try:
+        for result in results:
+            if profiler is not None:
+                profiler.add_result(result)
+            if result.skipped:
+                pass
+            elif render_manifest is None:
+                fingerprints.pop(result.row)
+            elif result.ok:
+                render_manifest.update(result.sample_id,
+                                       fingerprints.pop(result.row))
+            else:
+                fingerprints.pop(result.row)
+                if result.sample_id:
+                    render_manifest.remove(result.sample_id)
+            yield result
+    finally:
+        if render_manifest is not None:
+            render_manifest.save()
+        cleanup_dependencies_zip(zip_output)
+
+
+def shard_of(sample_id, count):
+    """Assign a sample_id to one of count shards by a stable hash.
+
+    Unlike hash(), it is the same in every process, on every host and in
+    every Python version, so the array jobs of a sharded render agree.
+    """
+    digest = hashlib.sha1(str(sample_id or '').encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big') % count
+
+
+class Shard:
+    """The shard index of count shards of samples, see shard_of.
+
+    total and selected count the samples seen and selected by select.
+    """
+
+    def __init__(self, index, count):
+        if count < 1 or not 0 <= index < count:
+            raise ValueError('Invalid shard: %d/%d, expected 0 <= i < N.' %
+                             (index, count))
+        self.index = index
+        self.count = count
+        self.total = 0
+        self.selected = 0
+
+    @classmethod
+    def parse(cls, value):
+        """Parse a shard like 3/16, the index is 0-based."""
+        match = re.match(r'^(\d+)/(\d+)$', value.strip())
+        if not match:
+            raise ValueError('Invalid shard: %s, expected i/N.' % value)
+        return cls(int(match.group(1)), int(match.group(2)))
+
+    def __str__(self):
+        return '%d/%d' % (self.index, self.count)
+
+    def owns(self, sample_id):
+        return shard_of(sample_id, self.count) == self.index
+
+    def select(self, samples):
+        """Yield the samples of the shard."""
+        for sample in samples:
+            self.total += 1
+            if self.owns(sample.get('sample_id')):
+                self.selected += 1
+                yield sample
+
+
+class ShardSummary:
+    """A summary of the render of a shard, the summaries of shards are merged.
+
+    It is kept in <project>/.shards/<i>-of-<N>.json, or <archive>.shard.json.
+    """
+
+    def __init__(self, shard, samples_file):
+        self.shard = shard
+        self.samples_file = os.path.abspath(samples_file)
+        self.rendered = 0
+        self.skipped = 0
+        self.failed = []
+        self.start = time.time()
+
+    @staticmethod
+    def get_path(out, shard, archive=False):
+        if archive:
+            return '%s.shard.json' % out
+        return os.path.join(out, '.shards', '%d-of-%d.json' %
+                            (shard.index, shard.count))
+
+    def tally(self, results, path=None):
+        """Count the results, they are passed through.
+
+        :param path: Where to save the summary after the last result.
+        """
+        for result in results:
+            if result.skipped:
+                self.skipped += 1
+            elif result.ok:
+                self.rendered += 1
+            else:
+                self.failed.append(result.name)
+            yield result
+
+        if path:
+            self.save(path)
+
+    def to_dict(self):
+        stat = os.stat(self.samples_file)
+        return {'version': VERSION, 'shard': self.shard.index,
+                'count': self.shard.count, 'samples_file': self.samples_file,
+                'samples_stat': [stat.st_size, stat.st_mtime_ns],
+                'total': self.shard.total, 'selected': self.shard.selected,
+                'rendered': self.rendered, 'skipped': self.skipped,
+                'failed': self.failed, 'elapsed': time.time() - self.start}
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp_path = '%s.%s' % (path, uuid.uuid4().hex)
+        with open(tmp_path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
+        os.replace(tmp_path, path)
+
+
+def merge_shard_summaries(summaries):
+    """Merge the summaries of the shards of a render and check them.
+
+    :param summaries: A list of summaries, see ShardSummary.to_dict.
+    :return: The merged summary, its errors are empty when all shards of the
+             same samples file are rendered without failures.
+    """
+    errors = []
+    counts = set(summary['count'] for summary in summaries)
+    stats = set(tuple(summary['samples_stat']) for summary in summaries)
+    totals = set(summary['total'] for summary in summaries)
+    if len(counts) > 1:
+        errors.append('The shards are of different counts: %s.' %
+                      ', '.join(map(str, sorted(counts))))
+    if len(stats) > 1 or len(totals) > 1:
+        errors.append('The shards rendered different samples files.')
+
+    count = max(counts) if counts else 0
+    shards = sorted(set(summary['shard'] for summary in summaries))
+    missing = sorted(set(range(count)) - set(shards))
+    if missing:
+        errors.append('%d shards are missing: %s.' %
+                      (len(missing), ', '.join(map(str, missing))))
+    if len(shards) < len(summaries):
+        errors.append('Some shards are summarized more than once.')
+
+    merged = {'count': count, 'shards': len(shards),
+              'total': max(totals) if totals else 0}
+    for key in ('selected', 'rendered', 'skipped'):
+        merged[key] = sum(summary[key] for summary in summaries)
+    merged['failed'] = [name for summary in summaries
+                        for name in summary['failed']]
+    if merged['failed']:
+        errors.append('%d samples are not rendered.' % len(merged['failed']))
+    if (not missing and len(totals) == 1 and
+            merged['selected'] != merged['total']):
+        errors.append('%d samples are selected by the shards of %d samples.' %
+                      (merged['selected'], merged['total']))
+
+    merged['errors'] = errors
+    return merged
+
+
+class WorkQueue:
+    """Lease batches of samples to the workers of a project through files.
+
+    The files are kept in <project>/.queue/<run> on a shared POSIX filesystem,
+    a run is a render of the project by workers which join it:
+
+    - <batch>.lease is created exclusively by the worker which renders the
+      batch, its mtime is renewed by a heartbeat. A lease which is not
+      renewed for lease_ttl seconds has expired and can be reclaimed, a
+      worker only renews and removes the leases it owns.
+    - <batch>.done marks a rendered batch with the failed samples in it, it
+      is written by the first worker which completes the batch.
+    - total is the number of batches, config identifies the render.
+
+    Runs are numbered, the last one is the current run. A worker joins the
+    current run until all its batches are done, then it starts the next
+    one, so a render which is done never counts as rendered for a new one.
+    The runs done for more than lease_ttl seconds are removed.
+    """
+
+    def __init__(self, project_path, lease_ttl=300, worker_id=None):
+        self.root = os.path.join(project_path, '.queue')
+        self.run = None
+        self.path = None
+        self.lease_ttl = lease_ttl
+        self.worker_id = worker_id or '%s-%d-%s' % (
+            socket.gethostname(), os.getpid(), uuid.uuid4().hex[:8])
+        self._held = set()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._heartbeat = None
+
+    def _file(self, batch, suffix):
+        return os.path.join(self.path, '%d.%s' % (batch, suffix))
+
+    def _write(self, path, data):
+        tmp_path = '%s.%s' % (path, uuid.uuid4().hex)
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+
+    def _create(self, path, data):
+        """Create a file exclusively, False if it exists.
+
+        The file is written aside and linked in place, so that it is never
+        seen empty and the link is atomic on NFS too.
+        """
+        tmp_path = '%s.%s' % (path, uuid.uuid4().hex)
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f)
+        try:
+            os.link(tmp_path, path)
+        except FileExistsError:
+            return False
+        finally:
+            os.remove(tmp_path)
+        return True
+
+    def _owner(self, path):
+        """The worker which owns a lease, None if it is gone or unknown."""
+        try:
+            with open(path, 'r') as f:
+                return json.load(f).get('worker')
+        except (OSError, ValueError, AttributeError):
+            return None
+
+    def get_runs(self):
+        """The numbers of the runs of the project, the last is the current."""
+        try:
+            names = os.listdir(self.root)
+        except FileNotFoundError:
+            return []
+        return sorted(int(name) for name in names if name.isdigit())
+
+    def set_run(self, run):
+        self.run = run
+        self.path = os.path.join(self.root, str(run))
+
+    def _start_run(self, run, config):
+        """Start a run, False if another worker started it first.
+
+        The run is prepared aside and renamed in place, renaming a directory
+        onto a non-empty one fails, so only one worker can start it.
+        """
+        tmp_path = os.path.join(self.root, '.%d.%s' % (run, uuid.uuid4().hex))
+        os.makedirs(tmp_path)
+        with open(os.path.join(tmp_path, 'config'), 'w') as f:
+            json.dump(config, f)
+        try:
+            os.rename(tmp_path, os.path.join(self.root, str(run)))
+        except OSError:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            return False
+        return True
+
+    def _remove_runs(self, runs):
+        """Remove the runs done for more than lease_ttl seconds."""
+        for run in runs:
+            path = os.path.join(self.root, str(run))
+            try:
+                if not self._expired(os.stat(path).st_mtime):
+                    continue
+                # Rename first, a removed run is never seen partly removed.
+                removed_path = os.path.join(self.root, '.%d.%s.removed' %
+                                            (run, uuid.uuid4().hex))
+                os.rename(path, removed_path)
+            except OSError:
+                continue
+            shutil.rmtree(removed_path, ignore_errors=True)
+
+    def join(self, config):
+        """Join the current run of the render of config, or start a new one.
+
+        All workers of a run render the same samples in the same batches. A
+        new run is started when the current one is done.
+
+        :raise ValueError: The current run renders another config.
+        """
+        while True:
+            runs = self.get_runs()
+            if runs:
+                self.set_run(runs[-1])
+                try:
+                    with open(os.path.join(self.path, 'config'), 'r') as f:
+                        queued = json.load(f)
+                    done = self.is_done()
+                except FileNotFoundError:
+                    # Removed by a worker which started a new run.
+                    continue
+                if not done:
+                    if queued != config:
+                        raise ValueError('Another render is queued in %s, '
+                                         'remove it to start a new one.' %
+                                         self.path)
+                    return
+
+            run = runs[-1] + 1 if runs else 0
+            os.makedirs(self.root, exist_ok=True)
+            if self._start_run(run, config):
+                self.set_run(run)
+                self._remove_runs(runs)
+                return
+
+    def set_total(self, total):
+        self._write(os.path.join(self.path, 'total'), total)
+
+    def get_total(self):
+        try:
+            with open(os.path.join(self.path, 'total'), 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _expired(self, mtime):
+        return mtime + self.lease_ttl < time.time()
+
+    def claim(self, batch):
+        """Lease a batch which is not done and not leased, or whose lease
+        expired."""
+        if os.path.exists(self._file(batch, 'done')):
+            return False
+
+        lease = self._file(batch, 'lease')
+        owner = {'worker': self.worker_id}
+        if not self._create(lease, owner) and not self._reclaim(batch, owner):
+            return False
+
+        # The batch may be completed and its lease released since it was
+        # checked above, it must not be rendered again.
+        if os.path.exists(self._file(batch, 'done')):
+            os.remove(lease)
+            return False
+
+        with self._lock:
+            self._held.add(batch)
+        return True
+
+    def _reclaim(self, batch, owner):
+        """Lease a batch whose lease expired, see claim."""
+        lease = self._file(batch, 'lease')
+        try:
+            mtime = os.stat(lease).st_mtime_ns
+        except FileNotFoundError:
+            return False
+        if not self._expired(mtime / 1e9):
+            return False
+
+        # Only one worker can take the token of an expired lease. It is
+        # removed once the lease is replaced, the new lease has another mtime.
+        token = '%s.%d.reclaim' % (lease, mtime)
+        if not self._create(token, owner):
+            return False
+        try:
+            try:
+                if os.stat(lease).st_mtime_ns == mtime:
+                    os.remove(lease)
+            except FileNotFoundError:
+                pass
+            if not self._create(lease, owner):
+                return False
+        finally:
+            os.remove(token)
+        logger.warning('Reclaim the expired lease of batch %d.' % batch)
+        return True
+
+    def complete(self, batch, samples, failed):
+        """Mark a leased batch as done and release its lease.
+
+        A batch whose lease was reclaimed may be completed twice, the record
+        of the first worker is kept.
+        """
+        self._create(self._file(batch, 'done'), {
+            'worker': self.worker_id, 'samples': samples, 'failed': failed})
+        self.release(batch)
+
+    def release(self, batch):
+        """Remove the lease of a batch if this worker still owns it.
+
+        The lease is renamed aside before its owner is checked, so the lease
+        of a worker which reclaimed the batch is linked back, never removed.
+        """
+        with self._lock:
+            self._held.discard(batch)
+        lease = self._file(batch, 'lease')
+        tmp_path = '%s.%s.release' % (lease, uuid.uuid4().hex)
+        try:
+            os.rename(lease, tmp_path)
+        except FileNotFoundError:
+            return
+        try:
+            if self._owner(tmp_path) != self.worker_id:
+                try:
+                    os.link(tmp_path, lease)
+                except FileExistsError:
+                    pass
+        finally:
+            os.remove(tmp_path)
+
+    def renew(self):
+        with self._lock:
+            held = list(self._held)
+        for batch in held:
+            lease = self._file(batch, 'lease')
+            if self._owner(lease) != self.worker_id:
+                # Reclaimed by another worker, its lease is not renewed.
+                logger.warning('The lease of batch %d is lost.' % batch)
+                with self._lock:
+                    self._held.discard(batch)
+                continue
+            try:
+                os.utime(lease)
+            except FileNotFoundError:
+                pass
+
+    def start(self):
+        """Start the heartbeat which renews the leases of this worker."""
+        def heartbeat():
+            while not self._stopped.wait(self.lease_ttl / 4.0):
+                self.renew()
+
+        self._stopped.clear()
+        self._heartbeat = threading.Thread(target=heartbeat, daemon=True)
+        self._heartbeat.start()
+
+    def stop(self):
+        """Stop the heartbeat and release the leases of unfinished batches."""
+        self._stopped.set()
+        if self._heartbeat is not None:
+            self._heartbeat.join()
+        for batch in list(self._held):
+            self.release(batch)
+
+    def get_pending(self):
+        """The batches which are not done, None until the total is known."""
+        total = self.get_total()
+        if total is None:
+            return None
+        names = set(os.listdir(self.path))
+        return [batch for batch in range(total)
+                if '%d.done' % batch not in names]
+
+    def is_done(self):
+        return self.get_pending() == []
+
+    def wait(self, poll_interval=5):
+        """The completion barrier, wait until all batches are done.
+
+        :return: True when all batches are done, False when a batch can be
+                 claimed, i.e. its lease expired or was released.
+        """
+        while True:
+            pending = self.get_pending()
+            if pending is not None:
+                if not pending:
+                    return True
+
+                for batch in pending:
+                    try:
+                        mtime = os.stat(self._file(batch, 'lease')).st_mtime
+                    except FileNotFoundError:
+                        return False
+                    if self._expired(mtime):
+                        return False
+
+            time.sleep(poll_interval)
+
+    def summary(self):
+        """Merge the done batches."""
+        total = self.get_total() or 0
+        samples = 0
+        failed = []
+        for batch in range(total):
+            try:
+                with open(self._file(batch, 'done'), 'r') as f:
+                    done = json.load(f)
+            except (OSError, ValueError):
+                continue
+            samples += done['samples']
+            failed.extend(done['failed'])
+        return {'batches': total, 'samples': samples, 'failed': failed}
+
+
+def render_worker(app_dir, read_samples, project_path, queue,
+                  project_name=None, batch_size=64, poll_interval=5,
+                  **options):
+    """Render a project cooperatively with other workers, see WorkQueue.
+
+    The samples are split into batches by their position in the samples
+    file. Every worker reads the file and renders the batches it leases. A
+    worker which reaches the end of the file reads it again for the batches
+    of dead workers (with expired leases), until all batches are done.
+
+    :param read_samples: A function which returns an iterable of the samples,
+                         the samples must be the same for all workers.
+    :param queue: A WorkQueue of the project which joined a run, see
+                  WorkQueue.join.
+    :param options: See render_project, the manifest is not used.
+    :return: A generator of RenderResult of the samples of this worker.
+    """
+    queue.start()
+    try:
+        while True:
+            batches = deque()
+
+            def leased_samples():
+                samples = iter(read_samples())
+                batch = 0
+                while True:
+                    chunk = list(islice(samples, batch_size))
+                    if not chunk:
+                        break
+                    if queue.claim(batch):
+                        # The batch, its samples, unrendered samples and
+                        # failed samples.
+                        batches.append([batch, len(chunk), len(chunk), []])
+                        for sample in chunk:
+                            yield sample
+                    batch += 1
+                queue.set_total(batch)
+
+            for result in render_project(app_dir, leased_samples(),
+                                         project_path,
+                                         project_name=project_name,
+                                         manifest=False, **options):
+                batch, samples, unrendered, failed = current = batches[0]
+                current[2] -= 1
+                if not result.ok:
+                    failed.append(result.name)
+                if current[2] == 0:
+                    queue.complete(batch, samples, failed)
+                    batches.popleft()
+                yield result
+
+            if queue.wait(poll_interval):
+                break
+    finally:
+        queue.stop()
+
+
+def log_results(results):
+    """Log the results of render_project.
+
+    :return: The number of failed samples.
+    """
+    failed = 0
+    skipped = 0
+    for result in results:
+        if result.skipped:
+            skipped += 1
+        elif result.ok:
+            logger.info('Render %s successfully.' % result.name)
+        else:
+            failed += 1
+            logger.error('Render %s unsuccessfully: %s' %
+                         (result.name, result.error))
+
+    if skipped:
+        logger.info('Skip %d unchanged samples.' % skipped)
+    return failed
+
+
+def report_results(results):
+    """Log the results of render_project, exit with RENDER_FAILED if any
+    sample failed."""
+    failed = log_results(results)
+    if failed:
+        logger.critical('%d samples are not rendered.' % failed)
+        sys.exit(RENDER_FAILED)
+
+
+def render_worker_cli(app_dir, samples, project_path, project_name,
+                      read_samples, sample_ids, missing_samples, batch_size=64,
+                      lease_ttl=300, **options):
+    """Run render --worker, see render_worker."""
+    stat = os.stat(samples)
+    render_digest = get_render_digest(
+        app_dir, project_name, link_mode=options.get('link_mode', 'copy'),
+        inputs_format=options.get('inputs_format', 'raw'))
+    queue = WorkQueue(project_path, lease_ttl=lease_ttl)
+    try:
+        queue.join({'samples_file': os.path.abspath(samples),
+                    'samples_stat': [stat.st_size, stat.st_mtime_ns],
+                    'batch_size': batch_size, 'only': sample_ids,
+                    'render_digest': render_digest})
+    except ValueError as err:
+        logger.critical(str(err))
+        sys.exit(2)
+
+    # The workers do not keep the manifests, an incremental render must not
+    # trust the ones of an earlier render either.
+    for path in RenderManifest(project_path).get_paths():
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    # A batch of a dead worker may be rendered partly, it is overwritten.
+    log_results(render_worker(app_dir, read_samples, project_path, queue,
+                              project_name=project_name, batch_size=batch_size,
+                              poll_interval=min(5.0, lease_ttl / 10.0),
+                              force=True, **options))
+
+    # Every worker reads all samples, the missing ones are known to all.
+    summary = queue.summary()
+    failed = summary['failed'] + [result.name for result in missing_samples()]
+    logger.info('All %d batches of %d samples are rendered.' %
+                (summary['batches'], summary['samples']))
+    if failed:
+        logger.critical('%d samples are not rendered: %s' %
+                        (len(failed), ', '.join(failed)))
+        sys.exit(RENDER_FAILED)
+
+
+def validate_shard(ctx, param, value):
+    try:
+        return Shard.parse(value) if value else None
+    except ValueError as err:
+        raise click.BadParameter(str(err))
+
+
 @render_cli.command()
 @click.argument('app_name')
 @click.argument('samples', type=click.Path(exists=True))
@@ -808,59 +4035,320 @@ def render_cli():
               type=click.Path(exists=True))
 @click.option('--project-name', '-p', help='Your project name. (default: None)', type=str, required=True)
 @click.option('--force', '-f', help='Force to overwrite files. (default: False)', is_flag=True)
-def render(app_name, samples, base_dir, work_dir, project_name, force):
+@click.option('--link-mode', '-l', default='copy',
+              type=click.Choice(LINK_MODES),
+              help='How to place the tasks directory and the defaults file '
+                   'into sample directories, linked files are shared with the '
+                   'app. Fall back to copy when unsupported. (default: copy)')
+@click.option('--jobs', '-j', default=1, type=click.IntRange(min=1),
+              help='The number of processes to render samples. (default: 1)')
+@click.option('--incremental', '-i', is_flag=True,
+              help='Only render the samples which are changed since the last '
+                   'render, changed samples are overwritten. (default: False)')
+@click.option('--preflight', is_flag=True,
+              help='Validate the samples file and dry-render all samples '
+                   'before writing any file, report all errors at once. '
+                   '(default: False)')
+@click.option('--archive', '-a',
+              type=click.Path(dir_okay=False, allow_dash=True),
+              help='Write the whole project into an archive file instead of '
+                   'the working directory, - for stdout. (default: None)')
+@click.option('--archive-format', type=click.Choice(ARCHIVE_FORMATS),
+              help='The format of the archive. (default: from the suffix of '
+                   'the archive file, or tar)')
+@click.option('--inputs-format', default='raw',
+              type=click.Choice(INPUTS_FORMATS),
+              help='Write the inputs as rendered, or as canonical (sorted and '
+                   'indented) or minified JSON. (default: raw)')
+@click.option('--in-flight', default=0, type=click.IntRange(min=0),
+              help='Write files in N threads while rendering the next '
+                   'samples, at most N samples are in flight. It helps on a '
+                   'slow filesystem, e.g. NFS. (default: 0, disabled)')
+@click.option('--only', multiple=True,
+              help='Only render the samples with these sample_ids, separated '
+                   'by commas. The rows are read from an index of the samples '
+                   'file kept in the cache. (default: all samples)')
+@click.option('--only-file', type=click.Path(exists=True, dir_okay=False),
+              help='Only render the samples with the sample_ids in a file, '
+                   'one per line, see --only. (default: None)')
+@click.option('--shard', callback=validate_shard,
+              help='Only render the shard i (0-based) of N shards, e.g. '
+                   '$SLURM_ARRAY_TASK_ID/16. Samples are assigned by a stable '
+                   'hash of sample_id and a summary of the shard is written, '
+                   'see check-shards. (default: None)')
+@click.option('--worker', is_flag=True,
+              help='Render the project together with any number of workers on '
+                   'other nodes, which lease batches of samples through files '
+                   'in the project directory. A worker exits when all samples '
+                   'are rendered, a worker started later renders the project '
+                   'again. (default: False)')
+@click.option('--batch-size', default=64, type=click.IntRange(min=1),
+              help='The number of samples in a batch of --worker. '
+                   '(default: 64)')
+@click.option('--lease-ttl', default=300, type=click.FloatRange(min=1),
+              help='The seconds after which the lease of a batch of a dead '
+                   'worker can be reclaimed. (default: 300)')
+@click.option('--profile-stages', type=click.Path(dir_okay=False),
+              help='Write the time spent and the bytes written in every '
+                   'stage of the render (parse, defaults, render, check_json, '
+                   'write, copy, zip, archive) with percentiles per sample, '
+                   'as JSON, or CSV if the path ends with .csv. '
+                   '(default: None)')
+def render(app_name, samples, base_dir, work_dir, project_name, force,
+           link_mode, jobs, incremental, preflight, archive, archive_format,
+           inputs_format, in_flight, only, only_file, shard, worker,
+           batch_size, lease_ttl, profile_stages):
     """
     Render as a pipeline based on the specified app template.
     """
+    # The options are checked before any sample is read.
+    if worker and (archive or incremental or shard):
+        raise click.UsageError('--worker cannot be used with --archive, '
+                               '--incremental or --shard.')
+    if archive and incremental:
+        raise click.UsageError('--incremental cannot be used with --archive.')
+    if archive:
+        archive_format = archive_format or get_archive_format(archive)
+        if archive_format == 'tar.zst':
+            try:
+                import_zstandard()
+            except ImportError as err:
+                logger.critical(str(err))
+                sys.exit(2)
+
     samples_file = click.format_filename(samples)
     app_dir = os.path.join(base_dir, app_name)
     project_path = os.path.join(work_dir, project_name)
 
-    samples_data = parse_samples(samples)
-
-    for sample in samples_data:
-        if 'sample_id' not in sample.keys():
-            raise Exception("Your samples file must contain sample_id column.")
+    try:
+        with stage('parse'):
+            sample_columns = read_sample_columns(samples)
+    except (ValueError, ImportError) as err:
+        logger.critical(str(err))
+        sys.exit(2)
+
+    if sample_columns is not None:
+        # Columnar samples are validated as a whole before any sample is
+        # rendered.
+        errors = sample_columns.validate(
+            required=get_all_variables(app_dir, no_default=True))
+        for error in errors:
+            logger.error(error)
+        if errors:
+            logger.critical('%d errors in the samples file, nothing is '
+                            'rendered.' % len(errors))
+            sys.exit(RENDER_FAILED)
+
+    sample_ids = [sample_id.strip() for value in only
+                  for sample_id in value.split(',') if sample_id.strip()]
+    if only_file:
+        sample_ids.extend(read_sample_ids(only_file))
+    sample_ids = list(dict.fromkeys(sample_ids))
+    found = set()
+
+    def read_samples(shard=None):
+        # Samples are streamed, a large samples file is never loaded into
+        # memory.
+        columns = iter(sample_columns) if sample_columns is not None else None
+        if sample_ids:
+            samples_data = select_found(select_samples(samples, sample_ids,
+                                                       samples=columns))
+        else:
+            samples_data = columns
+            if samples_data is None:
+                samples_data = iter_samples(samples)
+        if shard:
+            samples_data = shard.select(samples_data)
+        if _memory_tracer:
+            samples_data = staged('parse', samples_data)
+        return samples_data
+
+    def select_found(selected):
+        for sample in selected:
+            found.add(str(sample.get('sample_id')))
+            yield sample
+
+    def missing_samples():
+        # It is only evaluated after all selected samples are rendered.
+        for sample_id in sample_ids:
+            if sample_id not in found and (not shard or shard.owns(sample_id)):
+                yield RenderResult(sample_id, 0,
+                                   error='not in the samples file.')
+
+    if preflight:
+        preflight_shard = Shard(shard.index, shard.count) if shard else None
+        errors = preflight_samples(app_dir, project_name,
+                                   read_samples(preflight_shard), jobs=jobs,
+                                   link_mode=link_mode,
+                                   inputs_format=inputs_format)
+        for error in errors:
+            logger.error(error)
+        if errors:
+            logger.critical('Preflight failed with %d errors, nothing is '
+                            'rendered.' % len(errors))
+            sys.exit(RENDER_FAILED)
+
+    # The report is saved even when samples failed.
+    profiler = StageProfiler() if profile_stages else None
+    try:
+        if worker:
+            render_worker_cli(app_dir, samples, project_path, project_name,
+                              read_samples, sample_ids, missing_samples,
+                              batch_size=batch_size, lease_ttl=lease_ttl,
+                              link_mode=link_mode, jobs=jobs,
+                              inputs_format=inputs_format, in_flight=in_flight,
+                              profiler=profiler)
+            return
+
+        samples_data = read_samples(shard)
+
+        if archive:
+            out = archive
         else:
-            # 用户可通过samples文件覆写default文件中已定义的变量
-            # 只有samples文件中缺少的变量才从default文件中取值
-            app_default_var = AppDefaultVar(app_dir)
-            all_default_value = app_default_var.show_default_value()
+            out = project_path
+
+        # Results are reported in the order of the samples file.
+        results = render_project(app_dir, samples_data, out,
+                                 project_name=project_name, force=force,
+                                 link_mode=link_mode, jobs=jobs,
+                                 incremental=incremental,
+                                 archive_format=archive_format,
+                                 inputs_format=inputs_format,
+                                 in_flight=in_flight, profiler=profiler,
+                                 shard=shard)
+        results = chain(results, missing_samples())
+        if shard and out != '-':
+            summary = ShardSummary(shard, samples)
+            results = summary.tally(results, ShardSummary.get_path(
+                out, shard, archive=bool(archive)))
+        report_results(results)
+    finally:
+        if profiler is not None:
+            profiler.save(profile_stages)
+            logger.info('The stages of the render are saved in %s.' %
+                        profile_stages)
+
+
+@render_cli.command('check-shards')
+@click.argument('paths', nargs=-1, required=True, type=click.Path(exists=True))
+def check_shards(paths):
+    """
+    Merge and check the summaries of a sharded render, from project
+    directories or summary files.
+    """
+    summaries = []
+    for path in paths:
+        if os.path.isdir(path):
+            shards_dir = os.path.join(path, '.shards')
+            files = [os.path.join(shards_dir, filename)
+                     for filename in sorted(os.listdir(shards_dir))
+                     if filename.endswith('.json')] \
+                if os.path.isdir(shards_dir) else []
+        else:
+            files = [path]
 
-            for key in all_default_value.keys():
-                if key not in sample.keys():
-                    sample[key] = all_default_value.get(key)
+        for filepath in files:
+            with open(filepath, 'r') as f:
+                summaries.append(json.load(f))
+
+    merged = merge_shard_summaries(summaries)
+    print(json.dumps(merged, indent=2))
+    for error in merged['errors']:
+        logger.error(error)
+    if merged['errors'] or not summaries:
+        sys.exit(RENDER_FAILED)
+
+
+def parse_size(size):
+    """Parse a size like 512K, 100M or 2G into bytes."""
+    units = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+    match = re.match(r'^(\d+)([KMGT]?)B?$', str(size).strip().upper())
+    if not match:
+        raise ValueError('Invalid size: %s' % size)
+    number, unit = match.groups()
+    return int(number) * units[unit]
 
-            # make project_name/sample_id directory
-            sample_path = os.path.join(project_path, sample.get('sample_id'))
-            check_dir(sample_path, skip=force)
 
-            sample['project_name'] = project_name
+def validate_size(ctx, param, value):
+    try:
+        return parse_size(value)
+    except ValueError as err:
+        raise click.BadParameter(str(err))
+
 
-            # inputs
-            inputs = render_app_file(app_dir, 'inputs', sample)
-            check_json(string=inputs)  # Json Syntax Checker
-            write(sample_path, 'inputs', inputs)
-            inputs_path = os.path.join(sample_path, 'inputs')
+@click.group()
+def cache_cli():
+    pass
+
+
+@cache_cli.group()
+def cache():
+    """
+    Manage the caches of app-utility.
+    """
+
+
+@cache.command()
+@click.option('--cache-dir', '-c', default=DEFAULT_CACHE_DIR,
+              help='The cache directory.', type=click.Path())
+@click.option('--max-zip-size', default='1G', callback=validate_size,
+              help='The size limit of dependencies zip files. (default: 1G)')
+@click.option('--max-bytecode-size', default='64M', callback=validate_size,
+              help='The size limit of compiled templates. (default: 64M)')
+@click.option('--max-index-size', default='256M', callback=validate_size,
+              help='The size limit of samples file indexes. (default: 256M)')
+def gc(cache_dir, max_zip_size, max_bytecode_size, max_index_size):
+    """
+    Evict the least recently used cache entries.
+    """
+    zip_count = prune_cache_dir(os.path.join(cache_dir, 'zips'), max_zip_size)
+    bytecode_count = prune_cache_dir(os.path.join(cache_dir, 'bytecode'),
+                                     max_bytecode_size)
+    index_count = prune_cache_dir(os.path.join(cache_dir, 'index'),
+                                  max_index_size)
+    print('Evict %d dependencies zip files, %d compiled templates and %d '
+          'samples file indexes.' % (zip_count, bytecode_count, index_count))
 
-            # workflow.wdl
-            wdl = render_app_file(app_dir, 'workflow.wdl', sample)
-            write(sample_path, 'workflow.wdl', wdl)
-            wdl_path = os.path.join(sample_path, 'workflow.wdl')
 
-            # defaults
-            src_defaults_file = os.path.join(app_dir, 'defaults')
-            dest_defaults_file = os.path.join(sample_path, 'defaults')
-            copy_and_overwrite(src_defaults_file,
-                               dest_defaults_file, is_file=True)
+@click.group()
+def serve_cli():
+    pass
 
-            src_dependencies = os.path.join(app_dir, 'tasks')
-            dest_dependencies = os.path.join(sample_path, 'tasks')
-            copy_and_overwrite(src_dependencies, dest_dependencies)
 
-            # dependencies zip file
-            zip_output = generate_dependencies_zip(src_dependencies)
-            shutil.copy2(zip_output, sample_path)
+@serve_cli.command()
+@click.option('--socket', '-s', 'socket_path', default=DEFAULT_SOCKET_PATH,
+              help='The Unix domain socket to listen on. (default: %s)' %
+                   DEFAULT_SOCKET_PATH)
+@click.option('--base-dir', '-b', default=DEFAULT_APP_ROOT_DIR,
+              help='The base directory for your apps.',
+              type=click.Path(exists=True))
+@click.option('--work-dir', '-w', default=DEFAULT_PROJECT_ROOT_DIR,
+              help='The default working directory for your pipelines.',
+              type=click.Path(exists=True))
+def serve(socket_path, base_dir, work_dir):
+    """
+    Serve render, list and validate requests with warm caches.
+    """
+    from biominer_app_util.serve import RenderServer, is_serving
+
+    if os.path.exists(socket_path):
+        if is_serving(socket_path):
+            logger.critical('A daemon is already listening on %s.' %
+                            socket_path)
+            sys.exit(2)
+        # A stale socket of a daemon which is gone.
+        os.remove(socket_path)
+    check_dir(os.path.dirname(os.path.abspath(socket_path)), skip=True)
+
+    server = RenderServer(socket_path, base_dir=base_dir, work_dir=work_dir)
+    try:
+        apps = server.warm_up()
+        logger.info('Serve %d apps on %s.' % (len(apps), socket_path))
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
 
 
 @click.group()
@@ -895,8 +4383,32 @@ def test(project_name, data_dict_file, wdl_dir,
                  cromwell_jar_file=cromwell_jar_file, output_dir=output_dir)
 
 
+@click.pass_context
+def trace_memory(ctx, trace_memory):
+    if trace_memory:
+        tracer = MemoryTracer()
+        tracer.start()
+
+        def save():
+            tracer.save(trace_memory)
+            tracer.stop()
+            logger.info('The memory of the stages is saved in %s.' %
+                        trace_memory)
+
+        # The report is saved when the command exits, also when it fails.
+        ctx.call_on_close(save)
+
+
 main = click.CommandCollection(
-    sources=[apps_cli, install_cli, uninstall_cli, render_cli, version_cli, test_cli])
+    sources=[apps_cli, install_cli, uninstall_cli, render_cli, version_cli,
+             test_cli, cache_cli, serve_cli],
+    params=[click.Option(
+        ['--trace-memory'], type=click.Path(dir_okay=False),
+        help='Trace the memory with tracemalloc and write the peak memory and '
+             'the top allocation sites of every stage (parse, render, zip, '
+             'extract and so on) into a JSON file. It slows down the command, '
+             'the processes of --jobs are not traced. (default: None)')],
+    callback=trace_memory)
 
 if __name__ == '__main__':
     main()
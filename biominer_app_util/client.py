@@ -0,0 +1,110 @@
+"""A client of the render daemon (biominer-app-util serve).
+
+It only depends on the standard library. Requests and responses are JSON
+objects, one per line, a connection can send any number of requests::
+
+    {"command": "render", "app_name": "demo", "project_name": "proj",
+     "samples": [{"sample_id": "S1"}], "dry_run": true}
+
+Commands are ping, list, validate and render, see biominer_app_util.serve.
+
+Usage:
+    python -m biominer_app_util.client [--socket PATH] COMMAND [KEY=VALUE ...]
+"""
+
+import os
+import sys
+import json
+import socket
+
+DEFAULT_SOCKET_PATH = os.environ.get(
+    'BIOMINER_SOCKET', os.path.expanduser('~/.biominer/serve.sock'))
+
+
+class Client:
+    """A connection to the render daemon, it is reused by all requests."""
+
+    def __init__(self, socket_path=None, timeout=None):
+        self.socket_path = socket_path or DEFAULT_SOCKET_PATH
+        self.timeout = timeout
+        self._sock = None
+        self._file = None
+
+    def connect(self):
+        if self._sock is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            sock.connect(self.socket_path)
+            self._sock = sock
+            self._file = sock.makefile('rwb')
+
+    def request(self, command, **params):
+        """Send a request and wait for the response.
+
+        :param command: ping, list, validate or render.
+        :param params: The parameters of the command.
+        :return: The response, response['ok'] is False when the request failed.
+        """
+        self.connect()
+        params['command'] = command
+        self._file.write(json.dumps(params).encode('utf-8') + b'\n')
+        self._file.flush()
+        line = self._file.readline()
+        if not line:
+            self.close()
+            raise ConnectionError('The render daemon closed the connection.')
+        return json.loads(line)
+
+    def close(self):
+        if self._sock is not None:
+            self._file.close()
+            self._sock.close()
+            self._sock = None
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def request(command, socket_path=None, timeout=None, **params):
+    """Send a single request to the render daemon, see Client.request."""
+    with Client(socket_path, timeout=timeout) as client:
+        return client.request(command, **params)
+
+
+def parse_value(value):
+    try:
+        return json.loads(value)
+    except ValueError:
+        return value
+
+
+def main(argv=None):
+    args = list(sys.argv[1:] if argv is None else argv)
+    socket_path = None
+    if args[:1] == ['--socket']:
+        socket_path = args[1]
+        args = args[2:]
+
+    if not args:
+        print(__doc__.strip().splitlines()[-1])
+        return 2
+
+    params = dict()
+    for arg in args[1:]:
+        key, sep, value = arg.partition('=')
+        if not sep:
+            print('Invalid parameter %s, expected KEY=VALUE.' % arg)
+            return 2
+        params[key] = parse_value(value)
+
+    response = request(args[0], socket_path=socket_path, **params)
+    print(json.dumps(response, indent=2))
+    return 0 if response.get('ok') else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
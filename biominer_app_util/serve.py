@@ -0,0 +1,147 @@
+"""The render daemon (biominer-app-util serve), see biominer_app_util.client.
+
+It is only imported by the serve command, so the other commands do not
+pay for socketserver at startup.
+"""
+
+import os
+import json
+import socket
+import socketserver
+import threading
+
+from biominer_app_util.cli import (
+    DEFAULT_APP_ROOT_DIR, DEFAULT_PROJECT_ROOT_DIR, VERSION, InValidApp,
+    dry_render_sample, get_render_digest, get_template_engine, is_valid_app,
+    iter_samples, listapps, logger, preflight_samples, render_project)
+
+
+class RenderRequestHandler(socketserver.StreamRequestHandler):
+    """Answer the JSON Lines requests of a connection, see the client."""
+
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+
+            try:
+                request = json.loads(line)
+                response = self.server.dispatch(request)
+            except Exception as err:
+                response = {'ok': False, 'error': str(err)}
+            data = json.dumps(response, default=str).encode('utf-8')
+            self.wfile.write(data + b'\n')
+            self.wfile.flush()
+
+
+class RenderServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Serve render, list and validate requests over a Unix domain socket.
+
+    The caches of the process (templates, defaults and dependencies) stay warm
+    between requests. Requests which render are serialized, rendering is CPU
+    bound and zip_dependencies changes the working directory.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, socket_path, base_dir=DEFAULT_APP_ROOT_DIR,
+                 work_dir=DEFAULT_PROJECT_ROOT_DIR):
+        self.base_dir = base_dir
+        self.work_dir = work_dir
+        self.render_lock = threading.Lock()
+        super().__init__(socket_path, RenderRequestHandler)
+
+    def server_bind(self):
+        super().server_bind()
+        # Only the owner can render files as the owner.
+        os.chmod(self.server_address, 0o600)
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+
+    def warm_up(self):
+        """Compile the templates of all installed apps."""
+        apps = listapps(self.base_dir)
+        for app_name in apps:
+            engine = get_template_engine(os.path.join(self.base_dir, app_name))
+            for template_file in ('inputs', 'workflow.wdl'):
+                try:
+                    engine.get_template(template_file)
+                except Exception as err:
+                    logger.warning('Cannot compile %s of %s: %s' %
+                                   (template_file, app_name, str(err)))
+        return apps
+
+    def dispatch(self, request):
+        request = dict(request)
+        command = request.pop('command', None)
+        handler = getattr(self, 'do_%s' % command, None)
+        if handler is None:
+            raise ValueError('Unknown command: %s' % command)
+        return handler(**request)
+
+    def get_app_dir(self, app_name):
+        app_dir = os.path.join(self.base_dir, app_name)
+        if os.path.relpath(app_dir, self.base_dir).startswith(os.pardir):
+            raise InValidApp('%s is not a valid app.' % app_name)
+        is_valid_app(app_dir)
+        return app_dir
+
+    def do_ping(self):
+        return {'ok': True, 'version': VERSION}
+
+    def do_list(self):
+        return {'ok': True, 'apps': listapps(self.base_dir)}
+
+    def do_validate(self, app_name, samples, project_name,
+                    inputs_format='raw'):
+        app_dir = self.get_app_dir(app_name)
+        if isinstance(samples, str):
+            samples = iter_samples(samples, is_terminal=False)
+
+        with self.render_lock:
+            errors = preflight_samples(app_dir, project_name, samples,
+                                       inputs_format=inputs_format)
+        return {'ok': not errors, 'errors': errors}
+
+    def do_render(self, app_name, samples, project_name, work_dir=None,
+                  dry_run=False, force=False, link_mode='copy',
+                  incremental=False, inputs_format='raw'):
+        app_dir = self.get_app_dir(app_name)
+        with self.render_lock:
+            if dry_run:
+                if isinstance(samples, str):
+                    samples = iter_samples(samples, is_terminal=False)
+                render_digest = get_render_digest(app_dir, project_name,
+                                                  inputs_format=inputs_format)
+                results = [dry_render_sample(row_sample, app_dir, project_name,
+                                             keep_outputs=True,
+                                             render_digest=render_digest,
+                                             inputs_format=inputs_format)
+                           for row_sample in enumerate(samples, 1)]
+            else:
+                project_path = os.path.join(work_dir or self.work_dir,
+                                            project_name)
+                results = list(render_project(app_dir, samples, project_path,
+                                              project_name=project_name,
+                                              force=force, link_mode=link_mode,
+                                              incremental=incremental,
+                                              inputs_format=inputs_format))
+
+        results = [result.to_dict() for result in results]
+        return {'ok': all(result['ok'] for result in results),
+                'results': results}
+
+
+def is_serving(socket_path):
+    """Whether a daemon is listening on socket_path."""
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+        return True
+    except OSError:
+        return False
+    finally:
+        sock.close()
@@ -15,6 +15,12 @@ requirements = ['Click>=7.0', 'Jinja2==2.11.1', 'markupsafe==2.0.1',
 
 test_requirements = []
 
+extras_requirements = {
+    'orjson': ['orjson'],
+    'pyarrow': ['pyarrow'],
+    'zstd': ['zstandard'],
+}
+
 setup(
     author="Jingcheng Yang",
     author_email='yjcyxky@163.com',
@@ -37,6 +43,7 @@ setup(
         ],
     },
     install_requires=requirements,
+    extras_require=extras_requirements,
     license="MIT license",
     long_description=readme + '\n\n' + history,
     include_package_data=True,
@@ -0,0 +1,1052 @@
+#!/usr/bin/env python
+
+"""Tests for `biominer_app_util.cli` module."""
+
+
+import io
+import csv
+import os
+import sys
+import json
+import time
+import pickle
+import subprocess
+import shutil
+import tarfile
+import zipfile
+import tempfile
+import threading
+import tracemalloc
+import unittest
+from click.testing import CliRunner
+
+from biominer_app_util import cli, client, serve
+
+
+def make_app(app_dir):
+    """Create a minimal app under app_dir."""
+    os.makedirs(os.path.join(app_dir, 'tasks'))
+    with open(os.path.join(app_dir, 'inputs'), 'w') as f:
+        f.write('{"wf.sample_id": "{{ sample_id }}", '
+                '"wf.reads": "{{ reads }}", "wf.genome": "{{ genome }}"}\n')
+    with open(os.path.join(app_dir, 'workflow.wdl'), 'w') as f:
+        f.write('import "tasks/align.wdl" as align\n\n'
+                'workflow {{ project_name }} {\n  call align.align {}\n}\n')
+    with open(os.path.join(app_dir, 'tasks', 'align.wdl'), 'w') as f:
+        f.write('task align {\n  command {\n    echo align\n  }\n}\n')
+    with open(os.path.join(app_dir, 'defaults'), 'w') as f:
+        json.dump({'genome': 'hg38'}, f)
+
+
+class TestRender(unittest.TestCase):
+    """Tests for rendering apps."""
+
+    def setUp(self):
+        """Set up an app root, a work directory and a samples file."""
+        self.tmpdir = tempfile.mkdtemp()
+        self.base_dir = os.path.join(self.tmpdir, 'apps')
+        self.work_dir = os.path.join(self.tmpdir, 'projects')
+        os.makedirs(self.work_dir)
+        self.app_dir = os.path.join(self.base_dir, 'demo')
+        make_app(self.app_dir)
+        self.samples = os.path.join(self.tmpdir, 'samples.csv')
+        with open(self.samples, 'w') as f:
+            f.write('sample_id,reads\nS1,s1.fq\nS2,s2.fq\n')
+        self.cache_dir = cli.DEFAULT_CACHE_DIR
+        cli.DEFAULT_CACHE_DIR = os.path.join(self.tmpdir, 'cache')
+
+    def tearDown(self):
+        """Remove the temporary directory."""
+        cli.DEFAULT_CACHE_DIR = self.cache_dir
+        cli._template_engines.clear()
+        shutil.rmtree(self.tmpdir)
+
+    def invoke_render(self, *args):
+        runner = CliRunner()
+        return runner.invoke(cli.main, [
+            'render', 'demo', self.samples, '-b', self.base_dir,
+            '-w', self.work_dir, '-p', 'proj'] + list(args))
+
+    def test_render_samples(self):
+        """Render every sample of a samples file."""
+        result = self.invoke_render()
+        assert result.exit_code == 0, result.output
+        for sample_id, reads in (('S1', 's1.fq'), ('S2', 's2.fq')):
+            sample_path = os.path.join(self.work_dir, 'proj', sample_id)
+            with open(os.path.join(sample_path, 'inputs')) as f:
+                inputs = json.load(f)
+            assert inputs == {'wf.sample_id': sample_id, 'wf.reads': reads,
+                              'wf.genome': 'hg38'}
+            for name in ('workflow.wdl', 'defaults', 'tasks.zip',
+                         os.path.join('tasks', 'align.wdl')):
+                assert os.path.isfile(os.path.join(sample_path, name))
+
+    def test_template_engine_is_cached(self):
+        """Compile a template once and recompile it when it changes."""
+        engine = cli.get_template_engine(self.app_dir)
+        assert engine is cli.get_template_engine(self.app_dir + '/')
+        template = engine.get_template('workflow.wdl')
+        assert engine.get_template('workflow.wdl') is template
+
+        wdl_path = os.path.join(self.app_dir, 'workflow.wdl')
+        with open(wdl_path, 'w') as f:
+            f.write('workflow changed {}\n')
+        mtime = os.path.getmtime(wdl_path) + 10
+        os.utime(wdl_path, (mtime, mtime))
+        assert engine.render('workflow.wdl', {}) == 'workflow changed {}'
+
+    def test_bytecode_cache(self):
+        """Reuse compiled templates saved by a previous process."""
+        cli.render_app_file(self.app_dir, 'inputs', {})
+        bytecode_dir = os.path.join(cli.DEFAULT_CACHE_DIR, 'bytecode')
+        entries = os.listdir(bytecode_dir)
+        assert len(entries) == 1
+
+        cli._template_engines.clear()
+        engine = cli.get_template_engine(self.app_dir)
+        source = engine.env.loader.get_source(engine.env, 'inputs')[0]
+        bucket = engine.env.bytecode_cache.get_bucket(
+            engine.env, 'inputs', os.path.join(self.app_dir, 'inputs'), source)
+        assert bucket.code is not None
+
+    def test_prune_cache_dir(self):
+        """Evict the least recently used entries first."""
+        cache_dir = os.path.join(self.tmpdir, 'lru')
+        os.makedirs(cache_dir)
+        for i, name in enumerate(('a', 'b', 'c')):
+            path = os.path.join(cache_dir, name)
+            with open(path, 'w') as f:
+                f.write('x' * 10)
+            os.utime(path, (1000 + i, 1000 + i))
+
+        assert cli.prune_cache_dir(cache_dir, 20) == 1
+        assert sorted(os.listdir(cache_dir)) == ['b', 'c']
+
+    def test_dependencies_zip_is_shared(self):
+        """Build tasks.zip once and link it into every sample directory."""
+        result = self.invoke_render()
+        assert result.exit_code == 0, result.output
+        project_path = os.path.join(self.work_dir, 'proj')
+        assert not [name for name in os.listdir(project_path)
+                    if name.startswith('.tasks-')]
+        inodes = set(os.stat(os.path.join(project_path, sample_id,
+                                          'tasks.zip')).st_ino
+                     for sample_id in ('S1', 'S2'))
+        assert len(inodes) == 1
+
+        # The samples never link the zip file of the store.
+        store_dir = os.path.join(cli.DEFAULT_CACHE_DIR, 'zips')
+        cached_zip = os.path.join(store_dir, os.listdir(store_dir)[0])
+        assert os.stat(cached_zip).st_ino not in inodes
+        size = os.path.getsize(cached_zip)
+        with open(os.path.join(project_path, 'S1', 'tasks.zip'), 'ab') as f:
+            f.write(b'edited')
+        assert os.path.getsize(cached_zip) == size
+
+    def test_dependencies_zip_store(self):
+        """Reuse the zip file while the tasks tree is unchanged."""
+        tasks_path = os.path.join(self.app_dir, 'tasks')
+        zip_output = cli.generate_dependencies_zip(tasks_path)
+        assert os.path.dirname(zip_output) == os.path.join(
+            cli.DEFAULT_CACHE_DIR, 'zips')
+        assert cli.generate_dependencies_zip(tasks_path) == zip_output
+
+        with open(os.path.join(tasks_path, 'call.wdl'), 'w') as f:
+            f.write('task call {}\n')
+        assert cli.generate_dependencies_zip(tasks_path) != zip_output
+
+        result = CliRunner().invoke(cli.main, [
+            'cache', 'gc', '--cache-dir', cli.DEFAULT_CACHE_DIR,
+            '--max-zip-size', '0'])
+        assert result.exit_code == 0, result.output
+        assert os.listdir(os.path.dirname(zip_output)) == []
+
+    def test_zip_dependencies_keeps_cwd(self):
+        """Zip the tasks without changing the current directory."""
+        tasks_path = os.path.join(self.app_dir, 'tasks')
+        cwd = os.getcwd()
+        check_cmd = cli.check_cmd
+        try:
+            for has_zip in (True, False):
+                cli.check_cmd = lambda command: has_zip and check_cmd(command)
+                zip_output = cli.zip_dependencies(tasks_path,
+                                                  dest_dir=self.tmpdir)
+                assert os.getcwd() == cwd
+                with zipfile.ZipFile(zip_output) as zip_file:
+                    assert 'tasks/align.wdl' in zip_file.namelist()
+                cli.cleanup_dependencies_zip(zip_output)
+        finally:
+            cli.check_cmd = check_cmd
+
+    def test_render_link_modes(self):
+        """Link the tasks directory and the defaults file into samples."""
+        project_path = os.path.join(self.work_dir, 'proj')
+        app_wdl = os.path.join(self.app_dir, 'tasks', 'align.wdl')
+
+        result = self.invoke_render('--link-mode', 'hardlink')
+        assert result.exit_code == 0, result.output
+        sample_wdl = os.path.join(project_path, 'S1', 'tasks', 'align.wdl')
+        assert os.path.samefile(sample_wdl, app_wdl)
+
+        result = self.invoke_render('--link-mode', 'symlink', '--force')
+        assert result.exit_code == 0, result.output
+        sample_tasks = os.path.join(project_path, 'S1', 'tasks')
+        assert os.path.islink(sample_tasks)
+        assert os.path.islink(os.path.join(project_path, 'S1', 'defaults'))
+
+        result = self.invoke_render('--force')
+        assert result.exit_code == 0, result.output
+        assert not os.path.islink(sample_tasks)
+        assert os.path.isfile(app_wdl)
+
+    def test_render_jobs(self):
+        """Render samples in processes and attribute errors to samples."""
+        with open(self.samples, 'w') as f:
+            f.write('sample_id,reads\nS1,s1.fq\nS2,"s2""fq"\nS3,s3.fq\n')
+
+        func = cli.functools.partial(
+            cli.render_sample, app_dir=self.app_dir,
+            project_path=os.path.join(self.work_dir, 'proj'),
+            project_name='proj')
+        results = list(cli.imap_ordered(
+            func, enumerate(cli.parse_samples(self.samples), 1), jobs=2,
+            chunksize=1))
+        assert [result.sample_id for result in results] == ['S1', 'S2', 'S3']
+        assert [result.ok for result in results] == [True, False, True]
+        assert 'Invalid JSON' in results[1].error
+
+        result = self.invoke_render('--jobs', '2', '--force')
+        assert result.exit_code == cli.RENDER_FAILED
+
+    def test_render_incremental(self):
+        """Only render the changed samples of an incremental render."""
+        result = self.invoke_render()
+        assert result.exit_code == 0, result.output
+        project_path = os.path.join(self.work_dir, 'proj')
+        s1_inputs = os.path.join(project_path, 'S1', 'inputs')
+        s2_inputs = os.path.join(project_path, 'S2', 'inputs')
+        mtimes = [os.stat(path).st_mtime_ns for path in (s1_inputs, s2_inputs)]
+
+        with open(self.samples, 'w') as f:
+            f.write('sample_id,reads\nS1,s1.fq\nS2,s2.fastq\n')
+        result = self.invoke_render('--incremental')
+        assert result.exit_code == 0, result.output
+        assert os.stat(s1_inputs).st_mtime_ns == mtimes[0]
+        assert os.stat(s2_inputs).st_mtime_ns != mtimes[1]
+        with open(s2_inputs) as f:
+            assert json.load(f)['wf.reads'] == 's2.fastq'
+
+        # A changed default changes every sample.
+        with open(os.path.join(self.app_dir, 'defaults'), 'w') as f:
+            json.dump({'genome': 'hg19'}, f)
+        result = self.invoke_render('--incremental')
+        assert result.exit_code == 0, result.output
+        with open(s1_inputs) as f:
+            assert json.load(f)['wf.genome'] == 'hg19'
+
+        # So does a changed template which is only included.
+        with open(os.path.join(self.app_dir, 'workflow.wdl'), 'w') as f:
+            f.write('{% include "part.wdl" %}')
+        with open(os.path.join(self.app_dir, 'part.wdl'), 'w') as f:
+            f.write('workflow {{ project_name }} {}\n')
+        result = self.invoke_render('--incremental')
+        assert result.exit_code == 0, result.output
+        with open(os.path.join(self.app_dir, 'part.wdl'), 'w') as f:
+            f.write('workflow changed {}\n')
+        result = self.invoke_render('--incremental')
+        assert result.exit_code == 0, result.output
+        with open(os.path.join(project_path, 'S1', 'workflow.wdl')) as f:
+            assert f.read().startswith('workflow changed {}')
+
+        # A hidden file is not a part of the app.
+        os.makedirs(os.path.join(self.app_dir, '.git'))
+        mtime = os.stat(s1_inputs).st_mtime_ns
+        result = self.invoke_render('--incremental')
+        assert result.exit_code == 0, result.output
+        assert os.stat(s1_inputs).st_mtime_ns == mtime
+
+    def test_render_preflight(self):
+        """Report all errors before any file is written."""
+        with open(self.samples, 'w') as f:
+            f.write('sample_id,read\nS1,s1.fq\n')
+        errors = cli.preflight_samples(self.app_dir, 'proj',
+                                       cli.iter_samples(self.samples))
+        assert errors == ['Row 1 (S1): reads not in samples header.']
+
+        with open(self.samples, 'w') as f:
+            f.write('sample_id,reads\nS1,s1.fq\n,s2.fq\n'
+                    'S3,"s3""fq"\nS1,s4.fq\n')
+        errors = cli.preflight_samples(self.app_dir, 'proj',
+                                       cli.iter_samples(self.samples))
+        assert errors[0] == 'Row 2: sample_id is empty.'
+        assert errors[1].startswith('Row 3 (S3): Invalid JSON')
+        assert errors[2] == 'Row 4 (S1): duplicated sample_id.'
+        assert len(errors) == 3
+
+        result = self.invoke_render('--preflight')
+        assert result.exit_code == cli.RENDER_FAILED
+        assert not os.path.exists(os.path.join(self.work_dir, 'proj'))
+
+        # The options are checked before the samples are dry-rendered.
+        result = self.invoke_render('--preflight', '--worker', '--archive',
+                                    os.path.join(self.tmpdir, 'proj.tar'))
+        assert result.exit_code == 2
+        assert 'cannot be used with' in result.output
+
+        # The samples are dry-rendered with the options of the render.
+        with open(self.samples, 'w') as f:
+            f.write('sample_id,reads\nS1,s1.fq\n')
+        dry_render_sample = cli.dry_render_sample
+        formats = []
+
+        def recording_dry_render_sample(*args, **kwargs):
+            formats.append(kwargs['inputs_format'])
+            return dry_render_sample(*args, **kwargs)
+
+        cli.dry_render_sample = recording_dry_render_sample
+        try:
+            result = self.invoke_render('--preflight',
+                                        '--inputs-format', 'canonical')
+        finally:
+            cli.dry_render_sample = dry_render_sample
+        assert result.exit_code == 0, result.output
+        assert formats == ['canonical']
+
+    def test_render_typed_samples(self):
+        """Validate typed columns before rendering any sample."""
+        with open(self.samples, 'w') as f:
+            f.write('sample_id,reads:json\nS1,"[1, 2]"\nS1,"[3]"\n')
+        result = self.invoke_render()
+        assert result.exit_code == cli.RENDER_FAILED
+        assert not os.path.exists(os.path.join(self.work_dir, 'proj'))
+
+        with open(self.samples, 'w') as f:
+            f.write('sample_id,reads:json\nS1,"[1, 2]"\nS2,"[3]"\n')
+        result = self.invoke_render()
+        assert result.exit_code == 0, result.output
+        with open(os.path.join(self.work_dir, 'proj', 'S1', 'inputs')) as f:
+            assert json.load(f)['wf.reads'] == '[1, 2]'
+
+    def test_render_only(self):
+        """Render selected samples from an index of the samples file."""
+        with open(self.samples, 'w') as f:
+            f.write('sample_id,reads,note\n')
+            f.write(''.join('S%d,s%d.fq,"multi\nline"\n' % (i, i)
+                            for i in range(50)))
+        ids_file = os.path.join(self.tmpdir, 'ids.txt')
+        with open(ids_file, 'w') as f:
+            f.write('# failed samples\nS40\n\n')
+
+        result = self.invoke_render('--only', 'S7,S3', '--only-file', ids_file)
+        assert result.exit_code == 0, result.output
+        project_path = os.path.join(self.work_dir, 'proj')
+        assert sorted(os.listdir(project_path)) == [
+            '.biominer-manifest.json', 'S3', 'S40', 'S7']
+        with open(os.path.join(project_path, 'S40', 'inputs')) as f:
+            assert json.load(f)['wf.reads'] == 's40.fq'
+
+        index = cli.SampleIndex(self.samples)
+        assert os.path.isfile(index.path) and index.load()
+        with open(index.path, 'rb') as f:
+            assert len(f.readlines()) == 51
+            assert index.lookup(f, 'S5') and not index.lookup(f, 'S51')
+        assert [sample['sample_id'] for sample in index.read(['S9', 'S1'])] \
+            == ['S1', 'S9']
+
+        result = self.invoke_render('--only', 'S1,S99', '--force')
+        assert result.exit_code == cli.RENDER_FAILED
+        assert os.path.isdir(os.path.join(project_path, 'S1'))
+
+        # A changed file is indexed again.
+        with open(self.samples, 'a') as f:
+            f.write('S50,s50.fq,\n')
+        os.utime(self.samples, (0, 0))
+        assert [sample['reads'] for sample in
+                cli.select_samples(self.samples, ['S50'])] == ['s50.fq']
+
+        lines = os.path.join(self.tmpdir, 'samples.jsonl')
+        with open(lines, 'w') as f:
+            f.write('{"sample_id": 2}\n{"sample_id": 1, "reads": "a"}\n\n'
+                    '{"sample_id": 2, "reads": "b"}\n')
+        assert list(cli.select_samples(lines, [2])) == [
+            {'sample_id': '2'}, {'sample_id': '2', 'reads': 'b'}]
+        array = os.path.join(self.tmpdir, 'samples.json')
+        with open(array, 'w') as f:
+            json.dump([{'sample_id': 'A'}, {'sample_id': 'B'}], f)
+        assert list(cli.select_samples(array, ['B'])) == [{'sample_id': 'B'}]
+
+    def test_render_shards(self):
+        """Render disjoint shards and check their summaries."""
+        with open(self.samples, 'w') as f:
+            f.write('sample_id,reads\n')
+            f.write(''.join('S%d,s%d.fq\n' % (i, i) for i in range(20)))
+        # The assignment is stable across processes and versions.
+        assert [cli.shard_of('S%d' % i, 4) for i in range(8)] == [
+            3, 2, 2, 3, 2, 0, 0, 3]
+
+        project_path = os.path.join(self.work_dir, 'proj')
+        rendered = set()
+        for index in range(3):
+            result = self.invoke_render('--shard', '%d/3' % index)
+            assert result.exit_code == 0, result.output
+            sample_dirs = set(name for name in os.listdir(project_path)
+                              if name.startswith('S'))
+            with open(os.path.join(project_path, '.shards',
+                                   '%d-of-3.json' % index)) as f:
+                summary = json.load(f)
+            assert summary['total'] == 20
+            assert summary['rendered'] == len(sample_dirs - rendered)
+            rendered = sample_dirs
+
+        assert rendered == set('S%d' % i for i in range(20))
+
+        # Every shard keeps its own manifest, they are merged on load.
+        assert len(os.listdir(project_path)) == 20 + 4
+        assert len(cli.RenderManifest(project_path).samples) == 20
+        results = list(cli.render_project(self.app_dir, self.samples,
+                                          project_path, incremental=True))
+        assert all(result.skipped for result in results)
+        # A failed sample is not brought back by the manifest of its shard.
+        manifest = cli.RenderManifest(project_path)
+        manifest.remove('S0')
+        manifest.save()
+        assert cli.RenderManifest(project_path).get('S0') is None
+
+        runner = CliRunner()
+        result = runner.invoke(cli.main, ['check-shards', project_path])
+        assert result.exit_code == 0, result.output
+        assert json.loads(result.stdout)['rendered'] == 20
+
+        os.remove(os.path.join(project_path, '.shards', '1-of-3.json'))
+        result = runner.invoke(cli.main, ['check-shards', project_path])
+        assert result.exit_code == cli.RENDER_FAILED
+        assert json.loads(result.stdout)['errors'] == [
+            '1 shards are missing: 1.']
+        assert self.invoke_render('--shard', '3/3').exit_code == 2
+
+    def test_render_worker(self):
+        """Reclaim expired leases and wait for the batches of live workers."""
+        with open(self.samples, 'w') as f:
+            f.write('sample_id,reads\n')
+            f.write(''.join('S%d,s%d.fq\n' % (i, i) for i in range(20)))
+        project_path = os.path.join(self.work_dir, 'proj')
+        queue = cli.WorkQueue(project_path, lease_ttl=1)
+        queue.join({'batch_size': 8})
+        # A dead worker left batch 0, a live worker holds batch 1 for a while.
+        for batch, age in ((0, 10), (1, 0)):
+            lease = os.path.join(queue.path, '%d.lease' % batch)
+            with open(lease, 'w') as f:
+                f.write('{}')
+            os.utime(lease, (time.time() - age, time.time() - age))
+
+        results = list(cli.render_worker(
+            self.app_dir, lambda: cli.iter_samples(self.samples), project_path,
+            queue, project_name='proj', batch_size=8, poll_interval=0.1,
+            force=True))
+        assert sorted(result.sample_id for result in results) == \
+            sorted('S%d' % i for i in range(20))
+        assert queue.summary() == {'batches': 3, 'samples': 20, 'failed': []}
+        assert not [name for name in os.listdir(queue.path)
+                    if name.endswith('.lease') or name.endswith('.reclaim')]
+
+        # A batch which is completed meanwhile is not leased again.
+        class RacingQueue(cli.WorkQueue):
+            def _create(self, path, data):
+                created = super()._create(path, data)
+                if path == self._file(9, 'lease'):
+                    self._write(self._file(9, 'done'), {})
+                return created
+
+        queue = RacingQueue(project_path)
+        queue.set_run(0)
+        assert not queue.claim(9)
+        assert not os.path.exists(queue._file(9, 'lease'))
+
+        # A worker whose lease is reclaimed mid-batch never removes the
+        # lease of the new owner, nor overwrites its done record.
+        first = cli.WorkQueue(project_path, lease_ttl=1, worker_id='first')
+        second = cli.WorkQueue(project_path, lease_ttl=1, worker_id='second')
+        third = cli.WorkQueue(project_path, lease_ttl=1, worker_id='third')
+        for queue in (first, second, third):
+            queue.set_run(0)
+        lease = first._file(5, 'lease')
+        assert first.claim(5)
+        os.utime(lease, (time.time() - 10, time.time() - 10))
+        assert second.claim(5)
+        first.renew()
+        assert 5 not in first._held
+        assert second._owner(lease) == 'second'
+        first.complete(5, 8, ['S1'])
+        assert second._owner(lease) == 'second'
+        assert not third.claim(5) and third._owner(lease) == 'second'
+        second.complete(5, 8, [])
+        assert not os.path.exists(lease)
+        assert first._owner(first._file(5, 'done')) == 'first'
+        assert not [name for name in os.listdir(first.path)
+                    if name.endswith('.release')]
+
+    def test_render_workers(self):
+        """Render a project with workers in parallel processes."""
+        with open(self.samples, 'w') as f:
+            f.write('sample_id,reads\n')
+            f.write(''.join('S%d,s%d.fq\n' % (i, i) for i in range(20)))
+        package_dir = os.path.dirname(os.path.dirname(cli.__file__))
+        env = dict(os.environ, BIOMINER_CACHE_DIR=cli.DEFAULT_CACHE_DIR,
+                   PYTHONPATH=package_dir)
+        command = [sys.executable, '-m', 'biominer_app_util.cli', 'render',
+                   'demo', self.samples, '-b', self.base_dir,
+                   '-w', self.work_dir, '-p', 'proj', '--worker',
+                   '--batch-size', '3']
+        workers = [subprocess.Popen(command, env=env, stderr=subprocess.PIPE)
+                   for _ in range(2)]
+        for worker in workers:
+            assert worker.wait() == 0, worker.stderr.read()
+            worker.stderr.close()
+
+        project_path = os.path.join(self.work_dir, 'proj')
+        assert len([name for name in os.listdir(project_path)
+                    if name.startswith('S')]) == 20
+        queue = cli.WorkQueue(project_path)
+        assert queue.get_runs() == [0]
+        queue.set_run(0)
+        assert queue.summary() == {'batches': 7, 'samples': 20, 'failed': []}
+
+        # A render which is done does not count for a new one.
+        with open(os.path.join(self.app_dir, 'defaults'), 'w') as f:
+            json.dump({'genome': 'mm10'}, f)
+        result = self.invoke_render('--worker', '--batch-size', '3')
+        assert result.exit_code == 0, result.output
+        assert queue.get_runs() == [0, 1]
+        with open(os.path.join(project_path, 'S1', 'inputs')) as f:
+            assert json.load(f)['wf.genome'] == 'mm10'
+
+        # Another render is refused while one is queued.
+        queue.join({'batch_size': 4})
+        queue.set_total(1)
+        result = self.invoke_render('--worker', '--batch-size', '3')
+        assert result.exit_code == 2
+
+    def test_render_archive(self):
+        """Render a project into an archive, tar stores shared files once."""
+        archive = os.path.join(self.tmpdir, 'proj.tar.gz')
+        result = self.invoke_render('--archive', archive)
+        assert result.exit_code == 0, result.output
+        assert not os.path.exists(os.path.join(self.work_dir, 'proj'))
+        with tarfile.open(archive) as tar:
+            members = dict((member.name, member) for member in tar)
+            assert members['proj/S1/tasks.zip'].isfile()
+            assert members['proj/S2/tasks.zip'].islnk()
+            assert members['proj/S2/tasks/align.wdl'].linkname == \
+                'proj/S1/tasks/align.wdl'
+            inputs = json.load(tar.extractfile('proj/S2/inputs'))
+            assert inputs['wf.reads'] == 's2.fq'
+
+        archive = os.path.join(self.tmpdir, 'proj.zip')
+        result = self.invoke_render('--archive', archive)
+        assert result.exit_code == 0, result.output
+        with zipfile.ZipFile(archive) as zip_file:
+            # Every zip entry holds the bytes, no link entry.
+            assert zip_file.read('proj/S2/defaults') == \
+                zip_file.read('proj/S1/defaults')
+            assert zipfile.is_zipfile(io.BytesIO(
+                zip_file.read('proj/S2/tasks.zip')))
+            inputs = json.loads(zip_file.read('proj/S1/inputs'))
+            assert inputs['wf.sample_id'] == 'S1'
+
+        result = self.invoke_render('--archive', '-')
+        assert result.exit_code == 0, result.output
+        with tarfile.open(fileobj=io.BytesIO(result.stdout_bytes)) as tar:
+            assert 'proj/S2/workflow.wdl' in tar.getnames()
+
+        # zstandard is an optional dependency, the zstd extra.
+        archive = os.path.join(self.tmpdir, 'proj.tar.zst')
+        result = self.invoke_render('--archive', archive)
+        try:
+            import zstandard
+        except ImportError:
+            assert result.exit_code == 2
+            assert not os.path.exists(archive)
+            with self.assertRaises(ImportError) as context:
+                cli.ProjectArchive(io.BytesIO(), archive_format='tar.zst')
+            assert 'biominer_app_util[zstd]' in str(context.exception)
+        else:
+            assert result.exit_code == 0, result.output
+            with open(archive, 'rb') as f:
+                reader = zstandard.ZstdDecompressor().stream_reader(f)
+                with tarfile.open(fileobj=reader, mode='r|') as tar:
+                    assert 'proj/S2/workflow.wdl' in tar.getnames()
+
+    def test_invariant_workflow(self):
+        """Render a project-invariant workflow.wdl once and share it."""
+        engine = cli.get_template_engine(self.app_dir)
+        assert engine.is_invariant('workflow.wdl', {'sample_id', 'reads'})
+        assert not engine.is_invariant('inputs', {'sample_id', 'reads'})
+
+        result = self.invoke_render('--link-mode', 'hardlink')
+        assert result.exit_code == 0, result.output
+        project_path = os.path.join(self.work_dir, 'proj')
+        workflow_path = os.path.join(project_path, 'S1', 'workflow.wdl')
+        assert os.path.samefile(
+            workflow_path, os.path.join(project_path, 'S2', 'workflow.wdl'))
+        with open(os.path.join(project_path, 'S2', 'workflow.wdl')) as f:
+            assert 'workflow proj {' in f.read()
+
+        # The sample which wrote the shared file is rendered again.
+        result = self.invoke_render('--link-mode', 'hardlink', '--force')
+        assert result.exit_code == 0, result.output
+        assert os.path.samefile(
+            workflow_path, os.path.join(project_path, 'S2', 'workflow.wdl'))
+
+        # The same project in another directory never shares the file.
+        other_path = os.path.join(self.tmpdir, 'other', 'proj')
+        results = list(cli.render_project(self.app_dir, self.samples,
+                                          other_path, link_mode='hardlink'))
+        assert all(result.ok for result in results)
+        assert not os.path.samefile(
+            workflow_path, os.path.join(other_path, 'S1', 'workflow.wdl'))
+
+    def test_integer_sample_ids(self):
+        """Render the samples of typed and parquet files with integer ids."""
+        with open(self.samples, 'w') as f:
+            f.write('sample_id:int,reads\n1,s1.fq\n2,s2.fq\n')
+        result = self.invoke_render('--only', '2')
+        assert result.exit_code == 0, result.output
+        assert os.listdir(os.path.join(self.work_dir, 'proj', '2'))
+        result = self.invoke_render('--force')
+        assert result.exit_code == 0, result.output
+        with open(os.path.join(self.work_dir, 'proj', '1', 'inputs')) as f:
+            assert json.load(f)['wf.sample_id'] == '1'
+
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet
+        except ImportError:
+            self.skipTest('pyarrow is not installed.')
+        self.samples = os.path.join(self.tmpdir, 'samples.parquet')
+        pyarrow.parquet.write_table(pa.table({'sample_id': [3, 4],
+                                              'reads': ['a', 'b']}),
+                                    self.samples)
+        result = self.invoke_render()
+        assert result.exit_code == 0, result.output
+        with open(os.path.join(self.work_dir, 'proj', '4', 'inputs')) as f:
+            assert json.load(f)['wf.sample_id'] == '4'
+
+    def test_invariant_include(self):
+        """Render a workflow.wdl which includes sample variables per sample."""
+        with open(os.path.join(self.app_dir, 'workflow.wdl'), 'w') as f:
+            f.write('workflow {{ project_name }} {}\n{% include "part.wdl" %}')
+        with open(os.path.join(self.app_dir, 'part.wdl'), 'w') as f:
+            f.write('# sample {{ sample_id }}\n')
+        engine = cli.get_template_engine(self.app_dir)
+        assert not engine.is_invariant('workflow.wdl', {'sample_id', 'reads'})
+
+        result = self.invoke_render()
+        assert result.exit_code == 0, result.output
+        for sample_id in ('S1', 'S2'):
+            with open(os.path.join(self.work_dir, 'proj', sample_id,
+                                   'workflow.wdl')) as f:
+                assert '# sample %s' % sample_id in f.read()
+
+    def test_specialized_template(self):
+        """Render the same output from a partially evaluated template."""
+        with open(os.path.join(self.app_dir, 'inputs'), 'w') as f:
+            f.write('{\n{% for key, value in options.items() %}'
+                    '  "wf.{{ key }}": {{ value|tojson }},\n{% endfor %}'
+                    '  "wf.name": "{{ project_name }}-{{ sample_id }}",\n'
+                    '  "wf.genome": "{{ genome|upper }}"\n}\n')
+        constants = {'options': {'threads': 4, 'mem': '8G'},
+                     'genome': 'hg38', 'project_name': 'proj'}
+        engine = cli.get_template_engine(self.app_dir)
+        residual = engine.get_specialized('inputs', constants, {'sample_id'},
+                                          'run')
+        assert engine.get_specialized('inputs', constants, {'sample_id'},
+                                      'run') is residual
+
+        data = dict(constants, sample_id='S1')
+        assert residual.render(**data) == engine.render('inputs', data)
+        assert json.loads(residual.render(**data))['wf.genome'] == 'HG38'
+
+        # A variable from the sample is never evaluated.
+        residual = engine.get_specialized('inputs', constants,
+                                          {'sample_id', 'genome'}, 'run')
+        data['genome'] = 'mm10'
+        assert json.loads(residual.render(**data))['wf.genome'] == 'MM10'
+
+    def test_app_defaults(self):
+        """Parse defaults once and overlay them without copying the sample."""
+        defaults = cli.get_app_defaults(self.app_dir)
+        assert defaults == {'genome': 'hg38'}
+        assert cli.get_app_defaults(self.app_dir + '/') is defaults
+
+        sample = {'sample_id': 'S1', 'reads': 'a'}
+        inputs, _ = cli.render_templates(self.app_dir, 'proj', sample)
+        assert json.loads(inputs)['wf.genome'] == 'hg38'
+        assert sample == {'sample_id': 'S1', 'reads': 'a'}
+        inputs, _ = cli.render_templates(self.app_dir, 'proj',
+                                         dict(sample, genome='mm10'))
+        assert json.loads(inputs)['wf.genome'] == 'mm10'
+
+        defaults_file = os.path.join(self.app_dir, 'defaults')
+        with open(defaults_file, 'w') as f:
+            json.dump({'genome': 'hg19'}, f)
+        os.utime(defaults_file, (0, 0))
+        assert cli.get_app_defaults(self.app_dir) == {'genome': 'hg19'}
+        os.remove(defaults_file)
+        assert cli.get_app_defaults(self.app_dir) == {}
+
+    def test_render_project(self):
+        """Render from the library API without exiting."""
+        project_path = os.path.join(self.work_dir, 'lib')
+        samples = [{'sample_id': 'S1', 'reads': 's1.fq'}, {'reads': 'none.fq'}]
+        results = list(cli.render_project(self.app_dir, samples, project_path))
+        assert [result.ok for result in results] == [True, False]
+        assert results[0].elapsed > 0
+        assert 'sample_id' in str(results[1].exception)
+        with open(os.path.join(project_path, 'S1', 'workflow.wdl')) as f:
+            assert 'workflow lib {' in f.read()
+
+        results = list(cli.render_project(self.app_dir, self.samples,
+                                          project_path, incremental=True))
+        assert [result.skipped for result in results] == [True, False]
+        results = list(cli.render_project(self.app_dir, self.samples,
+                                          project_path, incremental=True))
+        assert [result.skipped for result in results] == [True, True]
+
+        archive = io.BytesIO()
+        results = list(cli.render_project(self.app_dir, samples, archive,
+                                          project_name='lib',
+                                          archive_format='zip'))
+        assert [result.ok for result in results] == [True, False]
+        with zipfile.ZipFile(archive) as zip_file:
+            assert 'lib/S1/inputs' in zip_file.namelist()
+
+    def test_render_pipeline(self):
+        """Overlap writing files with rendering, keep the order of samples."""
+        with open(self.samples, 'w') as f:
+            f.write('sample_id,reads\n')
+            f.write(''.join('S%d,s%d.fq\n' % (i, i) for i in range(20)))
+            f.write(',no-sample-id.fq\n')
+        result = self.invoke_render('--in-flight', '4')
+        assert result.exit_code == cli.RENDER_FAILED, result.output
+        with open(os.path.join(self.work_dir, 'proj', 'S7', 'inputs')) as f:
+            assert json.load(f)['wf.reads'] == 's7.fq'
+
+        project_path = os.path.join(self.work_dir, 'pipeline')
+        results = list(cli.render_project(self.app_dir, self.samples,
+                                          project_path, in_flight=3,
+                                          incremental=True))
+        assert [result.row for result in results] == list(range(1, 22))
+        assert [result.ok for result in results] == [True] * 20 + [False]
+        results = list(cli.render_project(self.app_dir, self.samples,
+                                          project_path, in_flight=3,
+                                          incremental=True))
+        assert all(result.skipped for result in results[:20])
+
+        def samples():
+            yield {'sample_id': 'S1'}
+            raise ValueError('broken samples')
+
+        with self.assertRaises(ValueError):
+            list(cli.render_project(self.app_dir, samples(), project_path,
+                                    force=True, in_flight=2))
+
+        results = cli.render_project(self.app_dir, self.samples, project_path,
+                                     force=True, in_flight=2)
+        assert next(results).ok
+        results.close()
+
+    def test_profile_stages(self):
+        """Report the stages of a render, also from processes and threads."""
+        assert cli.stage('render') is cli._null_stage
+        report_path = os.path.join(self.tmpdir, 'stages.json')
+        result = self.invoke_render('--jobs', '2',
+                                    '--profile-stages', report_path)
+        assert result.exit_code == 0, result.output
+        with open(report_path) as f:
+            report = json.load(f)
+        assert report['samples'] == 2
+        stages = {row['stage']: row for row in report['stages']}
+        assert [row['stage'] for row in report['stages']] == [
+            'parse', 'defaults', 'render', 'check_json', 'write', 'copy',
+            'zip']
+        assert stages['render']['calls'] == 4
+        assert stages['render']['samples'] == 2
+        assert stages['render']['p50'] <= stages['render']['max']
+        assert stages['write']['bytes'] > 0
+        # Only the first render builds the dependencies zip file.
+        assert stages['zip']['bytes'] > 0
+
+        report_path = os.path.join(self.tmpdir, 'stages.csv')
+        result = self.invoke_render('--force', '--in-flight', '2',
+                                    '--profile-stages', report_path)
+        assert result.exit_code == 0, result.output
+        with open(report_path, newline='') as f:
+            rows = {row['stage']: row for row in csv.DictReader(f)}
+        assert int(rows['write']['samples']) == 2
+        # The zip file of the store is only copied into the project, once.
+        assert int(rows['zip']['bytes']) == os.path.getsize(
+            os.path.join(self.work_dir, 'proj', 'S1', 'tasks.zip'))
+
+        profiler = cli.StageProfiler()
+        results = list(cli.render_project(self.app_dir, self.samples,
+                                          io.BytesIO(), project_name='lib',
+                                          archive_format='tar',
+                                          profiler=profiler))
+        assert all(result.stages['archive'][2] > 0 for result in results)
+        assert 'archive' in [row['stage'] for row in profiler.report()]
+
+    def test_trace_memory(self):
+        """Report the peak memory and the top allocation sites of stages."""
+        report_path = os.path.join(self.tmpdir, 'memory.json')
+        result = CliRunner().invoke(cli.main, [
+            '--trace-memory', report_path, 'render', 'demo', self.samples,
+            '-b', self.base_dir, '-w', self.work_dir, '-p', 'proj'])
+        assert result.exit_code == 0, result.output
+        assert cli._memory_tracer is None
+        assert not tracemalloc.is_tracing()
+        with open(report_path) as f:
+            report = json.load(f)
+        stages = {entry['stage']: entry for entry in report['stages']}
+        assert ['parse', 'defaults', 'render', 'check_json', 'write', 'copy',
+                'zip'] == [entry['stage'] for entry in report['stages']]
+        assert stages['render']['calls'] == 4
+        assert 0 < stages['render']['peak'] <= report['peak']
+        assert stages['render']['top'] and report['top']['sites']
+        assert all(site['size'] > 0 for site in stages['render']['top'])
+
+        app_zip = os.path.join(self.tmpdir, 'zipped.zip')
+        with zipfile.ZipFile(app_zip, 'w') as zip_file:
+            for name in ('inputs', 'workflow.wdl',
+                         os.path.join('tasks', 'align.wdl')):
+                zip_file.write(os.path.join(self.app_dir, name),
+                               os.path.join('zipped', name))
+        result = CliRunner().invoke(cli.main, [
+            '--trace-memory', report_path, 'install', app_zip,
+            '-b', self.base_dir, '-u', 'user', '-p', 'password'])
+        assert result.exit_code == 0, result.output
+        with open(report_path) as f:
+            report = json.load(f)
+        assert [entry['stage'] for entry in report['stages']] == ['extract']
+
+    def test_serve(self):
+        """Answer requests of the client over a Unix socket."""
+        socket_path = os.path.join(self.tmpdir, 'serve.sock')
+        server = serve.RenderServer(socket_path, base_dir=self.base_dir,
+                                    work_dir=self.work_dir)
+        assert server.warm_up() == ['demo']
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        try:
+            with client.Client(socket_path, timeout=10) as conn:
+                assert conn.request('ping')['ok']
+                assert conn.request('list')['apps'] == ['demo']
+                sample = {'sample_id': 'S1', 'reads': 'a'}
+                response = conn.request('render', app_name='demo',
+                                        project_name='proj', dry_run=True,
+                                        samples=[sample])
+                outputs = response['results'][0]['outputs']
+                assert json.loads(outputs['inputs'])['wf.reads'] == 'a'
+                assert 'workflow proj {' in outputs['workflow.wdl']
+
+                response = conn.request('render', app_name='demo',
+                                        project_name='proj',
+                                        samples=self.samples)
+                assert response['ok'], response
+                assert os.path.isfile(os.path.join(self.work_dir, 'proj', 'S2',
+                                                   'inputs'))
+
+                response = conn.request('validate', app_name='demo',
+                                        project_name='proj',
+                                        samples=[{'reads': 'a'}])
+                assert not response['ok'] and response['errors']
+                assert not conn.request('render', app_name='../demo',
+                                        project_name='proj', samples=[])['ok']
+                assert 'Unknown command' in conn.request('nothing')['error']
+            assert client.request('ping', socket_path=socket_path)['ok']
+        finally:
+            server.shutdown()
+            server.server_close()
+            thread.join()
+        assert not os.path.exists(socket_path)
+
+        # The other commands never import the server.
+        output = subprocess.check_output([
+            sys.executable, '-c', 'import sys; import biominer_app_util.cli; '
+            'print(sorted({"socketserver", "asyncio", "tracemalloc", '
+            '"tarfile"} & set(sys.modules)))'])
+        assert output.strip() == b'[]'
+
+
+class TestSamples(unittest.TestCase):
+    """Tests for reading samples files."""
+
+    def setUp(self):
+        """Set up a temporary directory."""
+        self.tmpdir = tempfile.mkdtemp()
+        self.samples = [{'sample_id': 'S%d' % i, 'reads': [i, i + 0.5]}
+                        for i in range(50)]
+
+    def tearDown(self):
+        """Remove the temporary directory."""
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, filename, content):
+        path = os.path.join(self.tmpdir, filename)
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+
+    def test_json_formats(self):
+        """Stream JSON arrays, JSON Lines and single objects."""
+        array = self.write('samples.json', json.dumps(self.samples, indent=2))
+        lines = self.write('samples', '\n'.join(json.dumps(sample)
+                                                for sample in self.samples))
+        single = self.write('sample.json', json.dumps(self.samples[0]))
+        assert cli.detect_samples_format(array) == 'json'
+        assert cli.detect_samples_format(lines) == 'jsonl'
+        assert cli.parse_samples(array) == self.samples
+        assert cli.parse_samples(lines) == self.samples
+        assert cli.parse_samples(single) == self.samples[:1]
+        # A sample_id names a directory, an integer one is read as str.
+        lines = self.write('ids.jsonl', '{"sample_id": 7}\n')
+        assert cli.parse_samples(lines) == [{'sample_id': '7'}]
+
+        with open(array) as f:
+            assert list(cli.iter_json_values(f, array=True, bufsize=7)) \
+                == self.samples
+
+    def test_delimited_formats(self):
+        """Detect CSV and TSV files from their header."""
+        csv_path = self.write('samples.txt', 'sample_id,reads\nS1,a\tb\n')
+        tsv_path = self.write('samples', 'sample_id\treads\nS1\ta,b\n')
+        assert cli.parse_samples(csv_path) == [
+            {'sample_id': 'S1', 'reads': 'a\tb'}]
+        assert cli.parse_samples(tsv_path) == [
+            {'sample_id': 'S1', 'reads': 'a,b'}]
+
+    def test_sample_table(self):
+        """Keep rows compact and present them as mappings."""
+        path = self.write('samples.csv',
+                          'sample_id,reads,genome\nS1,a\nS2,b,mm10\n')
+        table = cli.parse_samples(path)
+        assert isinstance(table, cli.SampleTable) and len(table) == 2
+        row = table[0]
+        assert row._index is table[1]._index
+        assert row == {'sample_id': 'S1', 'reads': 'a', 'genome': None}
+        assert row.get('genome', 'hg38') is None
+        assert row.get('missing', 'x') == 'x' and 'reads' in row
+        assert pickle.loads(pickle.dumps(row)) == row
+        with self.assertRaises(AttributeError):
+            row.extra = 1
+
+        table = cli.SampleTable(self.samples)
+        assert table == self.samples and table[3]['reads'] == [3, 3.5]
+        assert len(set(id(row._index) for row in table)) == 1
+
+        path = self.write('bad.csv', 'sample_id,reads\nS1,a,b\n')
+        with self.assertRaises(ValueError):
+            list(cli.iter_samples(path, is_terminal=False))
+
+    def test_typed_columns(self):
+        """Convert and validate the columns of a typed TSV file."""
+        path = self.write('samples.tsv',
+                          'sample_id\tthreads:int\treads:json\tpaired:bool\n'
+                          'S1\t4\t["a", "b"]\tyes\nS2\t\t[]\tno\n')
+        columns = cli.read_sample_columns(path)
+        assert columns.validate(required=['reads']) == []
+        assert list(columns) == [
+            {'sample_id': 'S1', 'threads': 4, 'reads': ['a', 'b'],
+             'paired': True},
+            {'sample_id': 'S2', 'threads': None, 'reads': [], 'paired': False}]
+        assert cli.parse_samples(path)[0]['threads'] == 4
+
+        path = self.write('bad.tsv', 'sample_id\tthreads:int\n'
+                          'S1\t4\nS1\tfour\n\t2\n')
+        columns = cli.read_sample_columns(path)
+        assert columns.validate(required=['genome']) == [
+            'genome not in samples header.',
+            "Row 2 (S1): 'four' is not a valid int for threads.",
+            'Row 2 (S1): duplicated sample_id.',
+            'Row 3: sample_id is empty.']
+        with self.assertRaises(ValueError):
+            list(columns)
+
+        path = self.write('ids.tsv', 'sample_id:int\tthreads:int\n007\t4\n')
+        columns = cli.read_sample_columns(path)
+        assert columns.validate() == []
+        assert list(columns) == [{'sample_id': '007', 'threads': 4}]
+
+        path = self.write('a.tsv', 'sample_id\tx\n')
+        assert cli.read_sample_columns(path) is None
+
+    def test_arrow_columns(self):
+        """Read Parquet and Feather files and validate them with pyarrow."""
+        try:
+            import pyarrow as pa
+            import pyarrow.feather
+            import pyarrow.parquet
+        except ImportError:
+            self.skipTest('pyarrow is not installed.')
+
+        table = pa.table({'sample_id': ['S1', 'S2', 'S1', None],
+                          'threads': [4, 8, 4, 1],
+                          'reads': [['a'], [], ['b'], ['c']]})
+        parquet_path = os.path.join(self.tmpdir, 'samples')
+        pyarrow.parquet.write_table(table.slice(0, 2), parquet_path)
+        feather_path = os.path.join(self.tmpdir, 'samples.feather')
+        pyarrow.feather.write_feather(table, feather_path)
+
+        assert cli.detect_samples_format(parquet_path) == 'parquet'
+        assert cli.parse_samples(parquet_path) == [
+            {'sample_id': 'S1', 'threads': 4, 'reads': ['a']},
+            {'sample_id': 'S2', 'threads': 8, 'reads': []}]
+        assert cli.read_sample_columns(parquet_path).validate() == []
+        assert cli.read_sample_columns(feather_path).validate() == [
+            'Row 3 (S1): duplicated sample_id.', 'Row 4: sample_id is empty.']
+
+        ids_path = os.path.join(self.tmpdir, 'ids.parquet')
+        pyarrow.parquet.write_table(pa.table({'sample_id': [1, 2, None]}),
+                                    ids_path)
+        columns = cli.read_sample_columns(ids_path)
+        assert columns.validate() == ['Row 3: sample_id is empty.']
+        assert list(columns)[:2] == [{'sample_id': '1'}, {'sample_id': '2'}]
+        pyarrow.parquet.write_table(pa.table({'sample_id': [1.5]}), ids_path)
+        assert cli.read_sample_columns(ids_path).validate() == [
+            'sample_id must be strings, not double.']
+
+
+class TestInputs(unittest.TestCase):
+    """Tests for validating rendered inputs."""
+
+    def test_load_inputs(self):
+        """Parse inputs once and write them in the chosen format."""
+        inputs = '{"wf.b": [1, 2],\n "wf.a": "x"}'
+        assert cli.load_inputs(inputs) is inputs
+        assert cli.load_inputs(inputs, inputs_format='minified') == \
+            '{"wf.b":[1,2],"wf.a":"x"}'
+        assert cli.load_inputs(inputs, inputs_format='canonical') == \
+            '{\n  "wf.a": "x",\n  "wf.b": [\n    1,\n    2\n  ]\n}'
+        # Accepted by json even if a fast backend rejects it.
+        assert cli.load_inputs('{"wf.a": NaN}') == '{"wf.a": NaN}'
+        assert cli.load_inputs('{"wf.a": NaN}', inputs_format='canonical') == \
+            '{\n  "wf.a": NaN\n}'
+        # The same output with every backend.
+        json_backend = cli._json_backend
+        try:
+            for name in ('orjson', 'json'):
+                cli._json_backend = cli.get_json_backend(name)
+                assert cli.load_inputs('{"wf.a": 1e16}',
+                                       inputs_format='minified') == \
+                    '{"wf.a":1e+16}'
+        finally:
+            cli._json_backend = json_backend
+
+        with self.assertRaises(cli.InValidJSON) as context:
+            cli.load_inputs('{"wf.a": 1,\n "wf.b": }', is_terminal=False)
+        assert 'line 2 column 10' in str(context.exception)
+
+    def test_json_backends(self):
+        """Fall back to json when a backend is not installed."""
+        assert cli.get_json_backend('json').name == 'json'
+        assert cli.get_json_backend('not-installed').name == 'json'
+        assert cli.get_json_backend() is cli.get_json_backend()